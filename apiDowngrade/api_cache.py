@@ -0,0 +1,187 @@
+"""
+SQLite-backed cache of libraries.io projects (apiDowngrade/api_cache.sqlite), compacted to the
+fields the pipeline reads:
+
+    history(package PRIMARY KEY, status, numbers, times)
+        numbers  version strings joined by \\x1f, in libraries.io order
+        times    published_at of each version, int64 epoch milliseconds (array('q') bytes)
+    payloads(package PRIMARY KEY, payload)
+        the full libraries.io response, only written with keep_raw=True
+    failures(package PRIMARY KEY, error, attempts)
+        packages the last fetch gave up on ("not found" is permanent, anything else is retried)
+
+get() returns a Project(status, numbers, times): parallel tuples of interned version strings and
+epoch seconds, so a package costs a few hundred bytes in memory instead of its whole response.
+A miss is one row insert (WAL journal). The first open imports an existing
+apiDowngrade/api_cache.json; export_json() writes the cache back out in that layout:
+
+    python apiDowngrade/api_cache.py --export [apiDowngrade/api_cache.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+from array import array
+from collections import namedtuple
+
+DB_PATH = "apiDowngrade/api_cache.sqlite"
+JSON_PATH = "apiDowngrade/api_cache.json"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+SEPARATOR = "\x1f"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    package TEXT PRIMARY KEY,
+    status TEXT,
+    numbers TEXT NOT NULL,
+    times BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS payloads (package TEXT PRIMARY KEY, payload TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS failures (package TEXT PRIMARY KEY, error TEXT, attempts INTEGER NOT NULL DEFAULT 1);
+"""
+
+Project = namedtuple("Project", ["status", "numbers", "times"])
+
+
+def to_millis(published_at):
+    dt = datetime.datetime.strptime(published_at, TIMESTAMP_FORMAT).replace(tzinfo=datetime.timezone.utc)
+    return round(dt.timestamp() * 1000)
+
+
+def from_millis(ms):
+    dt = datetime.datetime.fromtimestamp(ms / 1000, datetime.timezone.utc)
+    return dt.strftime(TIMESTAMP_FORMAT)[:-4] + "Z"
+
+
+def compact_row(api, meta):
+    """libraries.io response -> history row; versions without a publication date are dropped"""
+    versions = [v for v in meta.get("versions", []) if v.get("published_at")]
+    times = array("q", (to_millis(v["published_at"]) for v in versions))
+    return api, meta.get("status"), SEPARATOR.join(v["number"] for v in versions), times.tobytes()
+
+
+def row_to_project(status, numbers, times):
+    millis = array("q")
+    millis.frombytes(times)
+    return Project(
+        status,
+        tuple(sys.intern(n) for n in numbers.split(SEPARATOR)) if numbers else (),
+        tuple(ms / 1000 for ms in millis),
+    )
+
+
+class ApiCache:
+    """Dict-like view of the cache: `api in cache`, cache.get(api), cache.put(api, meta)"""
+
+    def __init__(self, path=DB_PATH, legacy_json=JSON_PATH, keep_raw=False):
+        fresh = not os.path.exists(path)
+        self.keep_raw = keep_raw
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.migrate_projects()
+        if fresh and legacy_json and os.path.exists(legacy_json):
+            self.import_json(legacy_json)
+
+    def migrate_projects(self):
+        """Compact the full-payload `projects` table of earlier caches"""
+        if not self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'projects'").fetchone():
+            return
+        with self.conn:
+            for api, payload in self.conn.execute("SELECT package, payload FROM projects").fetchall():
+                self._insert(api, json.loads(payload), payload)
+            self.conn.execute("DROP TABLE projects")
+        self.conn.execute("VACUUM")
+
+    def _insert(self, api, meta, payload=None):
+        self.conn.execute("INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?)", compact_row(api, meta))
+        if self.keep_raw:
+            self.conn.execute("INSERT OR REPLACE INTO payloads VALUES (?, ?)",
+                              (api, payload or json.dumps(meta, ensure_ascii=False)))
+
+    def import_json(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            projects = json.load(f)
+        with self.conn:
+            for api, meta in projects.items():
+                self._insert(api, meta)
+        print(f"Imported {len(projects)} projects from {path}")
+
+    def __contains__(self, api):
+        return self.conn.execute("SELECT 1 FROM history WHERE package = ?", (api,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT count(*) FROM history").fetchone()[0]
+
+    def get(self, api):
+        row = self.conn.execute("SELECT status, numbers, times FROM history WHERE package = ?", (api,)).fetchone()
+        return row_to_project(*row) if row else None
+
+    def put(self, api, meta):
+        """Store a libraries.io response and return its compact Project"""
+        with self.conn:
+            self._insert(api, meta)
+            self.conn.execute("DELETE FROM failures WHERE package = ?", (api,))
+        return self.get(api)
+
+    def record_failure(self, api, error):
+        with self.conn:
+            self.conn.execute("INSERT INTO failures VALUES (?, ?, 1) ON CONFLICT(package) "
+                              "DO UPDATE SET error = excluded.error, attempts = attempts + 1", (api, error))
+
+    def failures(self):
+        """{package: error} of the packages that could not be fetched"""
+        return dict(self.conn.execute("SELECT package, error FROM failures"))
+
+    def packages(self):
+        return {row[0] for row in self.conn.execute("SELECT package FROM history")}
+
+    def export_json(self, path=JSON_PATH):
+        """
+        Stream the cache into the api_cache.json layout (json.dump(..., indent=2)); packages without
+        a raw payload are written as {"status", "versions": [{"number", "published_at"}]}
+        """
+        tmp = path + ".tmp"
+        rows = self.conn.execute(
+            "SELECT h.package, h.status, h.numbers, h.times, p.payload FROM history h "
+            "LEFT JOIN payloads p ON p.package = h.package ORDER BY h.rowid"
+        )
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("{")
+            first = True
+            for api, status, numbers, times, payload in rows:
+                if payload is not None:
+                    meta = json.loads(payload)
+                else:
+                    project = row_to_project(status, numbers, times)
+                    meta = {"status": status, "versions": [
+                        {"number": n, "published_at": from_millis(round(t * 1000))}
+                        for n, t in zip(project.numbers, project.times)
+                    ]}
+                body = json.dumps(meta, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+                f.write(("" if first else ",") + f"\n  {json.dumps(api, ensure_ascii=False)}: {body}")
+                first = False
+            f.write("}" if first else "\n}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Inspect or export the libraries.io project cache")
+    arg_parser.add_argument("--db", default=DB_PATH)
+    arg_parser.add_argument("--keep-raw", action="store_true", help="also keep the full responses of imported projects")
+    arg_parser.add_argument("--export", nargs="?", const=JSON_PATH, help=f"write the json layout (default {JSON_PATH})")
+    cli = arg_parser.parse_args()
+
+    cache = ApiCache(cli.db, keep_raw=cli.keep_raw)
+    print(f"{cli.db}: {len(cache)} projects")
+    if cli.export:
+        cache.export_json(cli.export)
+        print(f"Exported to {cli.export}")
@@ -0,0 +1,103 @@
+"""
+Benchmark of the libraries.io fetcher against the local stand-in (apiDowngrade/mock_librariesio.py).
+
+    python apiDowngrade/bench_fetcher.py [--cache apiDowngrade/api_cache.sqlite | --synthetic 500]
+        [--keys 4] [--per-minute 60] [--concurrency 8] [--latency 0.2] [--p429 0.05] [--ptimeout 0.01]
+
+Reports fetched packages per second, requests per second, requests per key, retries and the
+status mix seen by the server. Every run appends one line to apiDowngrade/bench_fetcher.tsv so
+rate limiting changes can be compared offline.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from apiDowngrade import librariesio_fetch
+from apiDowngrade.librariesio_fetch import KeyPool, fetch_projects, CONCURRENCY
+from apiDowngrade.mock_librariesio import MockState, load_payloads, start_server
+from apiDowngrade.api_cache import DB_PATH
+
+history_path = "apiDowngrade/bench_fetcher.tsv"
+
+
+def synthetic_payloads(n, seed=0):
+    rng = random.Random(seed)
+    payloads = {}
+    for i in range(n):
+        versions = [{"number": f"{j}.0.0", "published_at": f"20{10 + j:02d}-01-01T00:00:00.000Z"}
+                    for j in range(rng.randint(1, 12))]
+        payloads[f"package{i}"] = {"name": f"package{i}", "status": None, "versions": versions}
+    return payloads
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the libraries.io fetcher against a local stand-in")
+    parser.add_argument("--cache", default=DB_PATH, help="recorded payloads (api_cache.sqlite or api_cache.json)")
+    parser.add_argument("--synthetic", type=int, default=None, help="serve N generated packages instead of the cache")
+    parser.add_argument("--packages", type=int, default=None, help="only fetch the first N packages")
+    parser.add_argument("--missing", type=int, default=0, help="also request N unknown packages (404)")
+    parser.add_argument("--keys", type=int, default=4)
+    parser.add_argument("--per-minute", type=int, default=60, help="per-key limit of both the server and the client")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--p429", type=float, default=0.0)
+    parser.add_argument("--p500", type=float, default=0.0)
+    parser.add_argument("--ptimeout", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=2.0, help="client timeout; hung requests are held twice as long")
+    parser.add_argument("--backoff-base", type=float, default=librariesio_fetch.BACKOFF_BASE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    payloads = synthetic_payloads(args.synthetic, args.seed) if args.synthetic else load_payloads(args.cache)
+    packages = sorted(payloads)[:args.packages] + [f"missing-package-{i}" for i in range(args.missing)]
+    if not packages:
+        raise SystemExit("Nothing to fetch")
+
+    state = MockState(payloads, args.latency, args.jitter, args.per_minute, args.p429, args.p500,
+                      args.ptimeout, hang=args.timeout * 2, seed=args.seed)
+    server, base_url = start_server(state)
+    librariesio_fetch.BACKOFF_BASE = args.backoff_base
+
+    errors = Counter()
+    start = time.perf_counter()
+    results = fetch_projects(packages, KeyPool([f"bench-key-{i}" for i in range(args.keys)], args.per_minute),
+                             concurrency=args.concurrency, base_url=base_url, timeout=args.timeout,
+                             on_result=lambda api, meta, error: errors.update([error or "ok"]))
+    elapsed = time.perf_counter() - start
+    stats = state.stats()
+    server.shutdown()
+
+    fetched = sum(1 for meta, _ in results.values() if meta is not None)
+    row = {
+        "packages": len(packages),
+        "fetched": fetched,
+        "elapsed_s": elapsed,
+        "packages_per_s": len(packages) / elapsed,
+        "requests_per_s": stats["requests"] / elapsed,
+        "requests": stats["requests"],
+        "retries": stats["requests"] - len(packages),
+        "retried_packages": stats["retried_packages"],
+    }
+    print(f"{row['packages']} packages ({fetched} fetched) in {elapsed:.2f} s | {row['packages_per_s']:.2f} packages/s "
+          f"| {row['requests_per_s']:.2f} requests/s | {row['retries']} retries over {row['retried_packages']} packages")
+    print(f"requests per key: {json.dumps(dict(sorted(stats['by_key'].items())))}")
+    print(f"server statuses: {json.dumps(stats['by_status'])}")
+    print(f"client outcomes: {json.dumps(dict(errors))}")
+
+    new_file = not os.path.exists(history_path)
+    with open(history_path, "a", encoding="utf-8") as f:
+        if new_file:
+            f.write("timestamp\tpackages\tfetched\tkeys\tper_minute\tconcurrency\tlatency\tp429\tp500\tptimeout\t"
+                    "elapsed_s\tpackages_per_s\trequests_per_s\tretries\n")
+        stamp = datetime.datetime.now().isoformat(timespec="seconds")
+        f.write(f"{stamp}\t{row['packages']}\t{fetched}\t{args.keys}\t{args.per_minute}\t{args.concurrency}\t"
+                f"{args.latency}\t{args.p429}\t{args.p500}\t{args.ptimeout}\t{elapsed:.3f}\t"
+                f"{row['packages_per_s']:.3f}\t{row['requests_per_s']:.3f}\t{row['retries']}\n")
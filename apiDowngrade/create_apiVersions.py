@@ -1,171 +1,165 @@
-import requests
-import json
+"""
+Pin every API of every eligible kernel to the latest release before its submission date.
+
+Two phases:
+    prefetch  fetch every unique API of the eligible kernels that is not cached yet, concurrently;
+              each project is committed to apiDowngrade/api_cache.sqlite as it arrives, so an
+              interrupted prefetch resumes where it stopped
+    resolve   offline: write apiDowngrade/apiDowngradeList/{competition_fileName}.txt for every
+              kernel from the cache, in parallel; re-run it alone when the pinning policy changes
+
+    python apiDowngrade/create_apiVersions.py [prefetch|resolve|all] [--workers N] [--retry-failed]
+"""
+import argparse
 import datetime
 from pathlib import Path
-import time
-from collections import deque
-import itertools
+from multiprocessing import Pool
 from tqdm import tqdm
+import json
 import os
-import re
-
-CACHE_PATH = "apiDowngrade/api_cache.json"
-try:
-    with open(CACHE_PATH, "r", encoding="utf-8") as f:
-        api_cache = json.load(f)
-except Exception:
-    api_cache = {}
-    
-with open("/home/b27jin/config.json", "r") as f:
-    config = json.load(f)
-
-api_keys = [config["pypi5"], config["pypi6"], config["pypi7"], config["pypi8"]]
-rate_windows = {key: deque(maxlen=60) for key in api_keys}
-key_cycle = itertools.cycle(api_keys)
-
-def acquire_key():
-    """Get an API key that hasn't exceeded rate limit"""
-    for _ in range(len(api_keys)):
-        key = next(key_cycle)
-        window = rate_windows[key]
-        now = time.time()
-        # If this key has made 60 calls in the last 60 seconds, skip it
-        if len(window) == 60 and now - window[0] < 60:
-            continue  # Try next key
-        return key
-
-    # All keys are rate limited, wait for the oldest call to expire
-    saturated = [window for window in rate_windows.values() if len(window) == 60]
-    if not saturated:
-        time.sleep(0.1)
-        return acquire_key()
-
-    oldest_call = min(w[0] for w in saturated)
-    wait_for = max(0, 60 - (time.time() - oldest_call) + 1)
-    time.sleep(wait_for)
-    return acquire_key()
-
-with open("kernel.json", "r", encoding="utf-8") as f:
-    kernel_content = json.load(f)
-
-session = requests.Session()
-base_url = "https://libraries.io/api/pypi/{pkg}"
-
-def record_call(key):
-    rate_windows[key].append(time.time())
-
-def save_api_cache():
-    tmp = CACHE_PATH + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(api_cache, f, ensure_ascii=False, indent=2)
-        f.flush()
-        os.fsync(f.fileno())
-    os.replace(tmp, CACHE_PATH)
-
-def get_api_meta_cached(api: str, compt: str, fname: str) -> dict:
-    """Return api_meta from cache if present; otherwise fetch, cache, and return."""
-    if api in api_cache:
-        return api_cache[api]
-    
-    url = base_url.format(pkg=api)
-    for attempt in range(3):
-        current_key = acquire_key()
-        try:
-            resp = session.get(url, params={"api_key": current_key, "per_page": 100}, timeout=25)
-            record_call(current_key)
-            
-            if resp.status_code == 429:
-                time.sleep(1)
-                continue
-
-            resp.raise_for_status()
-            meta = resp.json()
-            api_cache[api] = meta
-            save_api_cache()
-            return meta
-        
-        except requests.exceptions.HTTPError as e:
-            if hasattr(e.response, 'status_code') and e.response.status_code == 429:
-                time.sleep(1)
-                continue
-            if attempt == 2:
-                print(f"HTTP error for {api}: {compt}/{fname} - {e}")
-                with open("apiDowngrade/apiMatch_timeout.txt", "a", encoding="utf-8") as json_file:
-                    json_file.write(f"{compt}/{fname} | timeout\n")
-                return None
-        except requests.exceptions.Timeout:
-            if attempt == 2:
-                with open("apiDowngrade/apiMatch_timeout.txt", "a", encoding="utf-8") as json_file:
-                    json_file.write(f"{compt}/{fname} | timeout\n")
-                return None
-        except Exception as e:
-            if attempt == 2:
-                print(f"Fetch fail {api}: {compt}/{fname} due to {e}")
-                with open("apiDowngrade/apiMatch_timeout.txt", "a", encoding="utf-8") as json_file:
-                    json_file.write(f"{compt}/{fname} | timeout\n")
-                api_meta = None
-                return None
-    return None
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from corpus.kernel_store import eligible_kernels
+from apiDowngrade.release_timeline import ReleaseIndex, parse_timestamp
+from apiDowngrade.librariesio_fetch import KeyPool, fetch_projects, CONCURRENCY
+from apiDowngrade.api_cache import ApiCache
+
+CONFIG_PATH = "/home/b27jin/config.json"
+REQ_DIR = "apiDowngrade/apiDowngradeList"
+NOT_FOUND = "not found"
+
+def load_key_pool():
+    with open(CONFIG_PATH, "r") as f:
+        config = json.load(f)
+    api_keys = [config["pypi5"], config["pypi6"], config["pypi7"], config["pypi8"]]
+    return KeyPool(api_keys)
+
+def append_lines(path, lines):
+    if lines:
+        with open(path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+def prefetch(concurrency=CONCURRENCY, retry_failed=False):
+    """Fetch every unique API of the eligible kernels missing from the cache"""
+    api_cache = ApiCache()
+    apis = {api for script_meta in eligible_kernels() for api in script_meta.get("api") or []}
+    failures = api_cache.failures()
+    missing = sorted(api for api in apis - api_cache.packages()
+                     if retry_failed or failures.get(api) != NOT_FOUND)
+    print(f"{len(apis)} unique APIs, {len(missing)} to fetch")
+
+    failed = 0
+    def on_result(api, meta, error):
+        nonlocal failed
+        progress.update(1)
+        # Every result is committed right away: the cache is the checkpoint
+        if meta is None:
+            failed += 1
+            api_cache.record_failure(api, error)
+            print(f"Fetch fail {api}: {error}")
+        else:
+            api_cache.put(api, meta)
+
+    if missing:
+        with tqdm(total=len(missing), desc="Prefetching APIs") as progress:
+            fetch_projects(missing, load_key_pool(), concurrency=concurrency, on_result=on_result)
+    print(f"Fetched {len(missing) - failed}, failed {failed} (rerun prefetch to retry transient failures)")
+
+    # Keep apiDowngrade/api_cache.json for the scripts that read the json layout
+    api_cache.export_json()
+    api_cache.close()
+
+# Per worker process: its own cache connection, release index and the failed fetches
+api_cache = None
+release_index = None
+fetch_failures = {}
+
+def init_worker(failures):
+    global api_cache, release_index, fetch_failures
+    api_cache = ApiCache(legacy_json=None)
+    release_index = ReleaseIndex(load=api_cache.get)
+    fetch_failures = failures
+
+def resolve_kernel(script_meta):
+    """
+    Pin the APIs of one kernel from the cache and write its requirement file.
+    Returns (compt, fname, log lines by file, APIs without cached metadata). A package libraries.io
+    does not know is left out; any other missing metadata blocks the kernel (no file), so it
+    cannot silently lose a package.
+    """
+    compt, fname = script_meta['competition'], script_meta['fname']
+    submission_ts = parse_timestamp(script_meta["datetime"])
+    submission_day = script_meta["datetime"][:10]
+
+    logs = {"apiDowngrade/apiMatch_oldest.txt": [], "apiDowngrade/apiMatch_notFound.txt": []}
+    missing = []
+    results_per_file = ""
+    for api in script_meta.get("api") or []:
+        api_meta = api_cache.get(api)
+        if api_meta is None:
+            if fetch_failures.get(api) == NOT_FOUND:
+                logs["apiDowngrade/apiMatch_notFound.txt"].append(f"{compt}_{fname} | {api} | not on libraries.io\n")
+            else:
+                missing.append(api)
+            continue
+        if api_meta.status == "Removed":
+            continue
+
+        # Latest release before the submission, and the oldest release overall (pre-releases skipped)
+        closest = release_index.latest_before(api, submission_ts)
+        oldest = release_index.oldest(api)
+
+        if closest:
+            results_per_file += f"{api}=={closest[0]}\n"
+        elif oldest:
+            # No version <= submission_date, use oldest version
+            results_per_file += f"{api}=={oldest[0]}\n"
+            oldest_day = datetime.datetime.fromtimestamp(oldest[1], datetime.timezone.utc).date()
+            logs["apiDowngrade/apiMatch_oldest.txt"].append(
+                f"{compt}_{fname} | {api}=={oldest[0]} | oldest {oldest_day} >= submission {submission_day}\n")
+        else:
+            # No versions at all
+            logs["apiDowngrade/apiMatch_notFound.txt"].append(f"{compt}_{fname} | {api} | no version available\n")
+
+    if not missing:
+        with open(f"{REQ_DIR}/{compt}_{fname.split('.html')[0]}.txt", "w", encoding="utf-8") as f:
+            f.writelines(results_per_file)
+    return compt, fname, logs, missing
+
+def resolve(workers=os.cpu_count(), chunksize=64):
+    """Offline: write the requirement file of every eligible kernel from the cache"""
+    api_cache = ApiCache(legacy_json=None)
+    failures = api_cache.failures()
+    api_cache.close()
+    kernels = [{k: meta[k] for k in ("competition", "fname", "datetime", "api")} for meta in eligible_kernels()]
+
+    logs = {}
+    unresolved = []
+    with Pool(processes=workers, initializer=init_worker, initargs=(failures,)) as pool:
+        for compt, fname, kernel_logs, missing in tqdm(
+            pool.imap_unordered(resolve_kernel, kernels, chunksize=chunksize), total=len(kernels), desc="Resolving"
+        ):
+            for path, lines in kernel_logs.items():
+                logs.setdefault(path, []).extend(lines)
+            if missing:
+                unresolved.append(f"{compt}/{fname} | missing metadata: {', '.join(missing)}\n")
+
+    for path, lines in logs.items():
+        append_lines(path, sorted(lines))
+    append_lines("apiDowngrade/apiMatch_timeout.txt", sorted(unresolved))
+    print(f"Resolved {len(kernels) - len(unresolved)} kernels; {len(unresolved)} kernels wait for missing "
+          f"metadata (see apiDowngrade/apiMatch_timeout.txt, rerun prefetch)")
 
 if __name__ == "__main__":
-
-    for compt, files in tqdm(kernel_content.items(), total=len(kernel_content),
-        desc="Competitions",
-        position=0):
-        for fname, script_meta in tqdm(files.items(), total=len(files),
-            desc=f"submissions to {compt}",
-            leave=False,
-            position=1):
-            if "ps" in script_meta and script_meta['runtime'] <= 600 and len(script_meta['datasets'])<=1 and "R" not in script_meta:
-
-                submission_date = datetime.datetime.strptime(script_meta["datetime"], "%Y-%m-%dT%H:%M:%S.%fZ")
-                
-                apis = script_meta.get("api") or []
-                # print(apis)
-
-                results_per_file = ""
-                for api in apis:
-                    api_meta = get_api_meta_cached(api, compt, fname)
-                    
-                    closest_v = None
-                    closest_dt = None
-                    if api_meta and api_meta.get("status") != "Removed":
-                        versions = api_meta.get("versions", [])
-                        oldest_v = None
-                        oldest_dt = None
-
-                        for version in versions:
-                            # Skip pre-releases (e.g., 1.12.1rc1, 2.0.0b1)
-                            # Matches if version contains letters indicating pre-release
-                            if re.search(r'[a-zA-Z]', version['number']) and len(versions) > 1:
-                                continue
-
-                            pub_date = datetime.datetime.strptime(version['published_at'], '%Y-%m-%dT%H:%M:%S.%fZ') #'2008-04-25T16:22:32.000Z',
-
-                            # Track oldest version overall
-                            if oldest_dt is None or pub_date < oldest_dt:
-                                oldest_dt = pub_date
-                                oldest_v = version['number']
-
-                            if pub_date < submission_date:
-                                if closest_dt is None or pub_date > closest_dt:
-                                    closest_dt = pub_date
-                                    closest_v = version['number']
-                        
-                        if closest_dt:
-                            # print(f"{compt}_{fname} | {api} | {closest_v} | {closest_dt.date()} <= {submission_date.date()}")
-                            results_per_file += f"{api}=={closest_v}\n"
-                        elif oldest_v:
-                            # No version <= submission_date, use oldest version
-                            # print(f"{compt}_{fname} | {api} | no version <= submission_date, using oldest: {oldest_v}")
-                            results_per_file += f"{api}=={oldest_v}\n"
-                            with open("apiDowngrade/apiMatch_oldest.txt", "a", encoding="utf-8") as json_file:
-                                    json_file.write(f"{compt}_{fname} | {api}=={oldest_v} | oldest {oldest_dt.date()} >= submission {submission_date.date()}\n")
-                        else:
-                            # No versions at all
-                            print(f"{compt}_{fname} | {api}")
-                            with open("apiDowngrade/apiMatch_notFound.txt", "a", encoding="utf-8") as json_file:
-                                    json_file.write(f"{compt}_{fname} | {api} | no version available\n")
-                    
-                with open(f"apiDowngrade/apiDowngradeList/{compt}_{fname.split('.')[0]}.txt", "w", encoding="utf-8") as f:
-                    f.writelines(results_per_file)
+    arg_parser = argparse.ArgumentParser(description="Pin the APIs of every eligible kernel by submission date")
+    arg_parser.add_argument("phase", nargs="?", choices=["prefetch", "resolve", "all"], default="all")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="resolve worker processes")
+    arg_parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="requests in flight during prefetch")
+    arg_parser.add_argument("--retry-failed", action="store_true", help="also refetch packages libraries.io did not find")
+    cli = arg_parser.parse_args()
+
+    if cli.phase in ("prefetch", "all"):
+        prefetch(cli.concurrency, cli.retry_failed)
+    if cli.phase in ("resolve", "all"):
+        resolve(cli.workers)
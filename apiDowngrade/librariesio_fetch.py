@@ -0,0 +1,197 @@
+"""
+Concurrent libraries.io project fetcher.
+
+Requests run on a small thread pool driven by asyncio (requests stays the HTTP client), with
+  - one token bucket per API key (libraries.io allows 60 requests per minute per key); a request
+    takes a token from the key that has one soonest (the fullest on ties), so every key is used
+    at its full rate and evenly
+  - at most `concurrency` requests in flight
+  - retries with exponential backoff and full jitter on 429 / 5xx / timeouts; a 429 also empties
+    the bucket of its key for Retry-After seconds
+
+    key_pool = KeyPool(api_keys)
+    fetch_projects(["numpy", "pandas"], key_pool, on_result=lambda api, meta, error: ...)
+
+With keyless=True no libraries.io query parameters are sent and the pool only paces the requests
+(its "keys" are just bucket names), e.g. for the PyPI JSON API of apiDowngrade/wheel_preflight.py.
+
+    python apiDowngrade/librariesio_fetch.py numpy pandas      # fetch into apiDowngrade/api_cache.sqlite
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from apiDowngrade.api_cache import ApiCache
+
+BASE_URL = "https://libraries.io/api/pypi/{pkg}"
+REQUESTS_PER_MINUTE = 60
+CONCURRENCY = 8
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0   # seconds
+BACKOFF_CAP = 60.0
+TIMEOUT = 25
+
+_local = threading.local()
+
+
+class TokenBucket:
+    """rate tokens per second, at most capacity stored"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """No tokens for the next `seconds` (the server told us to back off)"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class KeyPool:
+    """Token bucket per API key; acquire() waits for whichever key has a token first"""
+
+    def __init__(self, keys, per_minute=REQUESTS_PER_MINUTE):
+        self.buckets = {key: TokenBucket(per_minute / 60, per_minute) for key in keys}
+
+    async def acquire(self):
+        # No await between checking and taking a token, so no lock is needed within one event loop
+        while True:
+            now = time.monotonic()
+            # soonest token first, then the fullest bucket, so the keys are used evenly
+            key = min(self.buckets, key=lambda k: (self.buckets[k].delay(now), -self.buckets[k].tokens))
+            wait = self.buckets[key].delay(now)
+            if wait <= 0:
+                self.buckets[key].take()
+                return key
+            await asyncio.sleep(wait)
+
+    def pause(self, key, seconds):
+        self.buckets[key].pause(seconds)
+
+
+def _session():
+    """requests.Session is not thread safe, so each pool thread keeps its own"""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def _get(url, params, timeout):
+    return _session().get(url, params=params, timeout=timeout)
+
+
+def backoff(attempt):
+    """Full jitter: uniform in [0, min(cap, base * 2^attempt)]"""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_after(resp):
+    try:
+        return float(resp.headers.get("Retry-After", ""))
+    except ValueError:
+        return BACKOFF_BASE
+
+
+async def fetch_project(package, key_pool, semaphore, executor, base_url=BASE_URL, timeout=TIMEOUT, keyless=False):
+    """Return (package, project dict or None, error or None)"""
+    loop = asyncio.get_running_loop()
+    url = base_url.format(pkg=package)
+    error = None
+    for attempt in range(MAX_ATTEMPTS):
+        key = await key_pool.acquire()
+        wait = 0.0
+        try:
+            async with semaphore:
+                params = None if keyless else {"api_key": key, "per_page": 100}
+                resp = await loop.run_in_executor(executor, _get, url, params, timeout)
+        except requests.exceptions.Timeout:
+            error = "timeout"
+        except requests.exceptions.RequestException as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            if resp.status_code == 200:
+                try:
+                    return package, resp.json(), None
+                except ValueError:
+                    error = "invalid json"
+            elif resp.status_code == 404:
+                return package, None, "not found"
+            elif resp.status_code == 429:
+                wait = retry_after(resp)
+                key_pool.pause(key, wait)
+                error = "rate limited"
+            elif resp.status_code >= 500:
+                error = f"HTTP {resp.status_code}"
+            else:
+                return package, None, f"HTTP {resp.status_code}"
+        if attempt < MAX_ATTEMPTS - 1:
+            await asyncio.sleep(max(wait, backoff(attempt)))
+    return package, None, error
+
+
+async def fetch_all(packages, key_pool, concurrency=CONCURRENCY, on_result=None, base_url=BASE_URL, timeout=TIMEOUT,
+                    keyless=False):
+    """
+    Fetch every package and return {package: (meta, error)}; on_result(package, meta, error) is
+    called as each one finishes
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = [asyncio.ensure_future(fetch_project(p, key_pool, semaphore, executor, base_url, timeout, keyless))
+                   for p in packages]
+        for future in asyncio.as_completed(pending):
+            package, meta, error = await future
+            results[package] = (meta, error)
+            if on_result:
+                on_result(package, meta, error)
+    return results
+
+
+def fetch_projects(packages, key_pool, **kwargs):
+    """Blocking wrapper around fetch_all"""
+    return asyncio.run(fetch_all(list(packages), key_pool, **kwargs))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Fetch libraries.io projects into the api cache")
+    arg_parser.add_argument("packages", nargs="+")
+    arg_parser.add_argument("--config", default="/home/b27jin/config.json", help="json with the pypi5..pypi8 keys")
+    arg_parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    cli = arg_parser.parse_args()
+
+    with open(cli.config, "r") as f:
+        config = json.load(f)
+    cache = ApiCache()
+
+    def report(package, meta, error):
+        if meta is not None:
+            cache.put(package, meta)
+        print(f"{package}: {'ok' if meta is not None else error}")
+
+    pool = KeyPool([config["pypi5"], config["pypi6"], config["pypi7"], config["pypi8"]])
+    fetch_projects([p for p in cli.packages if p not in cache], pool, concurrency=cli.concurrency, on_result=report)
@@ -0,0 +1,182 @@
+"""
+Local stand-in for the libraries.io project endpoint, for testing and benchmarking the fetcher
+without API keys or network access.
+
+GET /api/pypi/{package}?api_key=...  serves the recorded payload from the api cache
+(api_cache.json, or api_cache.sqlite in its compact form) and 404 for unknown packages.
+Faults can be injected:
+    --latency / --jitter   seconds added to every response
+    --per-minute           per-key limit enforced like libraries.io (429 + Retry-After)
+    --p429 / --p500        probability of a spurious 429 / 500
+    --ptimeout             probability of holding the request for --hang seconds (client timeout)
+GET /_stats returns the request counts per key and per status.
+
+    python apiDowngrade/mock_librariesio.py --port 8765 --latency 0.2 --p429 0.05
+    # then point the fetcher at it: fetch_projects(..., base_url="http://127.0.0.1:8765/api/pypi/{pkg}")
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlparse
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from apiDowngrade.api_cache import ApiCache, DB_PATH, from_millis
+
+PREFIX = "/api/pypi/"
+
+
+def load_payloads(path):
+    """{package: payload} from api_cache.json, or rebuilt from the compact api_cache.sqlite"""
+    if path.endswith(".sqlite"):
+        cache = ApiCache(path, legacy_json=None)
+        payloads = {}
+        for api in cache.packages():
+            project = cache.get(api)
+            payloads[api] = {"name": api, "status": project.status, "versions": [
+                {"number": n, "published_at": from_millis(round(t * 1000))}
+                for n, t in zip(project.numbers, project.times)
+            ]}
+        cache.close()
+        return payloads
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class MockState:
+    def __init__(self, payloads, latency=0.0, jitter=0.0, per_minute=None, p429=0.0, p500=0.0,
+                 ptimeout=0.0, hang=30.0, seed=None):
+        self.payloads = payloads
+        self.latency = latency
+        self.jitter = jitter
+        self.per_minute = per_minute
+        self.p429 = p429
+        self.p500 = p500
+        self.ptimeout = ptimeout
+        self.hang = hang
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.windows = {}
+        self.by_key = Counter()
+        self.by_status = Counter()
+        self.by_package = Counter()
+
+    def decide(self, key):
+        """Status to answer with (None: serve normally) and the Retry-After for a 429"""
+        with self.lock:
+            self.by_key[key] += 1
+            now = time.monotonic()
+            if self.per_minute:
+                window = self.windows.setdefault(key, deque())
+                while window and now - window[0] >= 60:
+                    window.popleft()
+                if len(window) >= self.per_minute:
+                    return 429, 60 - (now - window[0])
+                window.append(now)
+            roll = self.random.random()
+            if roll < self.p429:
+                return 429, 1.0
+            if roll < self.p429 + self.p500:
+                return 500, None
+            if roll < self.p429 + self.p500 + self.ptimeout:
+                return "hang", None
+            return None, None
+
+    def count(self, package, status):
+        with self.lock:
+            self.by_package[package] += 1
+            self.by_status[status] += 1
+
+    def stats(self):
+        with self.lock:
+            return {"by_key": dict(self.by_key), "by_status": {str(k): v for k, v in self.by_status.items()},
+                    "requests": sum(self.by_key.values()),
+                    "retried_packages": sum(1 for n in self.by_package.values() if n > 1)}
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                # the client gave up first (timeouts)
+                pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/_stats":
+                return self.send_json(200, state.stats())
+            if not url.path.startswith(PREFIX):
+                return self.send_json(404, {"error": "unknown endpoint"})
+            package = unquote(url.path[len(PREFIX):])
+            key = parse_qs(url.query).get("api_key", [""])[0]
+
+            status, retry_after = state.decide(key)
+            if state.latency or state.jitter:
+                time.sleep(state.latency + state.random.uniform(0, state.jitter))
+            if status == "hang":
+                state.count(package, "hang")
+                time.sleep(state.hang)
+                return self.send_json(504, {"error": "timeout"})
+            if status == 429:
+                state.count(package, 429)
+                return self.send_json(429, {"error": "rate limited"}, {"Retry-After": f"{retry_after:.1f}"})
+            if status == 500:
+                state.count(package, 500)
+                return self.send_json(500, {"error": "server error"})
+            payload = state.payloads.get(package)
+            if payload is None:
+                state.count(package, 404)
+                return self.send_json(404, {"error": "not found"})
+            state.count(package, 200)
+            return self.send_json(200, payload)
+
+    return Handler
+
+
+def start_server(state, host="127.0.0.1", port=0):
+    """Serve in a background thread; returns (server, base_url for the fetcher)"""
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{PREFIX}{{pkg}}"
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Local libraries.io stand-in serving recorded payloads")
+    arg_parser.add_argument("--cache", default=DB_PATH, help="api_cache.sqlite or api_cache.json")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--latency", type=float, default=0.0)
+    arg_parser.add_argument("--jitter", type=float, default=0.0)
+    arg_parser.add_argument("--per-minute", type=int, default=None)
+    arg_parser.add_argument("--p429", type=float, default=0.0)
+    arg_parser.add_argument("--p500", type=float, default=0.0)
+    arg_parser.add_argument("--ptimeout", type=float, default=0.0)
+    arg_parser.add_argument("--hang", type=float, default=30.0)
+    cli = arg_parser.parse_args()
+
+    state = MockState(load_payloads(cli.cache), cli.latency, cli.jitter, cli.per_minute, cli.p429, cli.p500,
+                      cli.ptimeout, cli.hang)
+    server, base_url = start_server(state, cli.host, cli.port)
+    print(f"Serving {len(state.payloads)} projects at {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
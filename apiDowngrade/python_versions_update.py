@@ -1,180 +1,77 @@
 import json
-import datetime
 from tqdm import tqdm
 from collections import Counter
-from nbformat.v4 import new_notebook, new_code_cell
 import os
-import re
-import html
+import sys
+from pathlib import Path
 
-parent = '/home/b27jin/mle-bench-internal/fetch/competitions'
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from corpus.notebook_cache import load_notebook
+from corpus.kernel_store import eligible_kernels, update_python, export_json
+from corpus.py_syntax import parse_minor, format_minor
+from apiDowngrade.release_timeline import ReleaseIndex, ReleaseTimeline, parse_timestamp
 
-with open("kernel.json", "r", encoding="utf-8") as f:
-    kernel_content = json.load(f)
+parent = '/home/b27jin/mle-bench-internal/fetch/competitions'
 
 with open("apiDowngrade/python_versions.json", "r", encoding="utf-8") as f:
     python_versions = json.load(f)
 
-def read_html_content(file_path, nb=None):
-    """Read the content of an HTML file and append code cells to notebook if provided"""
-
-    with open(file_path, "r", encoding="utf-8") as file:
-        content = file.read()
+# One timeline per detected major (None: py2/py3 vote was inconclusive, search every version)
+# and one per minor, for kernels whose syntax rules out the minor picked by date
+python_index = ReleaseIndex(timelines={
+    prefix: ReleaseTimeline.from_python_versions(python_versions, prefix)
+    for prefix in ["2", "3", None] + sorted({".".join(v.split(".")[:2]) for v in python_versions})
+})
 
-        # Find all code blocks with highlight hl-ipython3 class
-        highlight_blocks = re.findall(r'<div class="highlight hl-ipython3">(.*?)</div>', content, re.DOTALL)
-        
-        # Process all input areas as before for backward compatibility
-        input_areas = re.findall(r'<div class="input_area">(.*?)</div>', content, re.DOTALL)
-        input_areas = "".join(input_areas) if input_areas else ""
-        input_areas = re.sub(r' *<pre>', '<pre>', input_areas)
-        
-        # If notebook object provided, add each code block as a cell
-        if nb is not None:
-            # nb.cells.append(new_code_cell('%pip install Unidecode monai ttach optuna optuna-integration'))
-            nb.cells.append(new_code_cell('import pandas as pd\nfrom pathlib import Path'))
-            for block in highlight_blocks:
-                # Extract code from the highlight block
-                code_match = re.search(r'<pre>(.*?)</pre>', block, re.DOTALL)
-                if code_match:
-                    # Clean up the code
-                    code_text = html.unescape(code_match.group(1))
-                    raw_code = assemble_code_regex(code_text)
-                    # code = inspect.cleandoc(raw_code)
-                    nb.cells.append(new_code_cell(raw_code))
-        
-        return nb
-    
-def assemble_code_regex(html_snippet: str) -> str:
+def fit_syntax(best, syntax, submission_ts):
     """
-    Uses a regular expression to remove HTML tags from the snippet and unescapes HTML entities.
+    Move the version picked by date into the (oldest, newest) minor range the syntax allows:
+    the latest release of the nearest allowed minor before the submission, else its first release
     """
-    # Unescape any HTML entities (if present)
-    code = html.unescape(html_snippet)
-    # Remove all HTML tags using regex
-    code = re.sub(r'</?[a-zA-Z][^>]*>', '', code)
-
-    return code
-
-def classify_notebook(nb):
-    """
-    Robustly discern if the code is written in python 2 syntax or python 3.
-    Returns '2', '3', or 'unknown'.
-    """
-    py2_hits = 0
-    py3_hits = 0
-
-    # Regex patterns for Python 2 specific syntax
-    py2_patterns = [
-        r'(^|[^a-zA-Z0-9_])print\s+["\']',      # print "string" (no parentheses)
-        r'(^|[^a-zA-Z0-9_])print\s+[\w]+',      # print var (no parentheses)
-        r'\bxrange\b',                          # xrange vs range
-        r'\braw_input\b',                       # raw_input vs input
-        r'\bunicode\b',                         # unicode type
-        r'\blong\b',                            # long type
-        r'\bbasestring\b',                      # basestring type
-        r'\.iteritems\(',                       # dict.iteritems()
-        r'except\s+\w+\s*,\s*\w+',              # except Exception, e
-        r'from\s+__future__\s+import\s+division', # __future__ imports common in Py2
-    ]
-    # Regex patterns for Python 3 specific syntax
-    py3_patterns = [
-        r'\bprint\s*\(',                        # print "string" with parentheses
-        r'\bf["\']',                            # f-strings (Py 3.6+)
-        r'\basync\s+def\b',                     # async/await (Py 3.5+)
-        r'\bawait\b',
-        r'\bnonlocal\b',                        # nonlocal keyword
-        r'\btyping\b',                          # typing module
-        r'\)\s*->\s*[A-Za-z_]',                 # function return annotations
-        r'\byield\s+from\b',                    # yield from (Py 3.3+)
-    ]
-    for cell in nb.cells:
-        if cell.get('cell_type') == 'code':
-            src = ''.join(cell.get('source', ''))
-            if not src.strip():
-                continue
-
-            for p in py2_patterns:
-                if re.search(p, src):
-                    py2_hits += 1
-            for p in py3_patterns:
-                if re.search(p, src):
-                    py3_hits += 1
-
-    if py2_hits == 0 and py3_hits == 0:
-        return 'unknown'
-    if py2_hits > py3_hits:
-        return '2'
-    if py3_hits >= py2_hits: # Default to 3 if tied, as it's more likely for recent files from the distribution
-        return '3'
-    return 'unknown'
-
-# Convert python_versions to datetime objects for comparison
-python_versions_dt = {
-    version: datetime.datetime.strptime(date, "%Y-%m-%d")
-    for version, date in python_versions.items()
-}
+    if best is None or syntax is None:
+        return best
+    minor = parse_minor(best[0])
+    target = min(max(minor, parse_minor(syntax[0])), parse_minor(syntax[1]))
+    if target == minor:
+        return best
+    prefix = format_minor(target)
+    return python_index.latest_before(prefix, submission_ts) or python_index.oldest(prefix) or best
 
 if __name__ == "__main__":
     updated_count = 0
     no_match_count = 0
     python_version_counts = Counter()
 
-    for compt, files in tqdm(
-            kernel_content.items(),
-            total=len(kernel_content),
-            desc="Competitions",
-            position=0):
-            for fname, script_meta in tqdm(
-                files.items(),
-                total=len(files),
-                desc=f"Processing {compt}",
-                leave=False,
-                position=1
-            ):
-                if "ps" in script_meta and script_meta['runtime'] <= 600 and len(script_meta['datasets'])<=1 and "R" not in script_meta:
-                    # Extract dependencies
-                    path = os.path.join(parent, compt, 'html', fname)
-                    # Create notebook first
-                    nb = new_notebook()
-                    # Pass notebook to read_html_content to add cells directly
-                    nb = read_html_content(path, nb)
-                    detected_major = classify_notebook(nb)
-
-                    # Restrict search space by detected major if known
-                    if detected_major == '2':
-                        candidate = {v: d for v, d in python_versions_dt.items() if v.startswith('2.')}
-                    elif detected_major == '3':
-                        candidate = {v: d for v, d in python_versions_dt.items() if v.startswith('3.')}
-                    else:
-                        candidate = python_versions_dt
-
-                    submission_date = datetime.datetime.strptime(script_meta["datetime"], "%Y-%m-%dT%H:%M:%S.%fZ")
-
-                    # Find the most recent Python version released before submission_date
-                    best_version = None
-                    best_date = None
-                    
-                    for version, release_date in candidate.items():
-                        if release_date < submission_date:
-                            if best_date is None or release_date > best_date:
-                                best_date = release_date
-                                best_version = version
-                    
-                    if best_version:
-                        script_meta["python"] = best_version
-                        script_meta["detected_major"] = detected_major
-                        python_version_counts[best_version] += 1
-                        updated_count += 1
-                    else:
-                        no_match_count += 1
-                        script_meta["detected_major"] = detected_major
-                        print(f"No Python version found for {compt}/{fname} (submission: {submission_date.date()})")
-                    
+    updates = []
+    for script_meta in tqdm(eligible_kernels(), desc="Eligible scripts"):
+        compt, fname = script_meta['competition'], script_meta['fname']
+        # Extract dependencies
+        path = os.path.join(parent, compt, 'html', fname)
+        # The syntax range and py2/py3 major are computed once when the page is parsed
+        notebook = load_notebook(path)
+        detected_major, syntax = notebook['detected_major'], notebook['syntax']
+
+        # Restrict search space by detected major if known
+        major = detected_major if detected_major in ('2', '3') else None
+
+        submission_ts = parse_timestamp(script_meta["datetime"])
+
+        # Find the most recent Python version released before the submission
+        best = fit_syntax(python_index.latest_before(major, submission_ts), syntax, submission_ts)
+        best_version = best[0] if best else None
+
+        if best_version:
+            updates.append((compt, fname, best_version, detected_major, syntax))
+            python_version_counts[best_version] += 1
+            updated_count += 1
+        else:
+            no_match_count += 1
+            updates.append((compt, fname, None, detected_major, syntax))
+            print(f"No Python version found for {compt}/{fname} (submission: {script_meta['datetime'][:10]})")
                     
-    # Save updated kernel.json
-    with open("apiDowngrade/kernel_w_pyVersion.json", "w", encoding="utf-8") as f:
-        json.dump(kernel_content, f, indent=4, ensure_ascii=False)
+    # Save the versions into the kernel store and export the updated kernel.json layout
+    update_python(updates)
+    export_json("apiDowngrade/kernel_w_pyVersion.json")
 
     print(f"\nUpdated {updated_count} scripts with Python versions")
     print(f"No match found for {no_match_count} scripts")
@@ -0,0 +1,114 @@
+"""
+Release timelines with bisect lookup, shared by python_versions_update.py and create_apiVersions.py.
+
+A timeline holds the releases of one package sorted by publication time (epoch seconds, as kept by
+apiDowngrade/api_cache.py), with pre-releases already dropped, so "latest release before the
+submission" is a bisect instead of a scan that re-runs the pre-release regex and strptime on every
+version for every kernel:
+
+    index = ReleaseIndex(load=lambda api: api_cache.get(api))
+    index.latest_before("numpy", parse_timestamp(script_meta["datetime"]))   # -> ("1.16.4", ts) or None
+    index.oldest("numpy")
+
+Timelines are built once per package and lookups are memoized per (package, day).
+"""
+import bisect
+import datetime
+import re
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"   # libraries.io published_at and kernel.json datetime
+PRERELEASE_PATTERN = re.compile(r'[a-zA-Z]')  # 1.12.1rc1, 2.0.0b1, ...
+DAY = 86400
+
+
+def parse_timestamp(text, fmt=TIMESTAMP_FORMAT):
+    """Naive UTC date string -> epoch seconds"""
+    return datetime.datetime.strptime(text, fmt).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+class ReleaseTimeline:
+    """Releases of one package sorted by time; ties keep their source order"""
+
+    def __init__(self, releases):
+        # releases: [(number, timestamp)] in source order; sorted() is stable
+        releases = sorted(releases, key=lambda r: r[1])
+        self.versions = [number for number, _ in releases]
+        self.times = [ts for _, ts in releases]
+
+    @classmethod
+    def from_project(cls, project):
+        """Timeline of a cached libraries.io project; pre-releases are skipped unless they are the only release"""
+        return cls(
+            (number, ts)
+            for number, ts in zip(project.numbers, project.times)
+            if not (PRERELEASE_PATTERN.search(number) and len(project.numbers) > 1)
+        )
+
+    @classmethod
+    def from_python_versions(cls, python_versions, major=None):
+        """Timeline of apiDowngrade/python_versions.json ({version: "YYYY-MM-DD"}), optionally one major only"""
+        return cls(
+            (version, parse_timestamp(date, "%Y-%m-%d"))
+            for version, date in python_versions.items()
+            if major is None or version.startswith(f"{major}.")
+        )
+
+    def __len__(self):
+        return len(self.versions)
+
+    def release(self, i):
+        return self.versions[i], self.times[i]
+
+    def index_before(self, ts, lo=0, hi=None):
+        """Index of the latest release strictly before ts (the first one listed on a tie), or -1"""
+        i = bisect.bisect_left(self.times, ts, lo, len(self.times) if hi is None else hi) - 1
+        if i < 0:
+            return -1
+        return bisect.bisect_left(self.times, self.times[i], 0, i)
+
+    def latest_before(self, ts):
+        i = self.index_before(ts)
+        return self.release(i) if i >= 0 else None
+
+    def oldest(self):
+        return self.release(0) if self.versions else None
+
+
+class ReleaseIndex:
+    """
+    Timelines keyed by package, with lookups memoized per (package, day).
+
+    Timelines are either given up front or built on first use from load(package), which returns an
+    api_cache.Project; a project that is missing or "Removed" has no timeline (None).
+    """
+
+    def __init__(self, load=None, timelines=None):
+        self.load = load
+        self.timelines = dict(timelines or {})
+        self.days = {}
+
+    def timeline(self, package):
+        if package not in self.timelines:
+            meta = self.load(package) if self.load else None
+            self.timelines[package] = (ReleaseTimeline.from_project(meta)
+                                       if meta and meta.status != "Removed" else None)
+        return self.timelines[package]
+
+    def latest_before(self, package, ts):
+        timeline = self.timeline(package)
+        if timeline is None:
+            return None
+        day = int(ts // DAY)
+        window = self.days.get((package, day))
+        if window is None:
+            # Releases published during that day; for any other time the answer is the same all day long
+            lo = bisect.bisect_left(timeline.times, day * DAY)
+            hi = bisect.bisect_left(timeline.times, (day + 1) * DAY, lo)
+            window = self.days[(package, day)] = (lo, hi, timeline.index_before(day * DAY))
+        lo, hi, before_day = window
+        i = before_day if lo == hi or ts <= timeline.times[lo] else timeline.index_before(ts, lo, hi)
+        return timeline.release(i) if i >= 0 else None
+
+    def oldest(self, package):
+        timeline = self.timeline(package)
+        return timeline.oldest() if timeline is not None else None
@@ -0,0 +1,271 @@
+"""
+Wheel availability pre-flight for the date-pinned requirements.
+
+A pin without a binary wheel for the interpreter a kernel runs on makes `pip install --prefer-binary`
+fall back to a source build (slow, and old numpy/scipy rarely build with today's toolchain).
+check_requirements() moves such a pin to the nearest version that has a compatible wheel and was
+released on or before the submission date; a pin nothing can replace is kept and reported.
+
+Wheel metadata comes from the PyPI JSON API, cached per package in apiDowngrade/wheel_index.sqlite,
+plus the *.whl files of an optional local wheelhouse. Only wheels the image can install count:
+CPython on linux x86_64 with glibc up to GLIBC.
+
+    python apiDowngrade/wheel_preflight.py --refresh      # fetch the metadata of every pinned package
+"""
+import argparse
+import datetime
+import os
+import re
+import sqlite3
+import sys
+from functools import lru_cache
+from itertools import chain
+from pathlib import Path
+
+from packaging.specifiers import InvalidSpecifier, SpecifierSet
+from packaging.tags import compatible_tags, cpython_tags
+from packaging.utils import InvalidWheelFilename, canonicalize_name, parse_wheel_filename
+from packaging.version import InvalidVersion, Version
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from corpus.py_syntax import parse_minor
+from apiDowngrade.librariesio_fetch import KeyPool, fetch_projects
+
+DB_PATH = "apiDowngrade/wheel_index.sqlite"
+REQ_DIR = "apiDowngrade/apiDowngradeList"
+PYPI_URL = "https://pypi.org/pypi/{pkg}/json"
+PYPI_PER_MINUTE = 600
+GLIBC = (2, 31)   # Ubuntu 20.04 base of the kaggle image
+PLATFORMS = [f"manylinux_2_{m}_x86_64" for m in range(GLIBC[1], 4, -1)] + [
+    "manylinux2014_x86_64", "manylinux2010_x86_64", "manylinux1_x86_64", "linux_x86_64"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    requires_python TEXT,
+    uploaded INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_package ON files (package);
+CREATE TABLE IF NOT EXISTS fetched (package TEXT PRIMARY KEY, error TEXT);
+"""
+
+DAY_MS = 86400000
+
+PIN = re.compile(r"([a-z0-9-]+)(\[[^\]]*\])?==([^;,]+)$")
+
+
+def python_tag(minor):
+    """CPython tag of a minor, "3.6" -> cp36"""
+    major, mnr = parse_minor(minor)
+    return f"cp{major}{mnr}"
+
+
+def interpreter_abis(minor):
+    """ABI tags of a default pyenv build of CPython `minor` (pymalloc "m" before 3.8, wide unicode "mu" on 2.7)"""
+    major, mnr = parse_minor(minor)
+    interpreter = python_tag(minor)
+    return [interpreter + "mu", interpreter + "m"] if major == 2 else [interpreter + "m"] if mnr < 8 else [interpreter]
+
+
+@lru_cache(maxsize=None)
+def supported_tags(minor):
+    """Wheel tags a pyenv CPython `minor` ("3.6") on linux x86_64 installs"""
+    version = parse_minor(minor)
+    return frozenset(chain(cpython_tags(version, interpreter_abis(minor), PLATFORMS),
+                           compatible_tags(version, python_tag(minor), PLATFORMS)))
+
+
+def python_allowed(requires_python, minor):
+    # pyenv installs the newest patch of a minor
+    if not requires_python:
+        return True
+    try:
+        return SpecifierSet(requires_python).contains(f"{minor}.99")
+    except InvalidSpecifier:
+        return True
+
+
+def wheel_matches(filename, requires_python, minor):
+    try:
+        tags = parse_wheel_filename(filename)[3]
+    except InvalidWheelFilename:
+        return False
+    return not tags.isdisjoint(supported_tags(minor)) and python_allowed(requires_python, minor)
+
+
+def to_millis(upload_time):
+    dt = datetime.datetime.fromisoformat(upload_time.rstrip("Z")).replace(tzinfo=datetime.timezone.utc)
+    return round(dt.timestamp() * 1000)
+
+
+def version_key(v):
+    try:
+        return Version(v)
+    except InvalidVersion:
+        return None
+
+
+class WheelIndex:
+    """Release files per package: PyPI metadata cached in sqlite plus a local wheelhouse"""
+
+    def __init__(self, path=DB_PATH, wheelhouse=None):
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.local = {}
+        if wheelhouse and os.path.isdir(wheelhouse):
+            for filename in (f for _, _, files in os.walk(wheelhouse) for f in files if f.endswith(".whl")):
+                try:
+                    name, ver = parse_wheel_filename(filename)[:2]
+                except InvalidWheelFilename:
+                    continue
+                self.local.setdefault((name, str(ver)), []).append(filename)
+        self.releases_cache = {}
+        self.decisions = {}
+        self.unknown = set()   # pinned packages without cached metadata (run --refresh)
+
+    def fetched(self):
+        return {row[0] for row in self.conn.execute("SELECT package FROM fetched")}
+
+    def refresh(self, packages, concurrency=16):
+        """Fetch the PyPI file lists of the packages not cached yet; returns how many failed"""
+        missing = sorted(set(packages) - self.fetched())
+        failed = 0
+
+        def on_result(package, meta, error):
+            nonlocal failed
+            with self.conn:
+                if meta is not None:
+                    for ver, files in meta.get("releases", {}).items():
+                        self.conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", [
+                            (package, ver, f["filename"], f.get("requires_python"), to_millis(f["upload_time"]))
+                            for f in files if f.get("upload_time")
+                        ])
+                elif error != "not found":
+                    failed += 1
+                    return
+                self.conn.execute("INSERT OR REPLACE INTO fetched VALUES (?, ?)", (package, error))
+            self.releases_cache.pop(package, None)
+
+        if missing:
+            # PyPI needs no key: one bucket paces the requests and no libraries.io parameters are sent
+            fetch_projects(missing, KeyPool(["pypi.org"], PYPI_PER_MINUTE), concurrency=concurrency,
+                           base_url=PYPI_URL, on_result=on_result, keyless=True)
+        return failed
+
+    def releases(self, package):
+        """{version: (first upload in epoch ms, [(wheel filename, requires_python)])}, None if never fetched"""
+        if package not in self.releases_cache:
+            rows = self.conn.execute(
+                "SELECT version, filename, requires_python, uploaded FROM files WHERE package = ?", (package,)
+            ).fetchall()
+            if not rows and not self.conn.execute("SELECT 1 FROM fetched WHERE package = ?", (package,)).fetchone():
+                self.releases_cache[package] = None
+            else:
+                releases = {}
+                for ver, filename, requires_python, uploaded in rows:
+                    first, wheels = releases.get(ver, (uploaded, []))
+                    if filename.endswith(".whl"):
+                        wheels.append((filename, requires_python))
+                    releases[ver] = (min(first, uploaded), wheels)
+                self.releases_cache[package] = releases
+        return self.releases_cache[package]
+
+    def has_wheel(self, package, ver, minor, releases=None):
+        if any(wheel_matches(f, None, minor) for f in self.local.get((package, ver), ())):
+            return True
+        release = (releases or {}).get(ver)
+        return bool(release) and any(wheel_matches(f, rp, minor) for f, rp in release[1])
+
+    def substitute(self, package, pin, minor, before_ms):
+        """
+        (version to install, reason): the pin itself when it has a wheel (or nothing is known about
+        the package), else one of its two neighbours in version order that have a wheel and were
+        released on or before the day of before_ms: the one released closer to the pinned release,
+        the newer one on a tie or when the pin's release date is unknown (later releases add wheels
+        for newer pythons)
+        """
+        day = before_ms // DAY_MS
+        memo = (package, pin, minor, day)
+        if memo in self.decisions:
+            return self.decisions[memo]
+        releases = self.releases(package)
+        if self.has_wheel(package, pin, minor, releases):
+            decision = pin, None
+        elif releases is None:
+            self.unknown.add(package)
+            decision = pin, None
+        elif not releases:
+            decision = pin, "not on PyPI"
+        else:
+            pinned = version_key(pin)
+            candidates = [
+                (version_key(v), v) for v, (first, _) in releases.items()
+                if first // DAY_MS <= day and version_key(v) is not None and self.has_wheel(package, v, minor, releases)
+            ]
+            if pinned is None or not candidates:
+                decision = pin, "no wheel on or before the submission"
+            else:
+                ordered = sorted(candidates + [(pinned, pin)])
+                at = ordered.index((pinned, pin))
+                lower = ordered[at - 1][1] if at > 0 else None
+                upper = ordered[at + 1][1] if at + 1 < len(ordered) else None
+                chosen = upper or lower
+                if upper and lower and pin in releases:
+                    pinned_at = releases[pin][0]
+                    if pinned_at - releases[lower][0] < releases[upper][0] - pinned_at:
+                        chosen = lower
+                decision = chosen, "substituted"
+        self.decisions[memo] = decision
+        return decision
+
+    def close(self):
+        self.conn.close()
+
+
+def check_requirements(index, requirements, minor, before_ms):
+    """
+    Canonical requirement lines -> (lines with substituted pins, [(package, pin, version, reason)])
+    for every pin that is not installable from a wheel as is
+    """
+    lines, changes = [], []
+    for line in requirements:
+        m = PIN.match(line)
+        if not m:
+            lines.append(line)
+            continue
+        package, extras, pin = m.group(1), m.group(2) or "", m.group(3)
+        ver, reason = index.substitute(package, pin, minor, before_ms)
+        if reason:
+            changes.append((package, pin, ver, reason))
+        lines.append(f"{package}{extras}=={ver}")
+    return tuple(sorted(set(lines))), changes
+
+
+def pinned_packages(req_dir=REQ_DIR):
+    packages = set()
+    for entry in os.scandir(req_dir):
+        with open(entry.path, "r", encoding="utf-8") as f:
+            for line in f:
+                m = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*==", line)
+                if m:
+                    packages.add(canonicalize_name(m.group(1)))
+    return packages
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Cache PyPI wheel metadata of the pinned packages")
+    arg_parser.add_argument("--refresh", action="store_true", help="fetch the packages not cached yet")
+    arg_parser.add_argument("--db", default=DB_PATH)
+    arg_parser.add_argument("--concurrency", type=int, default=16)
+    cli = arg_parser.parse_args()
+
+    index = WheelIndex(cli.db)
+    packages = pinned_packages()
+    print(f"{len(packages)} pinned packages, {len(packages & index.fetched())} cached in {cli.db}")
+    if cli.refresh:
+        failed = index.refresh(packages, cli.concurrency)
+        print(f"{failed} packages failed (rerun --refresh to retry)" if failed else "All pinned packages cached")
+    index.close()
@@ -1,38 +1,94 @@
+import argparse
 import json
+import os
+import re
 import subprocess
 import sys
+from pathlib import Path
+
+from packaging.utils import canonicalize_name
+from packaging.version import InvalidVersion, Version
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from apiDowngrade.api_cache import ApiCache
 
 image_name = "gcr.io/kaggle-gpu-images/python"
 cached_apis = "apiDowngrade/api_cache.json"
 save_path = "baseline/requirements.txt"
+manifest_cache = "baseline/image_manifests.json"
+req_dir = "apiDowngrade/apiDowngradeList"
 
-def get_docker_packages(image_name):
-    """Get list of installed packages from Docker image."""
-    print(f"Fetching packages from Docker image: {image_name}")
+# Interpreter and installed distributions of the image's default python, in one container start
+MANIFEST_SCRIPT = (
+    "python -c 'import sys; print(sys.executable); print(\"%d.%d\" % sys.version_info[:2])' "
+    "&& python -m pip list --format=json --disable-pip-version-check"
+)
+
+def image_digest(image_name):
+    """Content digest (image ID) of the local image, pulled first if it is not local yet"""
+    cmd = ["docker", "image", "inspect", "--format", "{{.Id}}", image_name]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        subprocess.run(["docker", "pull", image_name], check=True)
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+def get_image_manifest(image_name, cache_path=manifest_cache, refresh=False):
+    """
+    {"image", "digest", "executable", "python", "packages": {name: version}} of an image, cached in
+    cache_path by image digest: the container only starts for an image (or a tag update) not seen yet.
+    None when docker fails
+    """
     try:
-        # Run docker and execute pip list
-        cmd = [
-            "docker", "run", "--rm", image_name,
-            "pip", "list", "--format=json"
-        ]
+        digest = image_digest(image_name)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error inspecting Docker image {image_name}: {e}")
+        return None
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    if digest in cache and not refresh:
+        print(f"Using cached manifest of {image_name} ({digest[:19]})")
+        return cache[digest]
+
+    print(f"Fetching packages from Docker image: {image_name} ({digest[:19]})")
+    try:
+        cmd = ["docker", "run", "--rm", digest, "sh", "-c", MANIFEST_SCRIPT]
         result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        packages = json.loads(result.stdout)
-        
-        # Extract package names (normalize to lowercase)
-        docker_packages = {pkg["name"].lower() for pkg in packages}
-        print(f"Found {len(docker_packages)} packages in Docker image")
-        return docker_packages
-    
+        executable, python, listing = result.stdout.split("\n", 2)
+        packages = json.loads(listing)
     except subprocess.CalledProcessError as e:
         print(f"Error running docker command: {e}")
         print(f"Stderr: {e.stderr}")
-        sys.exit(1)
-    except json.JSONDecodeError as e:
+        return None
+    except (ValueError, json.JSONDecodeError) as e:
         print(f"Error parsing pip list output: {e}")
-        sys.exit(1)
+        return None
+    manifest = {"image": image_name, "digest": digest, "executable": executable.strip(), "python": python.strip(),
+                "packages": {pkg["name"]: pkg["version"] for pkg in packages}}
+    cache[digest] = manifest
+    with open(cache_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    return manifest
+
+def get_docker_packages(manifest):
+    """Get list of installed packages from the Docker image manifest."""
+    # Extract package names (normalize to lowercase)
+    docker_packages = {name.lower() for name in manifest["packages"]}
+    print(f"Found {len(docker_packages)} packages in Docker image (python {manifest['python']})")
+    return docker_packages
 
 def get_cached_packages(cache_path="apiDowngrade/api_cache.json"):
-    """Get list of package names from api_cache.json."""
+    """Get list of package names from the api cache (api_cache.sqlite next to cache_path if present, else api_cache.json)."""
+    db_path = os.path.splitext(cache_path)[0] + ".sqlite"
+    if os.path.exists(db_path):
+        # Only the package column is read, not the version histories
+        print(f"Reading cached packages from: {db_path}")
+        cached_packages = ApiCache(db_path, legacy_json=None).packages()
+        print(f"Found {len(cached_packages)} packages in cache")
+        return cached_packages
+
     print(f"Reading cached packages from: {cache_path}")
     try:
         with open(cache_path, "r", encoding="utf-8") as f:
@@ -56,12 +112,55 @@ def find_missing_packages(docker_packages, cached_packages):
     print(f"\nFound {len(missing)} packages in cache but not in Docker image")
     return sorted(missing)
 
+def same_version(installed, pinned):
+    try:
+        return Version(installed) == Version(pinned)
+    except InvalidVersion:
+        return installed == pinned
+
+def diff_pins(image_packages, requirements):
+    """
+    Version-aware diff of requirement lines against the image's {name: version}: returns
+    (satisfied, mismatched, missing) lines. A pin is satisfied when the image has the same
+    distribution at an equal version; anything else than a plain `name==version` pin (extras, markers,
+    ranges) counts as missing
+    """
+    installed = {canonicalize_name(name): ver for name, ver in image_packages.items()}
+    satisfied, mismatched, missing = [], [], []
+    for line in requirements:
+        m = re.match(r"([A-Za-z0-9][A-Za-z0-9._-]*)==([^;,\[\]]+)$", line)
+        if not m or canonicalize_name(m.group(1)) not in installed:
+            missing.append(line)
+        elif same_version(installed[canonicalize_name(m.group(1))], m.group(2)):
+            satisfied.append(line)
+        else:
+            mismatched.append(line)
+    return satisfied, mismatched, missing
+
+def report_pins(manifest, requirements_dir=req_dir):
+    """How many of the date-pinned requirements the image satisfies as is"""
+    installed = {canonicalize_name(name): ver for name, ver in manifest["packages"].items()}
+    satisfied, mismatched, missing = 0, {}, 0
+    for entry in os.scandir(requirements_dir):
+        with open(entry.path, "r", encoding="utf-8") as f:
+            lines = [re.sub(r"\s+", "", line.split("#", 1)[0]) for line in f]
+        ok, other, absent = diff_pins(manifest["packages"], [line for line in lines if line])
+        satisfied += len(ok)
+        missing += len(absent)
+        for line in other:
+            name = canonicalize_name(line.split("==")[0])
+            mismatched[name] = mismatched.get(name, 0) + 1
+    total = satisfied + sum(mismatched.values()) + missing
+    print(f"\nPins of {requirements_dir}: {satisfied}/{total} satisfied by the image, "
+          f"{sum(mismatched.values())} at another version, {missing} not installed")
+    for name, count in sorted(mismatched.items(), key=lambda kv: -kv[1])[:10]:
+        print(f"  - {name}: {count} pins differ from the image's {installed[name]}")
+
 def save_requirements(missing_packages, output_path):
     """Save missing packages to requirements.txt."""
     print(f"\nSaving missing packages to: {output_path}")
     
     # Ensure directory exists
-    import os
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
     with open(output_path, "w", encoding="utf-8") as f:
@@ -70,9 +169,12 @@ def save_requirements(missing_packages, output_path):
     
     print(f"Successfully saved {len(missing_packages)} package names")
 
-def main():
-    # Step 1: Get packages from Docker image
-    docker_packages = get_docker_packages(image_name)
+def main(refresh=False):
+    # Step 1: Get packages from Docker image (cached by image digest)
+    manifest = get_image_manifest(image_name, refresh=refresh)
+    if manifest is None:
+        sys.exit(1)
+    docker_packages = get_docker_packages(manifest)
     
     # Step 2: Get cached packages
     cached_packages = get_cached_packages(cached_apis)
@@ -90,8 +192,15 @@ def main():
     
     # Step 4: Save to requirements.txt
     save_requirements(missing_packages, save_path)
-    
+
+    # Step 5: Version-aware view of the pinned requirements
+    if os.path.isdir(req_dir):
+        report_pins(manifest)
+
     print("\nDone!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    arg_parser = argparse.ArgumentParser(description="List the cached APIs the Kaggle image does not install")
+    arg_parser.add_argument("--refresh", action="store_true", help="list the image's packages again even if cached")
+    cli = arg_parser.parse_args()
+    main(cli.refresh)
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+Static scan of the notebook corpus for the pretrained assets the notebooks download at run time
+(corpus.features.asset_references): nltk corpora, torchvision/timm/keras weights, spacy models
+and HuggingFace checkpoints. The counts go to baseline/assets.json, the input of
+docker/prefetch_assets.py, which fills the local asset cache the runners mount.
+"""
+import json
+import os
+import sys
+from pathlib import Path
+from tqdm import tqdm
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from corpus.features import asset_references
+from corpus.notebook_cache import load_notebook
+from corpus.kernel_store import eligible_kernels
+
+parent = '/home/b27jin/mle-bench-internal/fetch/competitions'
+output_path = "baseline/assets.json"
+
+kernels = [(row['competition'], row['fname']) for row in eligible_kernels()]
+print(f"Total eligible entries: {len(kernels)}")
+
+# {kind: {name: number of notebooks}}
+assets = {}
+
+for comp, fname in tqdm(kernels):
+    path = os.path.join(parent, comp, 'html', fname)
+    if not os.path.exists(path):
+        continue
+    # The cells are cached when the page is parsed, only the asset patterns run here
+    for kind, names in asset_references(load_notebook(path)['cells']).items():
+        for name in names:
+            assets.setdefault(kind, {})[name] = assets.get(kind, {}).get(name, 0) + 1
+
+with open(output_path, "w", encoding="utf-8") as f:
+    json.dump({kind: dict(sorted(names.items(), key=lambda kv: -kv[1])) for kind, names in sorted(assets.items())},
+              f, indent=2)
+
+for kind, names in sorted(assets.items()):
+    print(f"{kind}: {len(names)} assets in {sum(names.values())} notebook references")
+print(f"Successfully saved the assets to {output_path}")
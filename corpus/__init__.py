@@ -0,0 +1 @@
+"""Helpers shared by the corpus stages (create_kernel, baseline, apiDowngrade, docker)."""
@@ -0,0 +1,113 @@
+"""
+Micro-benchmark of the html cell extractor over the crawled corpus.
+
+    python -m corpus.bench_html_cells [--parent DIR] [--limit N] [--check]
+
+Every run appends one line to corpus/bench_html_cells.tsv so parse time per page can be tracked over time.
+--check only compares the cells of both extractors on every page and exits 1 on any difference.
+"""
+import argparse
+import datetime
+import glob
+import html
+import os
+import re
+import statistics
+import sys
+import time
+
+from corpus.html_cells import iter_code_cells
+
+parent = '/home/b27jin/mle-bench-internal/fetch/competitions'
+history_path = "corpus/bench_html_cells.tsv"
+
+
+def legacy_code_cells(content):
+    """The former read_html_content/assemble_code_regex pair, kept only as the baseline"""
+    highlight_blocks = re.findall(r'<div class="highlight hl-ipython3">(.*?)</div>', content, re.DOTALL)
+    input_areas = re.findall(r'<div class="input_area">(.*?)</div>', content, re.DOTALL)
+    input_areas = "".join(input_areas) if input_areas else ""
+    input_areas = re.sub(r' *<pre>', '<pre>', input_areas)
+    cells = []
+    for block in highlight_blocks:
+        code_match = re.search(r'<pre>(.*?)</pre>', block, re.DOTALL)
+        if code_match:
+            code = html.unescape(html.unescape(code_match.group(1)))
+            cells.append(re.sub(r'</?[a-zA-Z][^>]*>', '', code))
+    return cells
+
+
+def check_pages(files, pages):
+    """Number of pages whose cells differ between the shared and the legacy extractor"""
+    differ = 0
+    for path, content in zip(files, pages):
+        shared, legacy = list(iter_code_cells(content)), legacy_code_cells(content)
+        if shared != legacy:
+            differ += 1
+            first = next((i for i, (a, b) in enumerate(zip(shared, legacy)) if a != b), min(len(shared), len(legacy)))
+            print(f"{path}: {len(shared)} vs {len(legacy)} cells, first difference in cell {first}")
+    print(f"{len(pages) - differ} of {len(pages)} pages identical to the legacy extractor")
+    return differ
+
+
+def time_pages(pages, extract):
+    """Return the per-page parse time (ms) of extract over the already loaded pages"""
+    timings = []
+    for content in pages:
+        start = time.perf_counter()
+        for _ in extract(content):
+            pass
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(name, timings):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    row = {
+        "name": name,
+        "pages": len(timings),
+        "mean_ms": statistics.mean(timings),
+        "median_ms": statistics.median(timings),
+        "p95_ms": p95,
+        "total_s": sum(timings) / 1000,
+    }
+    print(f"{name:>8}: {row['pages']} pages | mean {row['mean_ms']:.3f} ms | median {row['median_ms']:.3f} ms "
+          f"| p95 {row['p95_ms']:.3f} ms | total {row['total_s']:.2f} s")
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the html cell extractor")
+    parser.add_argument("--parent", default=parent, help="fetch/competitions directory")
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N pages")
+    parser.add_argument("--no-legacy", action="store_true", help="skip the legacy regex baseline")
+    parser.add_argument("--check", action="store_true", help="compare the cells with the legacy extractor instead of timing")
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.parent, '*', 'html', '*.html')))[:args.limit]
+    if not files:
+        raise SystemExit(f"No html pages found under {args.parent}")
+
+    # Read everything up front so the timings only cover parsing
+    pages = []
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            pages.append(f.read())
+    print(f"Loaded {len(pages)} pages ({sum(len(p) for p in pages) / 1e6:.1f} MB)")
+    if args.check:
+        sys.exit(1 if check_pages(files, pages) else 0)
+
+    rows = [summarize("shared", time_pages(pages, iter_code_cells))]
+    if not args.no_legacy:
+        rows.append(summarize("legacy", time_pages(pages, legacy_code_cells)))
+        print(f"speedup: {rows[1]['total_s'] / max(rows[0]['total_s'], 1e-9):.1f}x")
+
+    new_file = not os.path.exists(history_path)
+    with open(history_path, "a", encoding="utf-8") as f:
+        if new_file:
+            f.write("timestamp\tname\tpages\tmean_ms\tmedian_ms\tp95_ms\ttotal_s\n")
+        stamp = datetime.datetime.now().isoformat(timespec="seconds")
+        for row in rows:
+            f.write(f"{stamp}\t{row['name']}\t{row['pages']}\t{row['mean_ms']:.4f}\t"
+                    f"{row['median_ms']:.4f}\t{row['p95_ms']:.4f}\t{row['total_s']:.4f}\n")
@@ -0,0 +1,119 @@
+"""
+Static features of the notebook cells, found with regexes (no cell is run or parsed).
+
+    classify_cells(cells)    -> '2', '3' or 'unknown' (python 2 vs 3 syntax hits)
+    nltk_downloads(cells)    -> sorted names passed to nltk.download
+    asset_references(cells)  -> {kind: sorted names} of the pretrained assets fetched at run time
+
+The asset kinds are the ones docker/prefetch_assets.py can fetch into the local asset cache.
+"""
+import re
+
+# Regex patterns for Python 2 specific syntax
+PY2_PATTERNS = [re.compile(p) for p in [
+    r'(^|[^a-zA-Z0-9_])print\s+["\']',      # print "string" (no parentheses)
+    r'(^|[^a-zA-Z0-9_])print\s+[\w]+',      # print var (no parentheses)
+    r'\bxrange\b',                          # xrange vs range
+    r'\braw_input\b',                       # raw_input vs input
+    r'\bunicode\b',                         # unicode type
+    r'\blong\b',                            # long type
+    r'\bbasestring\b',                      # basestring type
+    r'\.iteritems\(',                       # dict.iteritems()
+    r'except\s+\w+\s*,\s*\w+',              # except Exception, e
+    r'from\s+__future__\s+import\s+division', # __future__ imports common in Py2
+]]
+# Regex patterns for Python 3 specific syntax
+PY3_PATTERNS = [re.compile(p) for p in [
+    r'\bprint\s*\(',                        # print "string" with parentheses
+    r'\bf["\']',                            # f-strings (Py 3.6+)
+    r'\basync\s+def\b',                     # async/await (Py 3.5+)
+    r'\bawait\b',
+    r'\bnonlocal\b',                        # nonlocal keyword
+    r'\btyping\b',                          # typing module
+    r'\)\s*->\s*[A-Za-z_]',                 # function return annotations
+    r'\byield\s+from\b',                    # yield from (Py 3.3+)
+]]
+
+# matches nltk.download('pkg') or nltk.download("pkg")
+NLTK_DOWNLOAD_PATTERN = re.compile(r"nltk\.download\(\s*['\"]([^'\"]+)['\"]")
+
+
+def classify_cells(cells):
+    """
+    Robustly discern if the code is written in python 2 syntax or python 3.
+    Returns '2', '3', or 'unknown'.
+    """
+    py2_hits = 0
+    py3_hits = 0
+
+    for src in cells:
+        if not src.strip():
+            continue
+
+        for p in PY2_PATTERNS:
+            if p.search(src):
+                py2_hits += 1
+        for p in PY3_PATTERNS:
+            if p.search(src):
+                py3_hits += 1
+
+    if py2_hits == 0 and py3_hits == 0:
+        return 'unknown'
+    if py2_hits > py3_hits:
+        return '2'
+    if py3_hits >= py2_hits: # Default to 3 if tied, as it's more likely for recent files from the distribution
+        return '3'
+    return 'unknown'
+
+
+def nltk_downloads(cells):
+    """Return the sorted package names passed to nltk.download in the cells."""
+    downloads = set()
+    for src in cells:
+        for m in NLTK_DOWNLOAD_PATTERN.finditer(src):
+            downloads.add(m.group(1))
+    return sorted(downloads)
+
+
+# keras.applications models with imagenet weights (the names the prefetcher builds)
+KERAS_APPLICATIONS = {
+    "Xception", "VGG16", "VGG19", "InceptionV3", "InceptionResNetV2", "NASNetMobile", "NASNetLarge",
+    "ResNet50", "ResNet101", "ResNet152", "ResNet50V2", "ResNet101V2", "ResNet152V2",
+    "MobileNet", "MobileNetV2", "MobileNetV3Small", "MobileNetV3Large",
+    "DenseNet121", "DenseNet169", "DenseNet201",
+    *(f"EfficientNetB{i}" for i in range(8)),
+    *(f"EfficientNetV2{size}" for size in ("B0", "B1", "B2", "B3", "S", "M", "L")),
+    *(f"ConvNeXt{size}" for size in ("Tiny", "Small", "Base", "Large", "XLarge")),
+    *(f"RegNet{kind}{flops}" for kind in "XY"
+      for flops in ("002", "004", "006", "008", "016", "032", "040", "064", "080", "120", "160", "320")),
+}
+
+# Pretrained assets a notebook downloads at run time, by kind (see asset_references)
+ASSET_PATTERNS = {
+    # models.resnet50(pretrained=True), torchvision.models.vgg16(weights=...)
+    "torchvision": re.compile(r"\bmodels\.([a-z][a-z0-9_]*)\([^)]*\b(?:pretrained\s*=\s*True|weights\s*=\s*(?!None\b)\w)"),
+    # timm.create_model('efficientnet_b0', pretrained=True)
+    "timm": re.compile(r"\btimm\.create_model\(\s*['\"]([^'\"]+)['\"][^)]*\bpretrained\s*=\s*True"),
+    # ResNet50(weights='imagenet'), keras.applications.vgg16.VGG16(weights="imagenet", ...)
+    "keras": re.compile(r"\b(" + "|".join(sorted(KERAS_APPLICATIONS, key=len, reverse=True)) +
+                        r")\([^)]*\bweights\s*=\s*['\"]imagenet['\"]"),
+    # spacy.load('en_core_web_sm'), !python -m spacy download en_core_web_sm
+    "spacy": re.compile(r"\bspacy\.load\(\s*['\"]([^'\"]+)['\"]|\bspacy\s+download\s+([A-Za-z0-9_.-]+)"),
+    # AutoModel.from_pretrained('bert-base-uncased'), pipeline(..., model="distilgpt2")
+    "hf": re.compile(r"\.from_pretrained\(\s*['\"]([\w.-]+(?:/[\w.-]+)?)['\"]|\bpipeline\([^)]*\bmodel\s*=\s*['\"]([\w.-]+(?:/[\w.-]+)?)['\"]"),
+}
+
+
+def asset_references(cells):
+    """
+    {kind: sorted names} of the pretrained assets the cells fetch at run time: nltk corpora,
+    torchvision/timm/keras weights, spacy models and HuggingFace checkpoints. Only literal names
+    are found; a name built at run time (or a local path) is missed, so this is a lower bound
+    """
+    found = {kind: set() for kind in ASSET_PATTERNS}
+    for src in cells:
+        for kind, pattern in ASSET_PATTERNS.items():
+            for m in pattern.finditer(src):
+                found[kind].add(next(g for g in m.groups() if g))
+    found["nltk"] = set(nltk_downloads(cells))
+    return {kind: sorted(names) for kind, names in found.items() if names}
@@ -0,0 +1,76 @@
+"""
+Single-pass extractor of the code cells of a crawled Kaggle html page, shared by every corpus stage.
+
+    iter_code_cells(content)          -> source of every code cell, in page order
+    read_html_notebook(path, prelude) -> nbformat notebook of those cells
+
+The output is the one of the former regex extractor (corpus/bench_html_cells.py keeps it as
+legacy_code_cells; --check compares both on the corpus), only found with str.find instead of regexes.
+"""
+import html
+import re
+
+from nbformat.v4 import new_notebook, new_code_cell
+
+# Every code cell of a crawled Kaggle page is rendered by pygments as
+#   <div class="highlight hl-ipython3"><pre><span></span>...</pre></div>
+HIGHLIGHT_OPEN = '<div class="highlight hl-ipython3">'
+DIV_CLOSE = '</div>'
+PRE_OPEN = '<pre>'
+PRE_CLOSE = '</pre>'
+
+# Cell that create_kernel / python_versions_update put in front of the crawled code
+PANDAS_PRELUDE = 'import pandas as pd\nfrom pathlib import Path'
+
+TAG_PATTERN = re.compile(r'</?[a-zA-Z][^>]*>')
+
+
+def clean_code(html_snippet: str) -> str:
+    """
+    Removes the pygments markup from a <pre> body. As the legacy extractor did, entities are
+    unescaped twice before the tags are stripped, so every stage sees the same cells as before
+    """
+    return TAG_PATTERN.sub('', html.unescape(html.unescape(html_snippet)))
+
+
+def iter_code_cells(content):
+    """Yield the source of every code cell of a Kaggle html page, scanning the page once"""
+    find = content.find
+    pos = find(HIGHLIGHT_OPEN)
+    while pos != -1:
+        start = pos + len(HIGHLIGHT_OPEN)
+        end = find(DIV_CLOSE, start)
+        if end == -1:
+            # an unterminated block is no cell (the legacy regex needed the closing </div>)
+            break
+
+        # Only the first <pre> inside the highlight block holds the code
+        pre = find(PRE_OPEN, start, end)
+        if pre != -1:
+            pre_end = find(PRE_CLOSE, pre + len(PRE_OPEN), end)
+            if pre_end != -1:
+                yield clean_code(content[pre + len(PRE_OPEN):pre_end])
+
+        pos = find(HIGHLIGHT_OPEN, end)
+
+
+def read_code_cells(file_path):
+    """Read an html file and yield its code cells"""
+    with open(file_path, "r", encoding="utf-8") as file:
+        content = file.read()
+    yield from iter_code_cells(content)
+
+
+def notebook_from_cells(cells, prelude=None):
+    """Build a notebook from code cell sources, optionally starting with a prelude cell"""
+    nb = new_notebook()
+    if prelude is not None:
+        nb.cells.append(new_code_cell(prelude))
+    for code in cells:
+        nb.cells.append(new_code_cell(code))
+    return nb
+
+
+def read_html_notebook(file_path, prelude=None):
+    """Build a notebook from the code cells of an html file, optionally starting with a prelude cell"""
+    return notebook_from_cells(read_code_cells(file_path), prelude)
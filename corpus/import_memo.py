@@ -0,0 +1,98 @@
+"""
+Code-hash memo for import detection, shared by all create_kernel workers.
+
+Versions of the same kernel (..._v3_C1, _v4_C1, ...) usually differ in a few cells only, and their
+html differs even when the code does not, so the html-keyed notebook cache does not catch them.
+This memo is keyed by the code itself (corpus/cache/imports.sqlite):
+
+    cell_modules(digest, modules)   sha256 of one cell -> top-level modules it imports
+    notebook_deps(digest, deps)     sha256 of the module index + all cells -> resolved distributions
+
+A new version therefore only parses its changed cells, and an identical code body is resolved
+(including any pigar fallback) exactly once.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from functools import lru_cache
+
+from corpus.imports import INDEX_PATH, cell_modules, load_module_index
+
+MEMO_PATH = "corpus/cache/imports.sqlite"
+
+_connections = {}
+
+
+def connect(path=MEMO_PATH):
+    """One connection per process (Pool workers must not share the parent's connection)"""
+    key = (os.getpid(), path)
+    conn = _connections.get(key)
+    if conn is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS cell_modules (digest TEXT PRIMARY KEY, modules TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS notebook_deps (digest TEXT PRIMARY KEY, deps TEXT NOT NULL)")
+        conn.commit()
+        _connections[key] = conn
+    return conn
+
+
+def code_digest(src):
+    return hashlib.sha256(src.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def index_fingerprint(index_path=INDEX_PATH):
+    """Hash of the module index, so resolved notebooks are redone when the index is rebuilt"""
+    return code_digest(json.dumps(load_module_index(index_path), sort_keys=True))
+
+
+def notebook_digest(cells, fingerprint):
+    h = hashlib.sha256(fingerprint.encode("utf-8"))
+    for src in cells:
+        h.update(b"\0")
+        h.update(src.encode("utf-8"))
+    return h.hexdigest()
+
+
+def memo_cell_modules(cells, path=MEMO_PATH):
+    """Union of the modules imported by the cells; only cells never seen before are parsed"""
+    conn = connect(path)
+    digests = {code_digest(src): src for src in cells}
+
+    known = {}
+    keys = list(digests)
+    # stay below SQLite's host parameter limit
+    for i in range(0, len(keys), 500):
+        batch = keys[i:i + 500]
+        rows = conn.execute(
+            f"SELECT digest, modules FROM cell_modules WHERE digest IN ({','.join('?' * len(batch))})", batch
+        ).fetchall()
+        known.update((digest, set(json.loads(modules))) for digest, modules in rows)
+
+    new_rows = []
+    for digest, src in digests.items():
+        if digest not in known:
+            known[digest] = cell_modules(src)
+            new_rows.append((digest, json.dumps(sorted(known[digest]))))
+    if new_rows:
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO cell_modules VALUES (?, ?)", new_rows)
+
+    modules = set()
+    for found in known.values():
+        modules |= found
+    return modules
+
+
+def lookup_notebook_deps(digest, path=MEMO_PATH):
+    row = connect(path).execute("SELECT deps FROM notebook_deps WHERE digest = ?", (digest,)).fetchone()
+    return set(json.loads(row[0])) if row else None
+
+
+def store_notebook_deps(digest, deps, path=MEMO_PATH):
+    with connect(path) as conn:
+        conn.execute("INSERT OR REPLACE INTO notebook_deps VALUES (?, ?)", (digest, json.dumps(sorted(deps))))
@@ -0,0 +1,239 @@
+"""
+In-process import resolver for notebook cells.
+
+Each cell is parsed with ast (IPython magics and shell escapes blanked out first; py2 cells that do
+not parse fall back to a line regex) and its top-level module names are mapped to PyPI distributions
+through a module -> distribution index built from an installed environment:
+
+    # build the index inside the image the notebooks run in
+    docker run --rm -v $PWD:/w -w /w gcr.io/kaggle-gpu-images/python python -m corpus.imports --build-index
+
+Names the index cannot map (or maps to several distributions) are reported as unresolved so the
+caller can fall back to pigar for that notebook only.
+"""
+import argparse
+import ast
+import json
+import os
+import re
+import sys
+from functools import lru_cache
+
+INDEX_PATH = "corpus/module_index.json"
+
+# Modules only found in the python 2 standard library (sys.stdlib_module_names is py3 only)
+PY2_STDLIB = {
+    "__builtin__", "anydbm", "BaseHTTPServer", "Bastion", "CGIHTTPServer", "commands", "ConfigParser",
+    "Cookie", "cookielib", "copy_reg", "cPickle", "cStringIO", "dircache", "DocXMLRPCServer", "dummy_thread",
+    "exceptions", "htmlentitydefs", "HTMLParser", "httplib", "imputil", "md5", "mimetools",
+    "MimeWriter", "mutex", "new", "popen2", "Queue", "repr", "robotparser", "rfc822", "sets", "sha",
+    "SimpleHTTPServer", "SimpleXMLRPCServer", "SocketServer", "StringIO", "thread", "Tix", "Tkinter",
+    "tkFileDialog", "tkMessageBox", "urllib2", "urlparse", "UserDict", "UserList", "UserString",
+    "whichdb", "xmlrpclib",
+}
+
+# Import names that differ from their distribution and are often missing from the indexed environment
+KNOWN_ALIASES = {
+    "sklearn": "scikit-learn",
+    "skimage": "scikit-image",
+    "cv2": "opencv-python",
+    "PIL": "Pillow",
+    "bs4": "beautifulsoup4",
+    "yaml": "PyYAML",
+    "dateutil": "python-dateutil",
+    "Crypto": "pycryptodome",
+    "Levenshtein": "python-Levenshtein",
+    "fitz": "PyMuPDF",
+    "Bio": "biopython",
+    "OpenSSL": "pyOpenSSL",
+    "jose": "python-jose",
+    "magic": "python-magic",
+    "dotenv": "python-dotenv",
+    "attr": "attrs",
+    "tensorflow_addons": "tensorflow-addons",
+    "mpl_toolkits": "matplotlib",
+}
+
+# Cell magics whose body is not python
+NON_PYTHON_CELL_MAGICS = {"bash", "sh", "script", "writefile", "file", "html", "javascript", "js",
+                          "latex", "markdown", "perl", "ruby", "svg", "sql", "R", "system"}
+
+MAGIC_LINE = re.compile(r'^(\s*)(?:[%!].*|\S.*\?\??\s*)$')
+SHELL_ASSIGN = re.compile(r'^(\s*[\w.,\s]+=\s*)!.*$')
+WRITEFILE = re.compile(r'^%%writefile(?:\s+-a)?\s+(\S+)')
+IMPORT_LINE = re.compile(r'^\s*import\s+([\w.]+(?:\s*,\s*[\w.]+)*)')
+FROM_LINE = re.compile(r'^\s*from\s+([\w.]+)\s+import\b')
+
+
+def strip_magics(src):
+    """Blank out IPython magics/shell escapes so the cell parses as python; None if the cell is not python"""
+    lines = src.split("\n")
+    if lines and lines[0].startswith("%%"):
+        magic = lines[0][2:].split()[0] if lines[0][2:].split() else ""
+        if magic in NON_PYTHON_CELL_MAGICS:
+            return None
+        lines = [""] + lines[1:]
+
+    out = []
+    for line in lines:
+        m = SHELL_ASSIGN.match(line)
+        if m:
+            out.append(m.group(1) + "None")
+            continue
+        m = MAGIC_LINE.match(line)
+        if m and line.strip():
+            # keep the indentation so enclosing blocks stay valid
+            out.append(m.group(1) + "pass")
+            continue
+        out.append(line)
+    return "\n".join(out)
+
+
+def regex_modules(src):
+    """Line based fallback for cells that do not parse (mostly python 2 code)"""
+    modules = set()
+    for line in src.split("\n"):
+        m = IMPORT_LINE.match(line)
+        if m:
+            for name in m.group(1).split(","):
+                modules.add(name.strip().split(".")[0])
+            continue
+        m = FROM_LINE.match(line)
+        if m and not m.group(1).startswith("."):
+            modules.add(m.group(1).split(".")[0])
+    return modules
+
+
+def cell_modules(src):
+    """Return the top-level module names imported by a single cell"""
+    code = strip_magics(src)
+    if code is None:
+        return set()
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return regex_modules(code)
+
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                modules.add(alias.name.split(".")[0])
+        elif isinstance(node, ast.ImportFrom):
+            if node.level == 0 and node.module:
+                modules.add(node.module.split(".")[0])
+    return modules
+
+
+def local_modules(cells):
+    """Modules written by the notebook itself via %%writefile"""
+    local = set()
+    for src in cells:
+        m = WRITEFILE.match(src)
+        if m:
+            name = os.path.basename(m.group(1))
+            if name.endswith(".py"):
+                local.add(name[:-3])
+    return local
+
+
+def is_stdlib(name):
+    return name in sys.stdlib_module_names or name in PY2_STDLIB or name == "__future__"
+
+
+def build_module_index():
+    """Map every importable top-level name of this interpreter to its distribution(s)"""
+    from importlib.metadata import packages_distributions
+
+    index = {}
+    for module, dists in packages_distributions().items():
+        if module.startswith("_") or is_stdlib(module):
+            continue
+        index[module] = sorted(set(dists))
+    return index
+
+
+def save_module_index(index, path=INDEX_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2, sort_keys=True, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+@lru_cache(maxsize=None)
+def load_module_index(path=INDEX_PATH):
+    """Load the module index, building it from the running interpreter if it does not exist yet"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        print(f"No module index at {path}, building it from {sys.executable}")
+        index = build_module_index()
+        save_module_index(index, path)
+    for module, dist in KNOWN_ALIASES.items():
+        index.setdefault(module, [dist])
+    return index
+
+
+def canonical_name(dist):
+    return re.sub(r"[-_.]+", "-", dist).lower()
+
+
+def resolve_modules(modules, index=None):
+    """Map module names to distributions; returns (distributions, unresolved module names)"""
+    if index is None:
+        index = load_module_index()
+    deps = set()
+    unresolved = set()
+    for module in modules:
+        if is_stdlib(module):
+            continue
+        dists = index.get(module)
+        if dists and len(dists) == 1:
+            deps.add(dists[0])
+        else:
+            # unknown, or a namespace shared by several distributions (e.g. google)
+            unresolved.add(module)
+    return deps, unresolved
+
+
+def notebook_modules(cells):
+    """Top-level third-party candidates imported anywhere in the cells"""
+    modules = set()
+    for src in cells:
+        modules |= cell_modules(src)
+    return modules - local_modules(cells)
+
+
+def resolve_imports(cells, index=None):
+    """Resolve the distributions imported by a list of code cells; returns (distributions, unresolved)"""
+    return resolve_modules(notebook_modules(cells), index)
+
+
+def merge_distributions(deps, extra):
+    """Add the distributions of extra that are not already in deps (compared by canonical name)"""
+    seen = {canonical_name(d) for d in deps}
+    merged = set(deps)
+    for dist in extra:
+        if canonical_name(dist) not in seen:
+            seen.add(canonical_name(dist))
+            merged.add(dist)
+    return merged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Module -> distribution index for the import resolver")
+    parser.add_argument("--build-index", action="store_true", help="(re)build the index from this interpreter")
+    parser.add_argument("--output", default=INDEX_PATH)
+    parser.add_argument("modules", nargs="*", help="module names to resolve with the current index")
+    args = parser.parse_args()
+
+    if args.build_index:
+        index = build_module_index()
+        save_module_index(index, args.output)
+        print(f"Indexed {len(index)} modules from {sys.executable} into {args.output}")
+    if args.modules:
+        deps, unresolved = resolve_modules(args.modules, load_module_index(args.output))
+        print(f"resolved: {sorted(deps)}")
+        print(f"unresolved: {sorted(unresolved)}")
@@ -0,0 +1,245 @@
+"""
+Indexed SQLite store of the kernel metadata (kernel.sqlite, built from kernel.json).
+
+    kernels(competition, fname, year, month, day, datetime, ps, runtime, datasets, n_datasets,
+            is_r, python, python_minor, detected_major, python_min, python_max)
+    kernel_api(competition, fname, api)
+
+Every stage asks the store for the kernels it needs instead of loading and scanning the nested
+kernel.json, e.g.
+
+    for row in eligible_kernels(api="nltk"):
+        row["competition"], row["fname"], row["datetime"], row["api"], ...
+
+The store is rebuilt by create_kernel.py after every run, or by hand with
+
+    python -m corpus.kernel_store --build [--kernel-json kernel.json]
+"""
+import argparse
+import json
+import os
+import sqlite3
+
+KERNEL_PATH = "kernel.json"
+STORE_PATH = "kernel.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kernels (
+    competition TEXT NOT NULL,
+    fname TEXT NOT NULL,
+    year INTEGER,
+    month INTEGER,
+    day INTEGER,
+    datetime TEXT,
+    ps TEXT,
+    runtime INTEGER,
+    datasets TEXT NOT NULL DEFAULT '[]',
+    n_datasets INTEGER NOT NULL DEFAULT 0,
+    is_r INTEGER NOT NULL DEFAULT 0,
+    python TEXT,
+    python_minor TEXT,
+    detected_major TEXT,
+    python_min TEXT,
+    python_max TEXT,
+    PRIMARY KEY (competition, fname)
+);
+CREATE TABLE IF NOT EXISTS kernel_api (
+    competition TEXT NOT NULL,
+    fname TEXT NOT NULL,
+    api TEXT NOT NULL,
+    PRIMARY KEY (competition, fname, api)
+);
+CREATE INDEX IF NOT EXISTS kernels_runtime ON kernels (runtime);
+CREATE INDEX IF NOT EXISTS kernels_datetime ON kernels (datetime);
+CREATE INDEX IF NOT EXISTS kernels_python ON kernels (python_minor, python);
+CREATE INDEX IF NOT EXISTS kernel_api_api ON kernel_api (api);
+"""
+
+
+def python_minor(version):
+    """'3.6.9' -> '3.6'"""
+    if not version:
+        return None
+    return ".".join(version.split(".")[:2])
+
+
+def connect(store=STORE_PATH):
+    conn = sqlite3.connect(store, timeout=60)
+    conn.executescript(SCHEMA)
+    # stores built before the syntax range columns existed
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(kernels)")}
+    for column in ("python_min", "python_max"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE kernels ADD COLUMN {column} TEXT")
+    return conn
+
+
+def kernel_row(competition, fname, info):
+    datasets = info.get("datasets", [])
+    python_range = info.get("python_range") or (None, None)
+    return (
+        competition, fname, info.get("year"), info.get("month"), info.get("date"), info.get("datetime"),
+        info.get("ps"), info.get("runtime"), json.dumps(datasets, ensure_ascii=False), len(datasets),
+        1 if "R" in info else 0, info.get("python"), python_minor(info.get("python")), info.get("detected_major"),
+        python_range[0], python_range[1],
+    )
+
+
+def upsert_kernels(conn, competition, files):
+    """Insert or replace the entries {fname: info} of one competition"""
+    conn.executemany("INSERT OR REPLACE INTO kernels VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                     [kernel_row(competition, fname, info) for fname, info in files.items()])
+    conn.executemany("DELETE FROM kernel_api WHERE competition = ? AND fname = ?",
+                     [(competition, fname) for fname in files])
+    conn.executemany("INSERT OR IGNORE INTO kernel_api VALUES (?,?,?)",
+                     [(competition, fname, api) for fname, info in files.items() for api in info.get("api") or []])
+
+
+def build_store(entity, store=STORE_PATH):
+    """(Re)build the store from a nested {competition: {fname: info}} dict (or (competition, files) pairs), atomically"""
+    tmp = store + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = connect(tmp)
+    with conn:
+        for competition, files in (entity.items() if isinstance(entity, dict) else entity):
+            upsert_kernels(conn, competition, files)
+    conn.close()
+    os.replace(tmp, store)
+
+
+def open_store(store=STORE_PATH, kernel_json=KERNEL_PATH):
+    """Connect to the store, building it from kernel.json first if it does not exist"""
+    if not os.path.exists(store):
+        print(f"Building {store} from {kernel_json}")
+        with open(kernel_json, "r", encoding="utf-8") as f:
+            build_store(json.load(f), store)
+    conn = connect(store)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def row_to_info(row):
+    """Turn a kernels row back into the kernel.json layout (plus competition/fname)"""
+    info = {"competition": row["competition"], "fname": row["fname"]}
+    if row["datetime"] is not None:
+        info.update(year=row["year"], month=row["month"], date=row["day"], datetime=row["datetime"])
+    else:
+        info["no_date"] = 1
+    if row["ps"] is not None:
+        info["ps"] = row["ps"]
+    if row["runtime"] is not None:
+        info["runtime"] = row["runtime"]
+    if row["is_r"]:
+        info["R"] = 1
+    else:
+        # group_concat has no defined order; kernel.json keeps the imports sorted
+        info["api"] = sorted(row["api"].split("\x1f")) if row["api"] else []
+    info["datasets"] = json.loads(row["datasets"])
+    if row["python"] is not None:
+        info["python"] = row["python"]
+    if row["detected_major"] is not None:
+        info["detected_major"] = row["detected_major"]
+    if row["python_min"] is not None:
+        info["python_range"] = [row["python_min"], row["python_max"]]
+    return info
+
+
+def query_kernels(where="1", params=(), store=STORE_PATH):
+    """Stream kernels matching a WHERE clause over the kernels table (aliased k)"""
+    conn = open_store(store)
+    try:
+        cursor = conn.execute(
+            f"""SELECT k.*, (SELECT group_concat(a.api, char(31)) FROM kernel_api a
+                             WHERE a.competition = k.competition AND a.fname = k.fname) AS api
+                FROM kernels k WHERE {where} ORDER BY k.competition, k.fname""",
+            params,
+        )
+        for row in cursor:
+            yield row_to_info(row)
+    finally:
+        conn.close()
+
+
+def eligible_kernels(max_runtime=600, max_datasets=1, require_score=True, api=None, competition=None,
+                     since=None, until=None, python=None, store=STORE_PATH):
+    """
+    Stream the kernels the pipeline works on: dated, scored ("ps" in info), runtime <= max_runtime,
+    at most max_datasets external datasets and python (not R). Optional filters:
+      api          only kernels importing this distribution
+      competition  only this competition
+      since/until  submission datetime bounds (ISO strings, since inclusive, until exclusive)
+      python       python version prefix, e.g. "3.6" or "3.6.9"
+    """
+    clauses = ["k.is_r = 0", "k.datetime IS NOT NULL", "k.runtime <= ?", "k.n_datasets <= ?"]
+    params = [max_runtime, max_datasets]
+    if require_score:
+        clauses.append("k.ps IS NOT NULL")
+    if api is not None:
+        clauses.append("EXISTS (SELECT 1 FROM kernel_api a WHERE a.competition = k.competition "
+                       "AND a.fname = k.fname AND a.api = ?)")
+        params.append(api)
+    if competition is not None:
+        clauses.append("k.competition = ?")
+        params.append(competition)
+    if since is not None:
+        clauses.append("k.datetime >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("k.datetime < ?")
+        params.append(until)
+    if python is not None:
+        clauses.append("(k.python = ? OR k.python LIKE ?)")
+        params.extend([python, python + ".%"])
+    return query_kernels(" AND ".join(clauses), params, store)
+
+
+def update_python(updates, store=STORE_PATH):
+    """
+    Set the python columns for [(competition, fname, python, detected_major, python_range), ...];
+    python_range is the (oldest, newest) minor the syntax allows, or None
+    """
+    conn = open_store(store)
+    with conn:
+        conn.executemany(
+            "UPDATE kernels SET python = ?, python_minor = ?, detected_major = ?, python_min = ?, python_max = ? "
+            "WHERE competition = ? AND fname = ?",
+            [(py, python_minor(py), major, *(python_range or (None, None)), comp, fname)
+             for comp, fname, py, major, python_range in updates],
+        )
+    conn.close()
+
+
+def export_json(path, store=STORE_PATH):
+    """Write the store back out in the nested kernel.json layout, one competition at a time"""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("{")
+        current = None
+        for info in query_kernels(store=store):
+            comp, fname = info.pop("competition"), info.pop("fname")
+            if comp != current:
+                f.write(("\n    }," if current is not None else "") + f"\n    {json.dumps(comp, ensure_ascii=False)}: {{")
+                first = True
+                current = comp
+            f.write(("" if first else ",") + f"\n        {json.dumps(fname, ensure_ascii=False)}: "
+                    + json.dumps(info, ensure_ascii=False))
+            first = False
+        f.write("\n    }\n}\n" if current is not None else "}\n")
+    os.replace(tmp, path)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Build or inspect the kernel metadata store")
+    arg_parser.add_argument("--build", action="store_true", help="rebuild the store from --kernel-json")
+    arg_parser.add_argument("--kernel-json", default=KERNEL_PATH)
+    arg_parser.add_argument("--store", default=STORE_PATH)
+    cli = arg_parser.parse_args()
+
+    if cli.build:
+        with open(cli.kernel_json, "r", encoding="utf-8") as f:
+            build_store(json.load(f), cli.store)
+    conn = open_store(cli.store, cli.kernel_json)
+    total = conn.execute("SELECT count(*) FROM kernels").fetchone()[0]
+    conn.close()
+    print(f"{cli.store}: {total} kernels, {sum(1 for _ in eligible_kernels(store=cli.store))} eligible")
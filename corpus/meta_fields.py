@@ -0,0 +1,189 @@
+"""
+Extractor for the fields of a crawled meta_html page.
+
+Kaggle renders the page with styled-components, so the class names (sc-gQaihK, bwaGMg, ...) are
+generated and drift between crawls. Every field therefore has a table of patterns: the exact
+selector first, then fallbacks that keep the shape and the context of the element but not the
+hashed class names. Fields are extracted independently (a match of one field never hides the
+match of another); for every field the first pattern that matches wins. The private score and the
+runtime have no fallback: a loose pattern there picks up vote or comment counts, and "ps" in
+info is what marks a kernel as scored.
+
+    python -m corpus.meta_fields [--parent DIR] [--sample N] [--check-baseline]
+
+prints the coverage per field and per pattern on a sample of pages, so class-name drift shows up
+before a whole corpus pass is spent on it; --check-baseline also compares every page with the
+original per-field extraction (baseline_meta_fields) and fails on any difference.
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+from collections import Counter
+
+parent = '/home/b27jin/mle-bench-internal/fetch/competitions'
+
+DATE_TEXT = r'[A-Z][a-z]{2} [A-Z][a-z]{2} \d{2} \d{4} \d{2}:\d{2}:\d{2} GMT[+-]\d{4}'
+
+# field -> patterns in priority order; each pattern has exactly one capturing group (the value)
+FIELD_PATTERNS = {
+    # External datasets (every match is kept)
+    "datasets": [
+        r'<p\s+class="sc-gQaihK sc-dyfHgC bwaGMg igmQhu">\s*(.*?)\s*</p>',
+        r'<p\s+class="sc-[A-Za-z]+ sc-[A-Za-z]+ [A-Za-z]+ igmQhu">\s*(.*?)\s*</p>',
+    ],
+    # Runtime (the last block that parses as a duration wins)
+    "runtime": [
+        r'<p\s+class="sc-gQaihK\s+(?:sc-bHbnRu|sc-hKjFaw)\s+bwaGMg\s+(?:hAkjhA|jGRPCU)">(.*?)</p>',
+    ],
+    # Private score (first match)
+    "ps": [
+        r'<p class="sc-gQaihK[^"]*">\s*([-\d.]+)\s*</p>',
+    ],
+    # Submission date (first match)
+    "date": [
+        r'<span [^>]*title="(' + DATE_TEXT + r') \([^"]+\)"',
+        r'title="(' + DATE_TEXT + r')[^"]*"',
+    ],
+}
+
+MULTI_VALUE_FIELDS = {"datasets", "runtime"}
+
+COMPILED_PATTERNS = {field: [re.compile(p, re.DOTALL) for p in patterns] for field, patterns in FIELD_PATTERNS.items()}
+
+TIME_PATTERN = re.compile(r'(?:(?P<h>\d+)\s*h)?\s*(?:(?P<m>\d+)\s*m)?\s*(?P<s>\d+)\s*s')
+
+
+def time_to_seconds(text):
+    """
+    Extracts hours, minutes, and seconds from a text and converts them to seconds.
+    Expected formats are, for example, "4s", "1m 54s", or "1h 59m 59s".
+    """
+    # The regex looks for optional hours and minutes, and mandatory seconds.
+    match = TIME_PATTERN.search(text)
+    if match:
+        h = int(match.group('h')) if match.group('h') is not None else 0
+        m_val = int(match.group('m')) if match.group('m') is not None else 0
+        s = int(match.group('s'))
+        return h * 3600 + m_val * 60 + s
+    return None
+
+
+def extract_meta_fields(content):
+    """
+    Extract the fields of a meta_html page and return (fields, sources):
+      fields:  {"date": str, "ps": str, "runtime": int, "datasets": [str]} (missing fields are absent)
+      sources: {field: priority of the pattern that produced it}
+    """
+    fields = {}
+    sources = {}
+    for field, patterns in COMPILED_PATTERNS.items():
+        for priority, pattern in enumerate(patterns):
+            values = pattern.findall(content)
+            if field == "runtime":
+                values = [v for v in map(time_to_seconds, values) if v is not None]
+            if not values:
+                continue
+            sources[field] = priority
+            if field == "datasets":
+                fields[field] = list(set(values))
+            elif field == "runtime":
+                fields[field] = values[-1]
+            else:
+                fields[field] = values[0]
+            break
+    return fields, sources
+
+
+def baseline_meta_fields(content):
+    """The original extraction of create_kernel (one findall per field, exact selectors only), for --check-baseline"""
+    fields = {}
+    dates = re.findall(r'<span [^>]*title="([A-Z][a-z]{2} [A-Z][a-z]{2} \d{2} \d{4} \d{2}:\d{2}:\d{2} GMT[+-]\d{4} \([^"]+\))"',
+                       content, re.DOTALL)
+    if dates:
+        fields["date"] = dates[0].split(" (")[0]
+    matches = re.findall(r'<p class="sc-gQaihK[^"]*">\s*([-\d.]+)\s*</p>', content, re.DOTALL)
+    if matches:
+        fields["ps"] = matches[0]
+    for tag in re.findall(r'<p\s+class="sc-gQaihK\s+(?:sc-bHbnRu|sc-hKjFaw)\s+bwaGMg\s+(?:hAkjhA|jGRPCU)">(.*?)</p>',
+                          content, re.DOTALL):
+        seconds = time_to_seconds(tag)
+        if seconds is not None:
+            fields["runtime"] = seconds
+    fields["datasets"] = list(set(re.findall(r'<p\s+class="sc-gQaihK sc-dyfHgC bwaGMg igmQhu">\s*(.*?)\s*</p>',
+                                             content, flags=re.DOTALL)))
+    return fields
+
+
+def baseline_differences(content):
+    """[(field, baseline value, extracted value)] of the fields the primary patterns extract differently"""
+    fields, sources = extract_meta_fields(content)
+    expected = baseline_meta_fields(content)
+    diffs = []
+    for field in FIELD_PATTERNS:
+        got = fields.get(field, [] if field == "datasets" else None)
+        want = expected.get(field, [] if field == "datasets" else None)
+        # A fallback may find what the baseline missed; anything else must agree
+        if sources.get(field, 0) > 0 and not want:
+            continue
+        if field == "datasets":
+            got, want = sorted(got), sorted(want)
+        if got != want:
+            diffs.append((field, want, got))
+    return diffs
+
+
+class Coverage:
+    """Per-field counts of which pattern produced the value (or that none did)"""
+
+    def __init__(self):
+        self.pages = 0
+        self.counts = {field: Counter() for field in FIELD_PATTERNS}
+
+    def add(self, sources):
+        self.pages += 1
+        for field in FIELD_PATTERNS:
+            self.counts[field][sources.get(field, "missing")] += 1
+
+    def report(self):
+        lines = [f"Meta field coverage over {self.pages} pages"]
+        for field, counter in self.counts.items():
+            found = self.pages - counter["missing"]
+            by_pattern = ", ".join(
+                f"{'primary' if p == 0 else f'fallback {p}'}: {counter[p]}"
+                for p in range(len(FIELD_PATTERNS[field])) if counter[p]
+            )
+            share = found / self.pages * 100 if self.pages else 0
+            lines.append(f"  {field:<9} {found:>6}/{self.pages} ({share:5.1f}%)  [{by_pattern or 'no match'}]")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Check meta_html field coverage on a sample of pages")
+    arg_parser.add_argument("--parent", default=parent, help="fetch/competitions directory")
+    arg_parser.add_argument("--sample", type=int, default=200, help="number of random pages (0 = all)")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--check-baseline", action="store_true",
+                            help="also compare every page with the original per-field extraction")
+    cli = arg_parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(cli.parent, '*', 'meta_html', '*_C1.html')))
+    if cli.sample and len(files) > cli.sample:
+        files = random.Random(cli.seed).sample(files, cli.sample)
+
+    coverage = Coverage()
+    mismatched = 0
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        coverage.add(extract_meta_fields(content)[1])
+        if cli.check_baseline:
+            for field, want, got in baseline_differences(content):
+                mismatched += 1
+                print(f"{path}: {field} is {got!r}, the baseline extracts {want!r}")
+    print(coverage.report())
+    if cli.check_baseline:
+        print(f"Baseline check: {mismatched} differences on {len(files)} pages")
+        sys.exit(1 if mismatched else 0)
@@ -0,0 +1,105 @@
+"""
+Content-addressed cache of parsed notebooks.
+
+Each html/{submissionID}_C1.html page is parsed once; the result is stored under
+corpus/cache/notebooks/{sha[:2]}/{sha}.json where sha is the sha256 of the html bytes:
+
+    {
+        "version": 3,             # CACHE_VERSION, entries of another version are re-parsed
+        "digest": "...",
+        "cells": ["...", ...],    # code cells without any prelude
+        "syntax": ["3.6", "3.9"], # corpus.py_syntax.syntax_range (oldest/newest minor), or null
+        "syntax_newest": "3.14",  # py_syntax.NEWEST the range was computed with
+        "detected_major": "3",    # major of the syntax range, else corpus.features.classify_cells
+        "nltk": ["punkt", ...],   # nltk.download targets
+        "api": ["numpy", ...],    # set by create_kernel once the imports are resolved
+        "api_index": "..."        # import_memo.index_fingerprint "api" was resolved with
+    }
+
+create_kernel fills the cache, later stages (create_fullDataset, python_versions_update,
+search_nltkCorpora, search_assets) only read it.
+"""
+import hashlib
+import json
+import os
+
+from corpus.features import classify_cells, nltk_downloads
+from corpus.html_cells import iter_code_cells
+from corpus.py_syntax import NEWEST, format_minor, syntax_range, range_major
+
+CACHE_DIR = "corpus/cache/notebooks"
+CACHE_VERSION = 3
+
+
+def html_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def entry_path(digest, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, digest[:2], f"{digest}.json")
+
+
+def write_entry(entry, cache_dir=CACHE_DIR):
+    """Atomically (re)write a cache entry; safe with several worker processes"""
+    path = entry_path(entry["digest"], cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def read_entry(digest, cache_dir=CACHE_DIR):
+    """Return the cached entry for a digest, or None if missing/stale"""
+    try:
+        with open(entry_path(digest, cache_dir), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if entry.get("version") != CACHE_VERSION:
+        return None
+    return entry
+
+
+def parse_entry(digest, content):
+    cells = list(iter_code_cells(content))
+    entry = {
+        "version": CACHE_VERSION,
+        "digest": digest,
+        "cells": cells,
+        "nltk": nltk_downloads(cells),
+    }
+    return update_syntax(entry)
+
+
+def update_syntax(entry):
+    syntax = syntax_range(entry["cells"])
+    entry["syntax"] = syntax
+    entry["syntax_newest"] = format_minor(NEWEST)
+    # the regex vote only decides code that is valid in both python 2 and 3
+    entry["detected_major"] = range_major(syntax) or classify_cells(entry["cells"])
+    return entry
+
+
+def load_notebook(file_path, cache_dir=CACHE_DIR):
+    """Return the parsed entry of an html page, parsing and caching it on a miss"""
+    with open(file_path, "rb") as f:
+        data = f.read()
+    digest = html_digest(data)
+
+    entry = read_entry(digest, cache_dir)
+    if entry is None:
+        entry = parse_entry(digest, data.decode("utf-8"))
+        write_entry(entry, cache_dir)
+    elif entry.get("syntax_newest") != format_minor(NEWEST):
+        # A newer release in the version table: only the range is recomputed, from the cached cells
+        write_entry(update_syntax(entry), cache_dir)
+    return entry
+
+
+def store_imports(entry, deps, fingerprint, cache_dir=CACHE_DIR):
+    """Record the resolved imports of a cached notebook and the module index they were resolved with"""
+    entry["api"] = sorted(deps)
+    entry["api_index"] = fingerprint
+    write_entry(entry, cache_dir)
+    return entry
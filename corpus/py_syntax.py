@@ -0,0 +1,247 @@
+"""
+Syntax-driven range of python minor versions a notebook can run on.
+
+Every cell (IPython magics blanked out) is parsed and checked against a table of grammar features
+with the version that introduced them (f-strings 3.6, walrus 3.8, match 3.10, ...) and of names
+that later versions removed (async as an identifier, imp, collections.Mapping, ...). Cells that
+only parse as python 2 (print statements, except X, e, backticks, ...) pin the notebook to 2.7.
+
+    syntax_range(cells)  -> ("2.7", "3.14"), ("3.6", "3.9"), ("2.7", "2.7") or None
+
+None means no cell could be classified, or the cells contradict each other. The newest minor is the
+newest release in apiDowngrade/python_versions.json, the table the interpreters are picked from.
+Cells are parsed by the running interpreter, so syntax newer than it leaves a cell unclassified.
+"""
+import ast
+import io
+import json
+import re
+import sys
+import tokenize
+from pathlib import Path
+
+from corpus.imports import strip_magics
+
+VERSIONS_PATH = Path(__file__).resolve().parents[1] / "apiDowngrade" / "python_versions.json"
+OLDEST = (2, 7)
+PY2 = ((2, 7), (2, 7))
+
+# Top-level modules removed from the standard library -> last minor that still has them
+REMOVED_MODULES = {
+    "macpath": (3, 7),
+    "formatter": (3, 9),
+    "parser": (3, 9),
+    "symbol": (3, 9),
+    "imp": (3, 11),
+    "distutils": (3, 11),
+    "asynchat": (3, 11),
+    "asyncore": (3, 11),
+    "smtpd": (3, 11),
+    # PEP 594 dead batteries and lib2to3, removed in 3.13
+    **{name: (3, 12) for name in (
+        "aifc", "audioop", "cgi", "cgitb", "chunk", "crypt", "imghdr", "mailcap", "msilib", "nis", "nntplib",
+        "ossaudiodev", "pipes", "sndhdr", "spwd", "sunau", "telnetlib", "uu", "xdrlib", "lib2to3",
+    )},
+}
+# ABC aliases dropped from collections in 3.10
+COLLECTIONS_ABC = {
+    "Awaitable", "Coroutine", "AsyncIterable", "AsyncIterator", "AsyncGenerator", "Hashable", "Iterable",
+    "Iterator", "Generator", "Reversible", "Sized", "Container", "Callable", "Collection", "Set", "MutableSet",
+    "Mapping", "MutableMapping", "MappingView", "KeysView", "ItemsView", "ValuesView", "Sequence",
+    "MutableSequence", "ByteString",
+}
+
+# Python 2 only syntax, checked on cells that do not parse as python 3
+PY2_SYNTAX = re.compile(
+    r'^\s*print(?:\s+[^\s(=.,)\]]|\s*$|\s*>>)'      # print "x", print x, bare print, print >>f
+    r'|^\s*except\s+[\w.]+\s*,\s*\w+\s*:'            # except Exception, e:
+    r'|^\s*exec\s+["\'\w]'                           # exec "code"
+    r'|`[^`\n]+`'                                    # backtick repr
+    r'|\b\d+[lL]\b'                                  # 10L long literal
+    r'|\b[uU][rR]["\']'                              # ur"..." literal
+    r'|^\s*raise\s+[\w.]+\s*,',                      # raise E, "message"
+    re.MULTILINE,
+)
+
+
+def format_minor(v):
+    return f"{v[0]}.{v[1]}"
+
+
+def parse_minor(text):
+    major, minor = text.split(".")[:2]
+    return int(major), int(minor)
+
+
+def newest_minor(path=VERSIONS_PATH):
+    """Newest minor of the python release table, the running interpreter's if the table is missing"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            # versions such as "2.2p1" only count by their major.minor
+            return max(parse_minor(re.match(r"\d+\.\d+", v).group(0)) for v in json.load(f))
+    except FileNotFoundError:
+        return sys.version_info[:2]
+
+
+NEWEST = newest_minor()
+
+
+def _uses_print_function(tree):
+    return any(isinstance(node, ast.ImportFrom) and node.module == "__future__"
+               and any(alias.name == "print_function" for alias in node.names)
+               for node in ast.walk(tree))
+
+
+def feature_bounds(tree, async_names=False):
+    """(oldest, newest) minor allowed by the features used in a parsed cell"""
+    low, high = OLDEST, NEWEST
+    if async_names:
+        # async/await used as identifiers only parse up to 3.6
+        high = (3, 6)
+    print_function = _uses_print_function(tree)
+
+    def need(version):
+        nonlocal low
+        low = max(low, version)
+
+    def until(version):
+        nonlocal high
+        high = min(high, version)
+
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.JoinedStr, ast.AnnAssign)):
+            need((3, 6))
+        elif isinstance(node, (ast.AsyncFunctionDef, ast.AsyncFor, ast.AsyncWith, ast.Await)):
+            need((3, 5))
+        elif isinstance(node, ast.comprehension) and node.is_async:
+            need((3, 6))
+        elif isinstance(node, ast.NamedExpr):
+            need((3, 8))
+        elif isinstance(node, ast.Match):
+            need((3, 10))
+        elif type(node).__name__ == "TryStar":
+            need((3, 11))
+        elif type(node).__name__ == "TypeAlias":
+            need((3, 12))
+        elif type(node).__name__ == "TemplateStr":
+            need((3, 14))
+        elif isinstance(node, (ast.BinOp, ast.AugAssign)) and isinstance(node.op, ast.MatMult):
+            need((3, 5))
+        elif isinstance(node, ast.YieldFrom):
+            need((3, 3))
+        elif isinstance(node, ast.Nonlocal):
+            need((3, 0))
+        elif isinstance(node, ast.Raise) and node.cause is not None:
+            need((3, 0))
+        elif isinstance(node, ast.arguments):
+            if node.posonlyargs:
+                need((3, 8))
+            if node.kwonlyargs or any(a.annotation is not None for a in node.args):
+                need((3, 0))
+        elif isinstance(node, ast.Starred) and isinstance(node.ctx, ast.Store):
+            # a, *rest = ... (f(*args) is fine in python 2)
+            need((3, 0))
+        elif isinstance(node, (ast.List, ast.Tuple, ast.Set)) and not isinstance(getattr(node, "ctx", None), ast.Store) \
+                and any(isinstance(e, ast.Starred) for e in node.elts):
+            # [*a, *b] (PEP 448)
+            need((3, 5))
+        elif isinstance(node, ast.Dict) and None in node.keys:
+            need((3, 5))
+        elif isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name) and node.func.id == "print" and node.keywords and not print_function:
+                # print(..., end="") is a syntax error for the python 2 print statement
+                need((3, 0))
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                top = alias.name.split(".")[0]
+                if top in REMOVED_MODULES:
+                    until(REMOVED_MODULES[top])
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            top = node.module.split(".")[0]
+            if top in REMOVED_MODULES:
+                until(REMOVED_MODULES[top])
+            if node.module == "collections" and any(alias.name in COLLECTIONS_ABC for alias in node.names):
+                until((3, 9))
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.returns is not None:
+            need((3, 0))
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and any(
+                not _dotted_decorator(d) for d in node.decorator_list):
+            # arbitrary decorator expressions (PEP 614)
+            need((3, 9))
+    return low, high
+
+
+def _dotted_decorator(node):
+    if isinstance(node, ast.Call):
+        node = node.func
+    while isinstance(node, ast.Attribute):
+        node = node.value
+    return isinstance(node, ast.Name)
+
+
+def _rename_async(code):
+    """
+    code with every async/await token renamed to a plain name, or None when it has none. Used
+    instead of ast.parse(feature_version=(3, 6)), which no longer accepts them as names on 3.13+
+    """
+    lines = io.StringIO(code).readlines()
+    hits = []
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(code).readline):
+            if tok.type == tokenize.NAME and tok.string in ("async", "await"):
+                hits.append(tok.start)
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    if not hits:
+        return None
+    for row, col in reversed(hits):
+        lines[row - 1] = lines[row - 1][:col] + "_" + lines[row - 1][col:]
+    return "".join(lines)
+
+
+def cell_bounds(src):
+    """(oldest, newest) minor of a single cell, or None if it cannot be classified"""
+    code = strip_magics(src)
+    if code is None or not code.strip():
+        return None
+    try:
+        return feature_bounds(ast.parse(code))
+    except (SyntaxError, ValueError):
+        pass
+    # async/await were plain names before 3.7: the cell parses once they are renamed
+    renamed = _rename_async(code)
+    if renamed is not None:
+        try:
+            return feature_bounds(ast.parse(renamed), async_names=True)
+        except (SyntaxError, ValueError):
+            pass
+    if PY2_SYNTAX.search(code):
+        return PY2
+    return None
+
+
+def syntax_range(cells):
+    """Oldest and newest python minor ("3.6") every classifiable cell runs on, or None"""
+    low, high = OLDEST, NEWEST
+    seen = False
+    for src in cells:
+        bounds = cell_bounds(src)
+        if bounds is None:
+            continue
+        seen = True
+        low, high = max(low, bounds[0]), min(high, bounds[1])
+    if not seen or low > high:
+        return None
+    return format_minor(low), format_minor(high)
+
+
+def range_major(syntax):
+    """'2' or '3' when the range is within one major version, otherwise None"""
+    if syntax is None:
+        return None
+    low, high = parse_minor(syntax[0]), parse_minor(syntax[1])
+    if high < (3, 0):
+        return '2'
+    if low >= (3, 0):
+        return '3'
+    return None
@@ -1,20 +1,31 @@
 from tqdm import tqdm
-import re,os,glob, time
+import os,glob
 import datetime
 import ast
-import html
+import argparse
+import hashlib
+import random
 import json
 import warnings
 import tempfile
 import nbformat
 import subprocess
 from pathlib import Path
-from nbformat.v4 import new_notebook, new_code_cell
+from corpus.html_cells import notebook_from_cells, PANDAS_PRELUDE
+from corpus.notebook_cache import load_notebook, store_imports
+from corpus.meta_fields import extract_meta_fields, Coverage
+from corpus.imports import local_modules, resolve_modules, merge_distributions
+from corpus.kernel_store import build_store
+from corpus.import_memo import (
+    index_fingerprint, notebook_digest, memo_cell_modules, lookup_notebook_deps, store_notebook_deps,
+)
 from multiprocessing import Pool, Manager, RLock
-import multiprocessing
 warnings.filterwarnings("ignore", category=SyntaxWarning)
 
 parent = '/home/b27jin/mle-bench-internal/fetch/competitions'
+KERNEL_PATH = "kernel.json"
+MANIFEST_PATH = "kernel_manifest.json"
+SHARD_DIR = "kernel_shards"
 
 def init_pool(l):
     """Initialize the worker process with a shared lock for tqdm."""
@@ -24,126 +35,87 @@ def get_folders(base_path):
     """Get the folder names under the base path"""
     return [f for f in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, f))]
 
-def read_html_content(file_path, nb=None):
-    """Read the content of an HTML file and append code cells to notebook if provided"""
+def process_kernel(competi, fname, parent):
+    """Extract the metadata of a single kernel (meta_html/{fname} + html/{fname}); also returns the field sources"""
+    info = {}
+    with open(os.path.join(parent, competi, 'meta_html', fname), "r", encoding="utf-8") as fp:
+        content = fp.read()
+    # Every field of the page (falls back to looser patterns when class names drift)
+    fields, sources = extract_meta_fields(content)
 
-    with open(file_path, "r", encoding="utf-8") as file:
-        content = file.read()
+    # Submission Year
+    if 'date' in fields:
+        dt = datetime.datetime.strptime(fields['date'].replace("GMT", ""), "%a %b %d %Y %H:%M:%S %z")
 
-        # Find all code blocks with highlight hl-ipython3 class
-        highlight_blocks = re.findall(r'<div class="highlight hl-ipython3">(.*?)</div>', content, re.DOTALL)
-        
-        # Process all input areas as before for backward compatibility
-        input_areas = re.findall(r'<div class="input_area">(.*?)</div>', content, re.DOTALL)
-        input_areas = "".join(input_areas) if input_areas else ""
-        input_areas = re.sub(r' *<pre>', '<pre>', input_areas)
-        
-        # If notebook object provided, add each code block as a cell
-        if nb is not None:
-            # nb.cells.append(new_code_cell('%pip install Unidecode monai ttach optuna optuna-integration'))
-            nb.cells.append(new_code_cell('import pandas as pd\nfrom pathlib import Path'))
-            for block in highlight_blocks:
-                # Extract code from the highlight block
-                code_match = re.search(r'<pre>(.*?)</pre>', block, re.DOTALL)
-                if code_match:
-                    # Clean up the code
-                    code_text = html.unescape(code_match.group(1))
-                    raw_code = assemble_code_regex(code_text)
-                    # code = inspect.cleandoc(raw_code)
-                    nb.cells.append(new_code_cell(raw_code))
-        
-        return nb
-    
-def assemble_code_regex(html_snippet: str) -> str:
-    """
-    Uses a regular expression to remove HTML tags from the snippet and unescapes HTML entities.
-    """
-    # Unescape any HTML entities (if present)
-    code = html.unescape(html_snippet)
-    # Remove all HTML tags using regex
-    code = re.sub(r'</?[a-zA-Z][^>]*>', '', code)
-
-    return code
-
-
-def time_to_seconds(text):
-    """
-    Extracts hours, minutes, and seconds from a text and converts them to seconds.
-    Expected formats are, for example, "4s", "1m 54s", or "1h 59m 59s".
-    """
-    # The regex looks for optional hours and minutes, and mandatory seconds.
-    time_pattern = r'(?:(?P<h>\d+)\s*h)?\s*(?:(?P<m>\d+)\s*m)?\s*(?P<s>\d+)\s*s'
-    match = re.search(time_pattern, text)
-    if match:
-        h = int(match.group('h')) if match.group('h') is not None else 0
-        m_val = int(match.group('m')) if match.group('m') is not None else 0
-        s = int(match.group('s'))
-        return h * 3600 + m_val * 60 + s
-    return None
-
-def process_competition(args):
-    """Process a single competition"""
-    competi, parent = args
-    entity = {competi: {}}
-    
-    # Get worker ID for tqdm positioning (usually 1-based index for Pool workers)
-    worker_id = multiprocessing.current_process()._identity[0]
-    
-    files = glob.glob(os.path.join(parent, competi, 'meta_html','*_C1.html'))
-    for file in tqdm(files, desc=f"Worker {worker_id}: {competi}", position=worker_id, leave=False):
-        entity[competi][file.split("/")[-1]] = {}
-        with open(os.path.join(parent, competi, 'meta_html',file.split("/")[-1]), "r", encoding="utf-8") as fp:
-            content = fp.read()
-            # Submission Year
-            pattern = r'<span [^>]*title="([A-Z][a-z]{2} [A-Z][a-z]{2} \d{2} \d{4} \d{2}:\d{2}:\d{2} GMT[+-]\d{4} \([^"]+\))"'
-            date = re.findall(pattern, content, re.DOTALL)[0]
-            # print(date)
-            date_str = date.split(" (")[0].replace("GMT", "")
-            # print(date_str)
-            dt = datetime.datetime.strptime(date_str, "%a %b %d %Y %H:%M:%S %z")
-
-            entity[competi][file.split("/")[-1]]['year'] = dt.year
-            entity[competi][file.split("/")[-1]]['month'] = dt.month
-            entity[competi][file.split("/")[-1]]['date'] = dt.day
-            entity[competi][file.split("/")[-1]]['datetime'] = dt.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-            
-            # Find Private Score     
-            pattern = r'<p class="sc-gQaihK[^"]*">\s*([-\d.]+)\s*</p>'
-            matches = re.findall(pattern, content, re.DOTALL)
-            # has P.Score
-            if matches:
-                entity[competi][file.split("/")[-1]]['ps'] =  matches[0]
-
-            # Extract all time blocks (non-greedy match with DOTALL)
-            pattern = r'<p\s+class="sc-gQaihK\s+(?:sc-bHbnRu|sc-hKjFaw)\s+bwaGMg\s+(?:hAkjhA|jGRPCU)">(.*?)</p>'
-            p_tags = re.findall(pattern, content, re.DOTALL)
-            for tag in p_tags:
-                seconds = time_to_seconds(tag)
-                if seconds is not None:
-                    entity[competi][file.split("/")[-1]]['runtime'] =  seconds
-
-            # Extract dependencies
-            path = os.path.join(parent, competi, 'html', file.split("/")[-1])
-            # Create notebook first
-            nb = new_notebook()
-            # Pass notebook to read_html_content to add cells directly
-            nb = read_html_content(path, nb)
-
-            # If no cells were added, add the whole content as one cell
-            if len(nb.cells) != 1:
-                file_deps = get_imports_from_file(nb, path=file)
-                entity[competi][file.split("/")[-1]]['api'] = list(file_deps)
-            else:
-                entity[competi][file.split("/")[-1]]['R'] = 1
-            
-
-            pattern = r'<p\s+class="sc-gQaihK sc-dyfHgC bwaGMg igmQhu">\s*(.*?)\s*</p>'
-            matches = re.findall(pattern, content, flags=re.DOTALL)
-            entity[competi][file.split("/")[-1]]['datasets'] =  list(set(matches))
-    
-    return entity
+        info['year'] = dt.year
+        info['month'] = dt.month
+        info['date'] = dt.day
+        info['datetime'] = dt.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    else:
+        # Without a date no version can be resolved: kept out of every later stage (see kernel_store)
+        print(f"No submission date found in {competi}/meta_html/{fname}")
+        info['no_date'] = 1
+
+    # has P.Score
+    if 'ps' in fields:
+        info['ps'] = fields['ps']
+
+    if 'runtime' in fields:
+        info['runtime'] = fields['runtime']
+
+    # Extract dependencies (parsed once, shared with the later stages via the notebook cache)
+    path = os.path.join(parent, competi, 'html', fname)
+    cached = load_notebook(path)
+
+    # No code cell found: not a python notebook
+    if cached['cells']:
+        # Resolved against another module index (--build-index, KNOWN_ALIASES): resolve again
+        if cached.get('api') is None or cached.get('api_index') != index_fingerprint():
+            nb = notebook_from_cells(cached['cells'], prelude=PANDAS_PRELUDE)
+            cached = store_imports(cached, get_imports_from_file(nb, path=path), index_fingerprint())
+        info['api'] = list(cached['api'])
+    else:
+        info['R'] = 1
+
+    info['datasets'] = fields.get('datasets', [])
     
+    return info, sources
+
+def process_kernel_task(args):
+    """Pool task: process one kernel and return it with its competition for the per-competition merge"""
+    competi, fname = args
+    info, sources = process_kernel(competi, fname, parent)
+    return competi, fname, info, sources
+
+def schedule_tasks(changed, manifest):
+    """One task per kernel, largest html first so the big notebooks do not end up as stragglers"""
+    def size(comp, fname):
+        html_sig = manifest[comp][fname]['html']
+        return (html_sig[0] if html_sig else 0) + manifest[comp][fname]['meta'][0]
+
+    tasks = [(comp, fname) for comp, fnames in changed.items() for fname in fnames]
+    tasks.sort(key=lambda task: size(*task), reverse=True)
+    return tasks
+
 def get_imports_from_file(notebook, path=None):
+    """Resolve dependencies in-process from the cells' AST; pigar only runs for names the index cannot map"""
+    cells = [cell.source for cell in notebook.cells if cell.cell_type == 'code']
+
+    # Identical code bodies (e.g. versions of the same kernel) are resolved once
+    digest = notebook_digest(cells, index_fingerprint())
+    deps = lookup_notebook_deps(digest)
+    if deps is not None:
+        return deps
+
+    # Per-cell memo: only the cells that changed since an earlier version are parsed
+    modules = memo_cell_modules(cells) - local_modules(cells)
+    deps, unresolved = resolve_modules(modules)
+    if unresolved:
+        deps = merge_distributions(deps, get_imports_with_pigar(notebook, path=path))
+    store_notebook_deps(digest, deps)
+    return deps
+
+def get_imports_with_pigar(notebook, path=None):
     """Use pigar to detect dependencies"""
     deps = set()
     with tempfile.TemporaryDirectory() as tmpdir:
@@ -186,7 +158,6 @@ def get_imports_from_file(notebook, path=None):
                         if pkg:
                             deps.add(pkg)
 
-                    time.sleep(0.5)
                     return deps
                 # If execution finished without timeout but no file was created, stop retrying
                 break
@@ -204,34 +175,199 @@ def get_imports_from_file(notebook, path=None):
     
     return deps
 
+def file_signature(path, previous=None):
+    """[size, mtime_ns, sha256] of a file; the hash is reused when size and mtime did not change"""
+    st = os.stat(path)
+    if previous and previous[0] == st.st_size and previous[1] == st.st_mtime_ns:
+        return previous
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return [st.st_size, st.st_mtime_ns, digest]
+
+def content_hashes(signature):
+    return [sig[2] if sig else None for sig in (signature.get('meta'), signature.get('html'))]
+
+def scan_competition(competi, parent, previous, done):
+    """Signatures of every meta/html pair of a competition and the file names not yet in its shard"""
+    signatures = {}
+    changed = []
+    for file in glob.glob(os.path.join(parent, competi, 'meta_html', '*_C1.html')):
+        fname = file.split("/")[-1]
+        old = previous.get(fname, {})
+        sig = {'meta': file_signature(file, old.get('meta'))}
+        html_path = os.path.join(parent, competi, 'html', fname)
+        sig['html'] = file_signature(html_path, old.get('html')) if os.path.exists(html_path) else None
+        signatures[fname] = sig
+        # Compare content hashes only: a touched but identical file is not reprocessed
+        if content_hashes(sig) != done.get(fname):
+            changed.append(fname)
+    return signatures, sorted(changed)
+
+def load_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+def write_json_atomic(path, data, indent=None):
+    """Write to a temp file next to path and rename, so a crash never leaves a truncated file"""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def shard_path(competi):
+    return os.path.join(SHARD_DIR, f"{competi}.ndjson")
+
+def read_shard(competi):
+    """{fname: record} of a competition shard; the last record of a kernel wins and a torn last line is ignored"""
+    records = {}
+    try:
+        with open(shard_path(competi), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[record['fname']] = record
+    except FileNotFoundError:
+        pass
+    return records
+
+def shard_hashes(competi):
+    """Content hashes of the kernels already processed into the shard"""
+    return {fname: record['hashes'] for fname, record in read_shard(competi).items()}
+
+def append_record(shards, competi, fname, hashes, info):
+    """Append one kernel to its competition shard; lines are flushed as they come in"""
+    f = shards.get(competi)
+    if f is None:
+        f = shards[competi] = open(shard_path(competi), "a", encoding="utf-8")
+    f.write(json.dumps({'fname': fname, 'hashes': hashes, 'info': info}, ensure_ascii=False) + "\n")
+    f.flush()
+
+def close_shard(shards, competi):
+    f = shards.pop(competi)
+    os.fsync(f.fileno())
+    f.close()
+
+def seed_shards(competitions, manifest):
+    """Turn an existing kernel.json (+ its manifest) into shards, for --incremental runs from before the shards"""
+    entity = load_json(KERNEL_PATH, {})
+    for comp in competitions:
+        records = [{'fname': fname, 'hashes': content_hashes(manifest[comp][fname]), 'info': info}
+                   for fname, info in entity.get(comp, {}).items() if fname in manifest.get(comp, {})]
+        if records:
+            with open(shard_path(comp), "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+
+def compact_shards(competitions, manifest):
+    """Rewrite every shard with one sorted record per kernel still on disk; drop shards of vanished competitions"""
+    for name in os.listdir(SHARD_DIR):
+        if not name.endswith(".ndjson") or name[:-len(".ndjson")] not in manifest:
+            os.remove(os.path.join(SHARD_DIR, name))
+    for comp in competitions:
+        records = read_shard(comp)
+        if not records:
+            continue
+        tmp = shard_path(comp) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for fname in sorted(records):
+                if fname in manifest[comp]:
+                    f.write(json.dumps(records[fname], ensure_ascii=False) + "\n")
+        os.replace(tmp, shard_path(comp))
+
+def iter_shards(competitions):
+    """(competition, {fname: info}) per non-empty shard, one competition in memory at a time"""
+    for comp in sorted(competitions):
+        files = {fname: record['info'] for fname, record in read_shard(comp).items()}
+        if files:
+            yield comp, files
+
+def write_kernel_json(path, pairs):
+    """Stream (competition, files) pairs into path, byte for byte what json.dump(entity, indent=4) writes"""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("{")
+        first = True
+        for comp, files in pairs:
+            body = json.dumps(files, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+            f.write(("" if first else ",") + f"\n    {json.dumps(comp, ensure_ascii=False)}: {body}")
+            first = False
+        f.write("}" if first else "\n}")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
 if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Build kernel.json from the crawled meta_html/html pages")
+    arg_parser.add_argument("--incremental", action="store_true",
+                            help=f"keep {SHARD_DIR}/ and only reprocess kernels that are new or changed since they were "
+                                 "written there (also resumes an interrupted run)")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    arg_parser.add_argument("--chunksize", type=int, default=4, help="kernels handed to a worker at a time")
+    cli = arg_parser.parse_args()
 
     # Get all competitions
     competitions = get_folders(parent)
-    
-    # Prepare arguments for each worker
-    args_list = [(comp, parent) for comp in competitions]
+
+    # Previous state (empty for a full rebuild)
+    previous_manifest = load_json(MANIFEST_PATH, {}) if cli.incremental else {}
+    if not cli.incremental and os.path.isdir(SHARD_DIR):
+        for name in os.listdir(SHARD_DIR):
+            os.remove(os.path.join(SHARD_DIR, name))
+    seed = cli.incremental and not os.path.isdir(SHARD_DIR) and os.path.exists(KERNEL_PATH)
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    if seed:
+        seed_shards(competitions, previous_manifest)
+
+    # Hash every meta/html pair (hashes are reused for files whose size and mtime did not change)
+    manifest = {}
+    changed = {}
+    for comp in tqdm(competitions, desc="Scanning"):
+        manifest[comp], changed[comp] = scan_competition(comp, parent, previous_manifest.get(comp, {}),
+                                                         shard_hashes(comp))
+
+    # One task per kernel, scheduled largest-first and handed out in small chunks
+    tasks = schedule_tasks(changed, manifest)
+    print(f"Processing {len(tasks)} new/changed kernels in {sum(1 for f in changed.values() if f)} competitions")
+
+    # Check the meta_html patterns on a sample first, so class-name drift shows up before the full pass
+    preflight = Coverage()
+    for comp, fname in random.Random(0).sample(tasks, min(len(tasks), 200)):
+        with open(os.path.join(parent, comp, 'meta_html', fname), "r", encoding="utf-8") as fp:
+            preflight.add(extract_meta_fields(fp.read())[1])
+    print("Preflight " + preflight.report())
     
     # Create a shared lock for tqdm
     # This prevents workers from writing to the terminal simultaneously
     tqdm_lock = RLock()
     tqdm.set_lock(tqdm_lock)
 
-    # Create pool with n workers
-    with Pool(processes=32, initializer=init_pool, initargs=(tqdm_lock,)) as pool:
-        # Use imap for progress bar
-        results = list(tqdm(
-            pool.imap(process_competition, args_list),
-            total=len(args_list),
-            desc="Competitions",
-            position=0  # Force main bar to stay at the top
-        ))
-    
-    # Merge all results
-    entity = {}
-    for result in results:
-        entity.update(result)
-        
-    # Save the entity dictionary into a JSON file.
-    with open("kernel.json", "w", encoding="utf-8") as json_file:
-        json.dump(entity, json_file, indent=4, ensure_ascii=False)
\ No newline at end of file
+    # Create pool with n workers; every result is appended to its competition shard as it arrives,
+    # so nothing is held in memory and a crash only loses the kernels still in flight
+    coverage = Coverage()
+    pending = {comp: len(files) for comp, files in changed.items() if files}
+    shards = {}
+    with Pool(processes=cli.workers, initializer=init_pool, initargs=(tqdm_lock,)) as pool:
+        for comp, fname, info, sources in tqdm(
+            pool.imap_unordered(process_kernel_task, tasks, chunksize=cli.chunksize),
+            total=len(tasks),
+            desc="Kernels",
+        ):
+            append_record(shards, comp, fname, content_hashes(manifest[comp][fname]), info)
+            coverage.add(sources)
+            pending[comp] -= 1
+            if not pending[comp]:
+                close_shard(shards, comp)
+    print(coverage.report())
+
+    # Compact the shards (one sorted record per kernel still on disk) and stream them into kernel.json
+    # and the store, one competition at a time (the manifest last, so it never runs ahead of kernel.json)
+    compact_shards(competitions, manifest)
+    write_kernel_json(KERNEL_PATH, iter_shards(competitions))
+    build_store(iter_shards(competitions))
+    write_json_atomic(MANIFEST_PATH, manifest)
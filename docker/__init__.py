@@ -0,0 +1 @@
+"""Image, venv and runner tooling (importable as docker.* with the repository root on sys.path)."""
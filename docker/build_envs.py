@@ -0,0 +1,203 @@
+"""
+Parallel host-side venv builder, the out-of-image alternative to the venv layers of Dockerfile.base.
+
+Every venv of docker/venv_batches.json (written by create_venv.py) is built in a process pool on
+the host under its own pyenv interpreter, at ENV_ROOT/{venv}. The venv name is the python minor
+plus the hash of its requirement set, so the directory is content-addressed: an unchanged venv
+is never rebuilt and a changed requirement set lands in a new directory. A failed pin only fails
+its own venv (ENV_ROOT/{venv}.log keeps the pip output); a finished venv carries ENV_ROOT/{venv}/.complete.
+
+Each venv also gets ipykernel (constrained to the pins) and a `kaggle_env` kernelspec, and is
+mounted read-only by build_docker_command of the runners at the same path, together with its
+pyenv interpreter, so the absolute paths inside the venv stay valid in the container:
+
+    python docker/build_envs.py [--workers 32] [--rebuild VENV ...] [--wheelhouse docker/wheelhouse]
+
+ENV_ROOT defaults to /opt/kaggle_envs (override with KAGGLE_ENV_ROOT); build the venvs on a host
+with the same OS release as the image so the interpreters find the same system libraries.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+from tqdm import tqdm
+
+# The repository root, for docker.dedup_envs (--dedup)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+ENV_ROOT = os.path.abspath(os.environ.get("KAGGLE_ENV_ROOT", "/opt/kaggle_envs"))
+# Next to this file, so the runners can build venvs from any working directory
+VENV_REQ_DIR = str(Path(__file__).resolve().parent / "venv_requirements")
+BATCHES_PATH = Path(__file__).resolve().parent / "venv_batches.json"
+VENV_MAP_PATH = Path(__file__).resolve().parent / "kernel_venv_map.json"
+KERNEL_NAME = "kaggle_env"
+MARKER = ".complete"
+
+
+def python_tag(minor):
+    return "cp" + minor.replace(".", "")
+
+
+def venv_python(venv_name):
+    """Python minor of a venv from its name, py3.6_<hash> -> 3.6"""
+    return venv_name[2:].split("_", 1)[0]
+
+
+def tree_inodes(path):
+    """{(device, inode): allocated bytes} of the files under path; hardlinks of one file count once"""
+    inodes = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            st = os.lstat(os.path.join(root, name))
+            inodes[st.st_dev, st.st_ino] = st.st_blocks * 512
+    return inodes
+
+
+def tree_bytes(path):
+    return sum(tree_inodes(path).values())
+
+
+def run(cmd, log, env=None):
+    """Run a build step with its output appended to the venv log; raises CalledProcessError"""
+    log.write(f"$ {' '.join(cmd)}\n")
+    log.flush()
+    subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, env=env, check=True)
+
+
+def prepare_interpreters(minors):
+    """pyenv install every minor missing on the host (any patch of it will do) with virtualenv"""
+    for minor in minors:
+        if subprocess.run(["pyenv", "prefix", minor], capture_output=True).returncode != 0:
+            subprocess.run(["pyenv", "install", minor], check=True)
+        env = dict(os.environ, PYENV_VERSION=minor)
+        subprocess.run(["pyenv", "exec", "python", "-m", "pip", "install", "-q", "--upgrade", "pip", "virtualenv"],
+                       env=env, check=True)
+
+
+def build_env(task):
+    """Build one venv; returns (venv, seconds, error or None)"""
+    venv_name, minor, wheelhouse = task
+    start = time.time()
+    path = f"{ENV_ROOT}/{venv_name}"
+    req_file = f"{VENV_REQ_DIR}/{venv_name}.txt"
+    # Pins create_venv.py left to the image: the host venv does not see the image, so it installs them too
+    image_pins = f"{VENV_REQ_DIR}/{venv_name}.image.txt"
+    req_args = ["-r", req_file] + (["-r", image_pins] if os.path.exists(image_pins) else [])
+    shutil.rmtree(path, ignore_errors=True)
+    failed_step = None
+    with open(f"{path}.log", "w", encoding="utf-8") as log:
+        try:
+            run(["pyenv", "exec", "python", "-m", "virtualenv", path], log, dict(os.environ, PYENV_VERSION=minor))
+            pip = [f"{path}/bin/python", "-m", "pip", "--disable-pip-version-check"]
+            source = ["--no-index", "--find-links", f"{wheelhouse}/{python_tag(minor)}"] if wheelhouse else []
+            if minor.startswith("3."):
+                run(pip + ["install"] + source + ["--upgrade", "pip"], log)
+            run(pip + ["install"] + source + req_args + ["--upgrade-strategy", "eager", "--prefer-binary"], log)
+            # The kernel of the notebook runs inside the venv; the pins stay as they are
+            constraints = [arg.replace("-r", "-c") for arg in req_args]
+            run(pip + ["install", "ipykernel"] + constraints + ["--prefer-binary"], log)
+        except subprocess.CalledProcessError as e:
+            failed_step = e
+    if failed_step is not None:
+        shutil.rmtree(path, ignore_errors=True)
+        with open(f"{path}.log", "r", encoding="utf-8", errors="replace") as log:
+            lines = [line.strip() for line in log if line.strip()]
+        return venv_name, time.time() - start, lines[-1] if lines else f"exit {failed_step.returncode}"
+
+    kernel_dir = f"{path}/share/jupyter/kernels/{KERNEL_NAME}"
+    os.makedirs(kernel_dir, exist_ok=True)
+    with open(f"{kernel_dir}/kernel.json", "w", encoding="utf-8") as f:
+        json.dump({"argv": [f"{path}/bin/python", "-m", "ipykernel_launcher", "-f", "{connection_file}"],
+                   "display_name": venv_name, "language": "python"}, f, indent=1)
+    # pyenv prefix the venv links to, mounted next to it
+    interpreter = Path(os.path.realpath(f"{path}/bin/python")).parents[1]
+    seconds = time.time() - start
+    with open(f"{path}/{MARKER}", "w", encoding="utf-8") as f:
+        json.dump({"python": minor, "interpreter": str(interpreter), "seconds": round(seconds, 1),
+                   "bytes": tree_bytes(path)}, f)
+    return venv_name, seconds, None
+
+
+def read_offline(wheelhouse):
+    """Venvs whose every wheel is in the wheelhouse (docker/build_wheelhouse.py)"""
+    path = f"{wheelhouse}/manifest.json" if wheelhouse else None
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return set(json.load(f)["complete"])
+
+
+def build_envs(workers=os.cpu_count(), rebuild=(), wheelhouse=None):
+    with open(BATCHES_PATH, "r", encoding="utf-8") as f:
+        venvs = {name: batch["python"] for batch in json.load(f).values() for name in batch["venvs"]}
+    os.makedirs(ENV_ROOT, exist_ok=True)
+    todo = sorted(name for name in venvs
+                  if name in rebuild or not os.path.exists(f"{ENV_ROOT}/{name}/{MARKER}"))
+    print(f"{len(venvs)} venvs, {len(venvs) - len(todo)} already built in {ENV_ROOT}, {len(todo)} to build")
+    if not todo:
+        return
+    prepare_interpreters(sorted({venvs[name] for name in todo}))
+
+    offline = read_offline(wheelhouse)
+    wheel_dir = os.path.abspath(wheelhouse) if wheelhouse else None
+    tasks = [(name, venvs[name], wheel_dir if name in offline else None) for name in todo]
+    failed = []
+    start = time.time()
+    with Pool(processes=workers) as pool:
+        for venv_name, seconds, error in tqdm(pool.imap_unordered(build_env, tasks), total=len(tasks), desc="Building venvs"):
+            if error:
+                failed.append(f"{venv_name} | {error} | see {ENV_ROOT}/{venv_name}.log\n")
+    with open(f"{ENV_ROOT}/failed.txt", "w", encoding="utf-8") as f:
+        f.writelines(sorted(failed))
+    print(f"Built {len(tasks) - len(failed)} venvs in {time.time() - start:.0f} s; {len(failed)} failed "
+          f"(see {ENV_ROOT}/failed.txt)")
+
+
+_venv_map = None
+
+def venv_for(compt, filename):
+    """Venv of a notebook from docker/kernel_venv_map.json, None when it has none"""
+    global _venv_map
+    if _venv_map is None:
+        _venv_map = {}
+        if VENV_MAP_PATH.exists():
+            with open(VENV_MAP_PATH, "r", encoding="utf-8") as f:
+                _venv_map = json.load(f)
+    # Kernel names may contain dots: strip only the suffix, as baseline/create_fullDataset.py does
+    stem = filename.split(".ipynb")[0]
+    return _venv_map.get(stem) or _venv_map.get(f"{compt}_{stem}")
+
+def env_docker_args(compt, filename):
+    """
+    (docker run options, nbconvert options) running a notebook in its host-built venv: the venv and
+    its interpreter are mounted read-only and the kernel is the venv's kaggle_env kernelspec.
+    ("", "") when the kernel has no finished venv, so the image's own python runs it
+    """
+    venv_name = venv_for(compt, filename)
+    path = f"{ENV_ROOT}/{venv_name}"
+    if not venv_name or not os.path.exists(f"{path}/{MARKER}"):
+        return "", ""
+    with open(f"{path}/{MARKER}", "r", encoding="utf-8") as f:
+        interpreter = json.load(f)["interpreter"]
+    opts = f" -v {path}:{path}:ro -v {interpreter}:{interpreter}:ro"
+    opts += f" -e VIRTUAL_ENV={path} -e JUPYTER_PATH={path}/share/jupyter"
+    return opts, f" --ExecutePreprocessor.kernel_name={KERNEL_NAME}"
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Build the kernel venvs on the host, one process per venv")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    arg_parser.add_argument("--rebuild", nargs="*", default=[], help="venvs to build again even if complete")
+    arg_parser.add_argument("--wheelhouse", default=None, help="install the venvs it covers with --no-index")
+    arg_parser.add_argument("--dedup", action="store_true", help="hardlink identical site-packages files afterwards")
+    cli = arg_parser.parse_args()
+    build_envs(cli.workers, set(cli.rebuild), cli.wheelhouse)
+    if cli.dedup:
+        from docker.dedup_envs import dedup_envs
+        dedup_envs()
@@ -0,0 +1,149 @@
+"""
+Local wheelhouse shared by every venv build; run it after create_venv.py and before docker build.
+
+The unique (package, version, python tag) triples pinned by the venv requirement files
+(docker/venv_requirements/, the apiDowngradeList pins after the wheel pre-flight) are put into
+docker/wheelhouse/{cpXY}/ exactly once:
+    1. every triple (and the newest pip) is downloaded once: binary only, no dependencies, for
+       the tags of the interpreter
+    2. every venv is resolved against its wheelhouse, which only downloads the dependencies still
+       missing (the first venv that needs one fetches it, the others find it there)
+    3. with --build, venvs that still miss a wheel are built by the matching pyenv interpreter
+docker/wheelhouse/manifest.json lists the venvs whose whole closure is in the wheelhouse;
+`python docker/create_venv.py --wheelhouse docker/wheelhouse` installs those with
+--no-index --find-links, without network access.
+
+    python docker/build_wheelhouse.py [--jobs 8] [--build]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from tqdm import tqdm
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from apiDowngrade.wheel_preflight import PLATFORMS, interpreter_abis, python_tag
+
+VENV_REQ_DIR = "docker/venv_requirements"
+BATCHES_PATH = "docker/venv_batches.json"
+WHEELHOUSE_DIR = "docker/wheelhouse"
+MANIFEST = "manifest.json"
+
+
+def target_args(minor):
+    """pip download options selecting the wheels of a pyenv CPython `minor` on linux x86_64"""
+    args = ["--only-binary=:all:", "--python-version", minor, "--implementation", "cp"]
+    for abi in interpreter_abis(minor) + ["abi3", "none"]:
+        args += ["--abi", abi]
+    for platform in PLATFORMS:
+        args += ["--platform", platform]
+    return args
+
+
+def pip(args, env=None, python=None):
+    """Run pip; returns None on success, else the last line of its error output"""
+    cmd = (python or [sys.executable]) + ["-m", "pip", "--disable-pip-version-check", "-q"] + args
+    proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    if proc.returncode == 0:
+        return None
+    lines = (proc.stderr or proc.stdout).strip().splitlines()
+    return lines[-1] if lines else f"exit {proc.returncode}"
+
+
+def read_venvs():
+    """{python minor: [venv names]} from the batches written by create_venv.py"""
+    with open(BATCHES_PATH, "r", encoding="utf-8") as f:
+        batches = json.load(f)
+    by_python = {}
+    for batch in batches.values():
+        by_python.setdefault(batch["python"], []).extend(batch["venvs"])
+    return by_python
+
+
+def req_files(venv_name):
+    """Requirement files of a venv: its own and the pins create_venv.py left to the image (host builds install both)"""
+    paths = [f"{VENV_REQ_DIR}/{venv_name}.txt", f"{VENV_REQ_DIR}/{venv_name}.image.txt"]
+    return [path for path in paths if os.path.exists(path)]
+
+
+def read_pins(venv_name):
+    pins = []
+    for path in req_files(venv_name):
+        with open(path, "r", encoding="utf-8") as f:
+            pins += [line.strip() for line in f if re.match(r"[a-z0-9-]+(\[[^\]]*\])?==", line)]
+    return pins
+
+
+def download_pins(minor, pins, wheel_dir, jobs):
+    """Stage 1: one binary download per unique pin; returns {pin: error} of the pins without a wheel"""
+    def fetch(pin):
+        return pin, pip(["download", "--no-deps", "--dest", wheel_dir] + target_args(minor) + [pin])
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(tqdm(executor.map(fetch, sorted(pins) + ["pip"]), total=len(pins) + 1,
+                            desc=f"Downloading {python_tag(minor)} pins"))
+    return {pin: error for pin, error in results if error}
+
+
+def resolve_venvs(minor, venvs, wheel_dir, build):
+    """Stages 2-3: fetch (or build) the missing dependencies of every venv; returns {venv: error}"""
+    failed = {}
+    interpreter = None
+    if build and shutil.which("pyenv"):
+        interpreter = ["pyenv", "exec", "python"]
+    env = dict(os.environ, PYENV_VERSION=minor)
+    # One venv at a time: the venvs of a minor share the directory and mostly the same dependencies
+    for venv_name in tqdm(venvs, desc=f"Resolving {python_tag(minor)} venvs"):
+        req_args = [arg for path in req_files(venv_name) for arg in ("-r", path)]
+        error = pip(["download"] + req_args + ["--dest", wheel_dir, "--find-links", wheel_dir] + target_args(minor))
+        if error and interpreter:
+            error = pip(["wheel"] + req_args + ["--wheel-dir", wheel_dir, "--find-links", wheel_dir],
+                        env=env, python=interpreter)
+        if error:
+            failed[venv_name] = error
+    return failed
+
+
+def build_wheelhouse(wheelhouse=WHEELHOUSE_DIR, jobs=8, build=False):
+    by_python = read_venvs()
+    manifest = {"complete": [], "failed": {}}
+
+    def run_minor(minor):
+        wheel_dir = f"{wheelhouse}/{python_tag(minor)}"
+        os.makedirs(wheel_dir, exist_ok=True)
+        venvs = by_python[minor]
+        pins = {pin for venv_name in venvs for pin in read_pins(venv_name)}
+        total = sum(len(read_pins(venv_name)) for venv_name in venvs)
+        print(f"python {minor}: {len(venvs)} venvs pin {total} packages, {len(pins)} unique")
+        missing = download_pins(minor, pins, wheel_dir, jobs)
+        if missing:
+            print(f"python {minor}: {len(missing)} pins have no wheel{' (building them)' if build else ''}")
+        return resolve_venvs(minor, venvs, wheel_dir, build)
+
+    # The interpreters use separate directories, so they can be filled at the same time
+    with ThreadPoolExecutor(max_workers=max(1, len(by_python))) as executor:
+        for minor, failed in zip(by_python, executor.map(run_minor, by_python)):
+            manifest["failed"].update(failed)
+            manifest["complete"].extend(v for v in by_python[minor] if v not in failed)
+
+    manifest["complete"].sort()
+    with open(f"{wheelhouse}/{MANIFEST}", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    size = sum(entry.stat().st_size for tag in os.scandir(wheelhouse) if tag.is_dir() for entry in os.scandir(tag.path))
+    print(f"Wheelhouse {wheelhouse}: {size / 1e9:.2f} GB, {len(manifest['complete'])} venvs complete, "
+          f"{len(manifest['failed'])} still need the index (see {wheelhouse}/{MANIFEST})")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Download or build every pinned wheel once into a local wheelhouse")
+    arg_parser.add_argument("--wheelhouse", default=WHEELHOUSE_DIR)
+    arg_parser.add_argument("--jobs", type=int, default=8, help="parallel pin downloads per interpreter")
+    arg_parser.add_argument("--build", action="store_true", help="build missing wheels with the pyenv interpreters")
+    cli = arg_parser.parse_args()
+    build_wheelhouse(cli.wheelhouse, cli.jobs, cli.build)
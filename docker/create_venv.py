@@ -1,15 +1,42 @@
+import argparse
+import hashlib
 import json
+import math
 import os
 import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
 from packaging import version
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from corpus.kernel_store import eligible_kernels
+from corpus.py_syntax import parse_minor, format_minor
+from apiDowngrade.release_timeline import parse_timestamp
+from apiDowngrade.wheel_preflight import WheelIndex, check_requirements, python_tag, DB_PATH as WHEEL_DB_PATH
+from baseline.check_missingAPIs import diff_pins, get_image_manifest
+
 # Paths
 BASE_IMAGE = "gcr.io/kaggle-gpu-images/python"
-JSON_PATH = "apiDowngrade/kernel_w_pyVersion.json"
 REQ_DIR = "apiDowngrade/apiDowngradeList"
 NLTK_CORPORA_FILE = "baseline/nltk_corpora.txt"
 DOCKERFILE_PATH = "docker/Dockerfile.base"
 REQUIREMENTS_PATH = "baseline/requirements.txt"
+VENV_REQ_DIR = "docker/venv_requirements"
+VENV_MAP_PATH = "docker/kernel_venv_map.json"
+SUBSTITUTIONS_LOG = "docker/wheel_substitutions.txt"
+BATCHES_PATH = "docker/venv_batches.json"
+BUILD_REPORT = "/opt/venvs/build_report.tsv"
+IMAGE_PINS_SUFFIX = ".image.txt"
+
+# Venv RUN layers; the base image already holds many of Docker's 127 layers
+MAX_VENV_LAYERS = 40
+PIP_CACHE = "--mount=type=cache,target=/root/.cache/pip"
+
+# Requirements are pinned by submission date, so a kernel is only moved to an interpreter at most
+# this many minors older than the one picked for that date (older ones tend to miss the wheels)
+MAX_MINOR_DOWNGRADE = 2
 
 def parse_version(v):
     # Returns (major, minor, patch_int, original_patch_str)
@@ -27,27 +54,22 @@ def parse_version(v):
             patch_str = m.group(1)
     return (major, minor, patch, patch_str)
 
-def load_kernel():
-    with open(JSON_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def collect_tasks(kernel):
+def collect_tasks():
     tasks = []
     versions_used = set()
-    for compt, files in kernel.items():
-        for fname, meta in files.items():
-            if ("ps" in meta and
-                meta.get('runtime', float('inf')) <= 600 and
-                len(meta.get('datasets', [])) <= 1 and
-                "R" not in meta):
-                py_ver = meta.get("python")
-                if not py_ver:
-                    print(f"!!!Skipping {compt}_{fname} due to missing python version!!!")
-                    continue
-                env_name = f"{compt}_{fname.split('.')[0]}"
-                tasks.append((env_name, py_ver))
-                versions_used.add(py_ver)
-    return tasks, versions_used
+    submitted = {}
+    # Kernels with python versions assigned by apiDowngrade/python_versions_update.py
+    for meta in eligible_kernels():
+        compt, fname = meta['competition'], meta['fname']
+        py_ver = meta.get("python")
+        if not py_ver:
+            print(f"!!!Skipping {compt}_{fname} due to missing python version!!!")
+            continue
+        env_name = f"{compt}_{fname.split('.html')[0]}"
+        tasks.append((env_name, py_ver, meta.get("python_range")))
+        versions_used.add(py_ver)
+        submitted[env_name] = meta["datetime"]
+    return tasks, versions_used, submitted
 
 def consolidate_versions(versions):
     # # Keep only highest patch per (major, minor)
@@ -89,7 +111,7 @@ def map_task_versions(tasks, consolidated_map=None):
 
     # Keep only first encountered version per (major, minor)
     mapped = []
-    for env_name, original_v in tasks:
+    for env_name, original_v, _ in tasks:
         pv = parse_version(original_v)
         if not pv:
             continue
@@ -99,14 +121,186 @@ def map_task_versions(tasks, consolidated_map=None):
         mapped.append((env_name, chosen))
     return mapped
 
+def allowed_minors(original_v, python_range):
+    """(lowest, highest) minor a kernel may run on: its date-picked minor, widened down to its syntax range"""
+    pv = parse_version(original_v)
+    if not pv:
+        return None
+    picked = (pv[0], pv[1])
+    if not python_range:
+        return picked, picked
+    low = max(parse_minor(python_range[0]), (picked[0], max(picked[1] - MAX_MINOR_DOWNGRADE, 0)))
+    high = min(parse_minor(python_range[1]), picked)
+    if low > high:
+        return picked, picked
+    return low, high
+
+def collapse_task_versions(tasks):
+    """
+    Map every kernel to a major.minor interpreter using as few interpreters as possible:
+    greedy interval stabbing over the allowed ranges (sorted by upper end, each uncovered range
+    adds its upper end), then every kernel takes the newest chosen minor inside its range
+    """
+    ranges = []
+    for env_name, original_v, python_range in tasks:
+        allowed = allowed_minors(original_v, python_range)
+        if allowed:
+            ranges.append((env_name, allowed))
+
+    chosen = []
+    for _, (low, high) in sorted(ranges, key=lambda r: r[1][1]):
+        if not chosen or chosen[-1] < low:
+            chosen.append(high)
+
+    mapped = []
+    for env_name, (low, high) in ranges:
+        mapped.append((env_name, format_minor(max(c for c in chosen if low <= c <= high))))
+    return mapped
+
+def canonical_requirements(path):
+    """Sorted, de-duplicated requirement lines with PEP 503 names and no comments or spaces"""
+    lines = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            m = re.match(r"([A-Za-z0-9][A-Za-z0-9._-]*)(.*)", line)
+            if m:
+                line = re.sub(r"[-_.]+", "-", m.group(1)).lower() + re.sub(r"\s+", "", m.group(2))
+            lines.add(line)
+    return tuple(sorted(lines))
+
+def group_venvs(mapped_tasks, submitted=None, wheel_index=None, image=None):
+    """
+    One venv per (python minor, requirement set): returns {venv_name: (py_ver, requirements, image_pins)},
+    {env_name: venv_name} and the wheel pre-flight log lines. The venv name is the minor plus a
+    hash of the canonical requirements, taken after pins without a wheel were substituted.
+    On the image's own python minor, the pins the image manifest satisfies go to image_pins
+    """
+    venvs, kernel_venv, log = {}, {}, []
+    for env_name, py_ver in mapped_tasks:
+        req_file = f"{REQ_DIR}/{env_name}.txt"
+        if not os.path.exists(req_file):
+            print(f"!!!Skipping {env_name} due to missing requirement file!!!")
+            continue
+        requirements = canonical_requirements(req_file)
+        image_pins = ()
+        if image is not None and py_ver == image["python"]:
+            # Installed in the image already: no wheel pre-flight needed for them
+            image_pins, _, _ = diff_pins(image["packages"], requirements)
+            image_pins = tuple(image_pins)
+            requirements = tuple(line for line in requirements if line not in image_pins)
+        if wheel_index is not None:
+            requirements, changes = check_requirements(
+                wheel_index, requirements, py_ver, round(parse_timestamp(submitted[env_name]) * 1000))
+            for package, pin, ver, reason in changes:
+                if ver != pin:
+                    log.append(f"{env_name} | py{py_ver} | {package}=={pin} -> {package}=={ver}\n")
+                else:
+                    log.append(f"{env_name} | py{py_ver} | {package}=={pin} kept: {reason}\n")
+        # The whole set, so kernels with the same pins share a venv whatever the image satisfies
+        digest = hashlib.sha256("\n".join(sorted(requirements + image_pins)).encode("utf-8")).hexdigest()[:12]
+        venv_name = f"py{py_ver}_{digest}"
+        venvs.setdefault(venv_name, (py_ver, requirements, image_pins))
+        kernel_venv[env_name] = venv_name
+    return venvs, kernel_venv, log
+
+def write_venv_files(venvs, kernel_venv):
+    """
+    docker/venv_requirements/{venv}.txt (and {venv}.image.txt, the pins the image satisfies) for
+    the image and the kernel -> venv map for the runner
+    """
+    shutil.rmtree(VENV_REQ_DIR, ignore_errors=True)
+    os.makedirs(VENV_REQ_DIR)
+    for venv_name, (_, requirements, image_pins) in venvs.items():
+        with open(f"{VENV_REQ_DIR}/{venv_name}.txt", "w", encoding="utf-8") as f:
+            f.writelines(f"{line}\n" for line in requirements)
+        if image_pins:
+            with open(f"{VENV_REQ_DIR}/{venv_name}{IMAGE_PINS_SUFFIX}", "w", encoding="utf-8") as f:
+                f.writelines(f"{line}\n" for line in image_pins)
+    with open(VENV_MAP_PATH, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(kernel_venv.items())), f, indent=2)
+
+def batch_venvs(venvs, max_layers=MAX_VENV_LAYERS):
+    """
+    [(py_ver, venv names)] with one RUN layer each: the venvs of every interpreter are cut into
+    batches of the same size, so there are at most max_layers + (number of interpreters) layers
+    """
+    by_python = {}
+    for venv_name, (py_ver, _, _) in sorted(venvs.items()):
+        by_python.setdefault(py_ver, []).append(venv_name)
+    size = max(1, math.ceil(len(venvs) / max_layers))
+    batches = []
+    for py_ver in sorted(by_python, key=lambda v: version.parse(v)):
+        names = by_python[py_ver]
+        for i in range(0, len(names), size):
+            batches.append((py_ver, names[i:i + size]))
+    return batches
+
+def read_wheelhouse_manifest(wheelhouse):
+    """Venvs whose every wheel is in the wheelhouse (docker/build_wheelhouse.py)"""
+    path = f"{wheelhouse}/manifest.json" if wheelhouse else None
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return set(json.load(f)["complete"])
+
+def batch_command(batch_id, py_ver, names, wheelhouse=None, offline=frozenset(), image_venvs=frozenset(),
+                  image_python=None):
+    """
+    One RUN building every venv of a batch; it appends (batch, python, venvs, seconds, bytes) to
+    BUILD_REPORT. Venvs in `offline` install from the bind-mounted wheelhouse without the index;
+    venvs in `image_venvs` are made from image_python with its site-packages and keep its
+    versions of the pins it satisfies (as constraints) instead of installing them
+    """
+    mounts = PIP_CACHE
+    if offline.intersection(names):
+        mounts += f" --mount=type=bind,source={wheelhouse},target=/wheelhouse"
+    lines = [f"# Batch {batch_id}: python {py_ver}, {len(names)} venvs",
+             f"RUN {mounts} <<'EOF'", "set -e", "start=$(date +%s)", f"pyenv local {py_ver}"]
+    for venv_name in names:
+        # 1. Create venv 2. Install requirements with its own pip (the pip cache is shared by all batches)
+        source = f" --no-index --find-links /wheelhouse/{python_tag(py_ver)}" if venv_name in offline else ""
+        cmd = f"virtualenv {venv_name}"
+        if venv_name in image_venvs:
+            cmd = f"virtualenv --system-site-packages -p {image_python} {venv_name}"
+            source += f" -c /tmp/requirements/{venv_name}{IMAGE_PINS_SUFFIX}"
+        if py_ver.startswith("3."):
+            cmd += f" && {venv_name}/bin/python -m pip install{source} --upgrade pip"
+        cmd += f" && {venv_name}/bin/python -m pip install{source} -r /tmp/requirements/{venv_name}.txt --upgrade-strategy eager --prefer-binary"
+        lines.append(cmd)
+    lines.append(f'printf "%s\\t%s\\t%s\\t%s\\t%s\\n" {batch_id} {py_ver} {len(names)} "$(( $(date +%s) - start ))" '
+                 f'"$(du -scb {" ".join(names)} | tail -n 1 | cut -f 1)" >> {BUILD_REPORT}')
+    lines.append("EOF")
+    return "\n".join(lines) + "\n\n"
+
+def print_build_report(image):
+    """Build time and size of every venv batch, read back from BUILD_REPORT in the built image"""
+    out = subprocess.run(["docker", "run", "--rm", image, "cat", BUILD_REPORT],
+                         capture_output=True, text=True, check=True).stdout
+    rows = [line.split("\t") for line in out.splitlines() if line.strip()]
+    print(f"{'batch':>5} {'python':>6} {'venvs':>5} {'seconds':>8} {'GB':>7} {'s/venv':>7} {'MB/venv':>8}")
+    per_python = {}
+    for batch_id, py_ver, n, seconds, size in sorted(rows, key=lambda r: int(r[0])):
+        n, seconds, size = int(n), int(seconds), int(size)
+        print(f"{batch_id:>5} {py_ver:>6} {n:>5} {seconds:>8} {size / 1e9:>7.2f} {seconds / n:>7.1f} {size / n / 1e6:>8.1f}")
+        total = per_python.setdefault(py_ver, [0, 0, 0])
+        total[0] += n
+        total[1] += seconds
+        total[2] += size
+    for py_ver, (n, seconds, size) in per_python.items():
+        print(f"python {py_ver}: {n} venvs, {seconds} s, {size / 1e9:.2f} GB")
+
 def read_nltk_corpora():
     with open(NLTK_CORPORA_FILE, "r", encoding="utf-8") as f:
         return [l.strip() for l in f if l.strip() and not l.startswith("#")]
 
 # Header of the Dockerfile
-dockerfile_content = f"""# docker pull gcr.io/kaggle-images/python:latest (CPU-only) or gcr.io/kaggle-gpu-images/python:latest (GPU)
-# Then build as follows:
-# DOCKER_BUILDKIT=0 docker build --platform=linux/amd64 -t kaggle_code_envs -f docker/Dockerfile.base .
+dockerfile_content = f"""# syntax=docker/dockerfile:1.4
+# docker pull gcr.io/kaggle-images/python:latest (CPU-only) or gcr.io/kaggle-gpu-images/python:latest (GPU)
+# Then build as follows (BuildKit: cache mounts and heredocs):
+# DOCKER_BUILDKIT=1 docker build --platform=linux/amd64 -t kaggle_code_envs -f docker/Dockerfile.base .
 FROM {BASE_IMAGE}
 
 # Avoid interactive dialog
@@ -127,7 +321,7 @@ RUN apt-get update && apt-get install -y --no-install-recommends \\
 # 2. Install basic APIs that kaggle images do not include
 ARG REQUIREMENTS=/tmp/requirements.txt
 COPY {REQUIREMENTS_PATH} """+ """${REQUIREMENTS}
-RUN pip install --upgrade pip setuptools wheel && \\
+RUN --mount=type=cache,target=/root/.cache/pip pip install --upgrade pip setuptools wheel && \\
     python -m pip install --upgrade pip && \\
     # grep -v '^#' requirements.txt | xargs -n 1 pip install #--prefer-binary 
     pip install -r ${REQUIREMENTS} --prefer-binary 
@@ -157,12 +351,37 @@ RUN curl -fsSL https://pyenv.run | bash
 
 """
 
-def generate_dockerfile():
-    kernel = load_kernel()
-    tasks, versions_used = collect_tasks(kernel)
-    consolidated_versions = consolidate_versions(versions_used)
+def generate_dockerfile(preflight=True, wheelhouse=None, max_layers=MAX_VENV_LAYERS, reuse_image=False):
+    tasks, versions_used, submitted = collect_tasks()
     # mapped_tasks = map_task_versions(tasks, consolidated_map)
-    mapped_tasks = map_task_versions(tasks)
+    mapped_tasks = collapse_task_versions(tasks)
+    wheel_index = WheelIndex(WHEEL_DB_PATH, wheelhouse) if preflight else None
+    # Opt-in: the reusing venvs see the image's site-packages, so unpinned imports get its versions
+    image = get_image_manifest(BASE_IMAGE) if reuse_image else None
+    if reuse_image and image is None:
+        print("No manifest of the base image: every pin is installed in the venvs")
+    venvs, kernel_venv, substitutions = group_venvs(mapped_tasks, submitted, wheel_index, image)
+    write_venv_files(venvs, kernel_venv)
+    if wheel_index is not None:
+        if wheel_index.unknown:
+            print(f"Wheel pre-flight: {len(wheel_index.unknown)} packages have no cached index metadata and were "
+                  f"kept as pinned (python apiDowngrade/wheel_preflight.py --refresh)")
+        wheel_index.close()
+        with open(SUBSTITUTIONS_LOG, "w", encoding="utf-8") as f:
+            f.writelines(substitutions)
+        moved = sum(1 for line in substitutions if " -> " in line)
+        print(f"Wheel pre-flight: {moved} pins substituted, {len(substitutions) - moved} kept without a wheel "
+              f"(see {SUBSTITUTIONS_LOG})")
+    image_venvs = {venv_name for venv_name, (_, _, image_pins) in venvs.items() if image_pins}
+    if image is not None:
+        skipped = sum(len(image_pins) for _, _, image_pins in venvs.values())
+        print(f"Image manifest: {len(image_venvs)} python {image['python']} venvs reuse {skipped} pins "
+              f"installed in {BASE_IMAGE}")
+    consolidated_versions = {py_ver for py_ver, _, _ in venvs.values()}
+    print(f"{len(consolidate_versions(versions_used))} interpreters by submission date, "
+          f"{len(consolidated_versions)} after collapsing on the syntax ranges")
+    print(f"{len(kernel_venv)} kernels share {len(venvs)} venvs by (python minor, requirement set); "
+          f"mapping written to {VENV_MAP_PATH}")
     nltk_corpora = read_nltk_corpora()
 
 
@@ -191,42 +410,32 @@ EOF
 """
 
     dockerfile_content_local += f"""# 6. Copy requirement files into the image
-COPY {REQ_DIR} /tmp/requirements/
+COPY {VENV_REQ_DIR} /tmp/requirements/
 
 # 7. Pre-install necessary Python versions using pyenv
 # We collect all unique versions first to minimize build layers
 """
     
-    # Sort versions to keep build deterministic
+    # Sort versions to keep build deterministic; pyenv keeps the downloaded sources in $PYENV_ROOT/cache
     for py_ver in sorted(consolidated_versions, key=lambda v: version.parse(v)):
-        dockerfile_content_local += f"RUN eval \"$(pyenv init -)\" && pyenv install {py_ver} && pyenv global {py_ver} && pip install --upgrade pip virtualenv\n"
+        dockerfile_content_local += f"RUN {PIP_CACHE} --mount=type=cache,target=/opt/pyenv/cache eval \"$(pyenv init -)\" && pyenv install {py_ver} && pyenv global {py_ver} && pip install --upgrade pip virtualenv\n"
 
     dockerfile_content_local += "\n# Creating Virtual Environments and Installing Requirements\n"
     dockerfile_content_local += "WORKDIR /opt/venvs\n\n"
 
     # Add commands to create venvs and install requirements
-    # We group them to reduce layers for better image size
-    
-    for env_name, py_ver in mapped_tasks:
-        req_file = f"/tmp/requirements/{env_name}.txt"
-        
-        # Command:
-        # 1. Switch to specific python version
-        # 2. Create venv
-        # 3. Activate and install requirements
-        cmd = f"""RUN pyenv local {py_ver} && \\
-    virtualenv {env_name} && \\
-    . {env_name}/bin/activate && \\
-    pip install --upgrade pip && \\
-    pip install -r /tmp/requirements/{env_name}.txt --upgrade-strategy eager --prefer-binary 
-
-""" if py_ver.startswith("3.") else f"""RUN pyenv local {py_ver} && \\
-    virtualenv {env_name} && \\
-    . {env_name}/bin/activate && \\
-    pip install -r /tmp/requirements/{env_name}.txt --upgrade-strategy eager --prefer-binary 
-
-"""
-        dockerfile_content_local += cmd
+    # Kernels with the same interpreter and requirement set share one venv (see VENV_MAP_PATH), and
+    # the venvs are built in a bounded number of layers per interpreter (see BATCHES_PATH)
+    batches = batch_venvs(venvs, max_layers)
+    offline = read_wheelhouse_manifest(wheelhouse).intersection(venvs)
+    if wheelhouse:
+        print(f"{len(offline)} of {len(venvs)} venvs install from the wheelhouse {wheelhouse} without the index")
+    for batch_id, (py_ver, names) in enumerate(batches):
+        dockerfile_content_local += batch_command(batch_id, py_ver, names, wheelhouse, offline, image_venvs,
+                                                  image and image["executable"])
+    with open(BATCHES_PATH, "w", encoding="utf-8") as f:
+        json.dump({batch_id: {"python": py_ver, "venvs": names} for batch_id, (py_ver, names) in enumerate(batches)},
+                  f, indent=2)
 
     # Final cleanup
     dockerfile_content_local += "\n# Cleanup\nRUN rm -rf /tmp\n"
@@ -236,7 +445,22 @@ COPY {REQ_DIR} /tmp/requirements/
     with open(DOCKERFILE_PATH, "w", encoding="utf-8") as f:
         f.write(dockerfile_content_local)
     
-    print(f"Dockerfile generated at {DOCKERFILE_PATH} with {len(tasks)} environments.")
+    print(f"Dockerfile generated at {DOCKERFILE_PATH} with {len(venvs)} environments for {len(kernel_venv)} kernels "
+          f"in {len(batches)} layers.")
 
 if __name__ == "__main__":
-    generate_dockerfile()
\ No newline at end of file
+    arg_parser = argparse.ArgumentParser(description="Generate docker/Dockerfile.base with one venv per requirement set")
+    arg_parser.add_argument("--no-preflight", action="store_true",
+                            help="keep every pin even without a wheel (skips apiDowngrade/wheel_preflight.py)")
+    arg_parser.add_argument("--wheelhouse", default=None, help="local wheelhouse (docker/build_wheelhouse.py): its wheels count as available and "
+                                 "the venvs it covers install from it with --no-index")
+    arg_parser.add_argument("--max-layers", type=int, default=MAX_VENV_LAYERS, help="RUN layers for the venvs (about)")
+    arg_parser.add_argument("--reuse-image-packages", action="store_true",
+                            help="skip the pins the base image has and build those venvs with --system-site-packages "
+                                 "(imports the requirements do not pin then resolve to the image's packages)")
+    arg_parser.add_argument("--report", metavar="IMAGE", help="print the build time and size of every venv batch of a built image")
+    cli = arg_parser.parse_args()
+    if cli.report:
+        print_build_report(cli.report)
+    else:
+        generate_dockerfile(not cli.no_preflight, cli.wheelhouse, cli.max_layers, cli.reuse_image_packages)
\ No newline at end of file
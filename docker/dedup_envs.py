@@ -0,0 +1,117 @@
+"""
+Content-addressed hardlink store for the site-packages of the host-built venvs (docker/build_envs.py).
+
+Every regular file under ENV_ROOT/{venv}/lib/python*/site-packages is hashed; the first copy of a
+content goes into ENV_ROOT/.store/{sha256[:2]}/{sha256}-{mode} and every venv file with the same
+content and permissions becomes a hardlink to it. The same numpy release installed in hundreds of
+venvs is then on disk (and in the page cache) once. Sources (.py) and their bytecode (.pyc) are
+left alone: hardlinks share one mtime, which would invalidate the timestamp-based .pyc of the
+other venvs. Files already linked (more than one link) are skipped, so a rerun only hashes new venvs.
+
+The store must be on the same filesystem as the venvs. Files are never modified in place (the
+venvs are mounted read-only and pip replaces files on reinstall), so sharing an inode is safe.
+
+    python docker/dedup_envs.py [--jobs 8]          # also: python docker/build_envs.py --dedup
+"""
+import argparse
+import errno
+import glob
+import hashlib
+import os
+import stat
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from tqdm import tqdm
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from docker.build_envs import ENV_ROOT, MARKER
+
+STORE = f"{ENV_ROOT}/.store"
+SKIP_SUFFIXES = (".py", ".pyc")
+CHUNK = 1 << 20
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def candidates(venv_dir):
+    """(path, stat) of the files of a venv's site-packages that are not shared yet"""
+    for site in glob.glob(f"{venv_dir}/lib/python*/site-packages"):
+        for root, _, files in os.walk(site):
+            for name in files:
+                if name.endswith(SKIP_SUFFIXES):
+                    continue
+                path = os.path.join(root, name)
+                st = os.lstat(path)
+                if stat.S_ISREG(st.st_mode) and st.st_size > 0 and st.st_nlink == 1:
+                    yield path, st
+
+
+def link_into_store(path, st, digest):
+    """Replace path by a hardlink to the store copy of its content; returns the bytes freed"""
+    target = f"{STORE}/{digest[:2]}/{digest}-{stat.S_IMODE(st.st_mode):o}"
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(path, target)
+            return 0
+        except FileExistsError:
+            pass
+    tmp = f"{path}.dedup"
+    try:
+        os.link(target, tmp)
+    except OSError as e:
+        if e.errno == errno.EMLINK:   # the filesystem's link limit: keep this copy
+            return 0
+        raise
+    os.replace(tmp, path)
+    return st.st_size
+
+
+def prune_store():
+    """Drop the store files no venv links to any more (rebuilt or removed venvs); stat of the others"""
+    store = []
+    for p in glob.glob(f"{STORE}/*/*"):
+        st = os.lstat(p)
+        if st.st_nlink == 1:
+            os.remove(p)
+        else:
+            store.append(st)
+    return store
+
+
+def dedup_envs(jobs=8):
+    venvs = sorted(d for d in glob.glob(f"{ENV_ROOT}/*") if os.path.exists(f"{d}/{MARKER}"))
+    files = [c for venv_dir in venvs for c in candidates(venv_dir)]
+    print(f"{len(venvs)} venvs in {ENV_ROOT}: {len(files)} files not in the store yet "
+          f"({sum(st.st_size for _, st in files) / 1e9:.2f} GB)")
+
+    saved, linked = 0, 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Hash in threads (hashlib releases the GIL); link in order so the first copy becomes the store copy
+        digests = executor.map(lambda c: file_digest(c[0]), files)
+        for (path, st), digest in tqdm(zip(files, digests), total=len(files), desc="Deduplicating"):
+            freed = link_into_store(path, st, digest)
+            saved += freed
+            linked += freed > 0
+
+    store = prune_store()
+    # A store file with n links stands for n - 1 venv copies, n - 2 of which no longer take space
+    total_saved = sum(st.st_size * max(st.st_nlink - 2, 0) for st in store)
+    print(f"Linked {linked} files to the store, {saved / 1e9:.2f} GB saved by this pass; the store holds "
+          f"{sum(st.st_size for st in store) / 1e9:.2f} GB of unique content, {total_saved / 1e9:.2f} GB saved in total")
+    return saved
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Hardlink identical site-packages files of the host-built venvs")
+    arg_parser.add_argument("--jobs", type=int, default=8, help="hashing threads")
+    cli = arg_parser.parse_args()
+    dedup_envs(cli.jobs)
@@ -0,0 +1,206 @@
+"""
+On-demand venv materialization for the runners: a bounded LRU disk cache of host-built venvs.
+
+Instead of building every venv up front (docker/build_envs.py), a runner asks for the venv of a
+kernel when its job is dequeued and builds the next ones in the background:
+
+    env_cache = EnvCache()
+    env_cache.prefetch([(compt, upcoming_file), ...])   # background builds for the next jobs
+    venv = env_cache.acquire(compt, filename)           # built now if needed, then pinned
+    ... docker run (build_docker_command mounts it) ...
+    env_cache.release(venv)
+
+The cache is ENV_ROOT itself, shared by every runner process on the host:
+  - a venv is built once (flock per venv); other processes wait for it, prefetching skips it
+  - a venv in use has a pin file ({venv}@{pid}-...) and is never evicted; pins of dead
+    processes are dropped
+  - after each build, the least recently used unpinned venvs are removed until the cache fits in
+    KAGGLE_ENV_CACHE_GB (the mtime of a venv's .complete marker is its last use); the disk use
+    counts every inode once, so files hardlinked into the store by dedup_envs.py are not counted per venv
+"""
+import fcntl
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from docker.build_envs import (ENV_ROOT, MARKER, build_env, prepare_interpreters, read_offline, tree_inodes,
+                                venv_for, venv_python)
+from docker.dedup_envs import prune_store
+
+MAX_BYTES = float(os.environ.get("KAGGLE_ENV_CACHE_GB", "200")) * 1e9
+PREFETCH_AHEAD = 2
+PIN_DIR = f"{ENV_ROOT}/.pins"
+LOCK_DIR = f"{ENV_ROOT}/.locks"
+
+
+@contextmanager
+def flock(path, blocking=True):
+    """Exclusive lock on a lock file; yields False when non-blocking and already held"""
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def complete(venv_name):
+    return os.path.exists(f"{ENV_ROOT}/{venv_name}/{MARKER}")
+
+
+class EnvCache:
+    def __init__(self, max_bytes=MAX_BYTES, prefetch_workers=1, wheelhouse=None):
+        os.makedirs(PIN_DIR, exist_ok=True)
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.wheelhouse = os.path.abspath(wheelhouse) if wheelhouse else None
+        self.offline = read_offline(wheelhouse)
+        self.pins = {}
+        self.prepared = set()
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=prefetch_workers)
+
+    def build(self, venv_name, blocking=True):
+        """Build a venv unless it is complete; False when it failed (or, non-blocking, is being built)"""
+        with flock(f"{LOCK_DIR}/{venv_name}.lock", blocking) as locked:
+            if not locked:
+                return False
+            if complete(venv_name):
+                return True
+            minor = venv_python(venv_name)
+            with flock(f"{LOCK_DIR}/interpreters.lock"):
+                if minor not in self.prepared:
+                    prepare_interpreters([minor])
+                    self.prepared.add(minor)
+            wheel_dir = self.wheelhouse if venv_name in self.offline else None
+            _, seconds, error = build_env((venv_name, minor, wheel_dir))
+        if error:
+            print(f"Venv {venv_name} failed: {error}")
+            return False
+        print(f"Venv {venv_name} built in {seconds:.0f} s")
+        self.evict()
+        return True
+
+    def acquire(self, compt, filename):
+        """Materialize and pin the venv of a notebook; None when it has none or it cannot be built"""
+        venv_name = venv_for(compt, filename)
+        if venv_name is None:
+            return None
+        # Retry once: another runner may evict the venv between the build and the pin
+        for _ in range(2):
+            try:
+                if not self.build(venv_name):
+                    return None
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"Venv {venv_name} unavailable: {e}")
+                return None
+            with flock(f"{LOCK_DIR}/cache.lock"):
+                if complete(venv_name):
+                    pin = f"{PIN_DIR}/{venv_name}@{os.getpid()}-{uuid.uuid4().hex[:8]}"
+                    open(pin, "w").close()
+                    os.utime(f"{ENV_ROOT}/{venv_name}/{MARKER}")
+                    self.pins.setdefault(venv_name, []).append(pin)
+                    return venv_name
+        return None
+
+    def release(self, venv_name):
+        if venv_name and self.pins.get(venv_name):
+            os.remove(self.pins[venv_name].pop())
+
+    def pinned(self):
+        """Venvs pinned by a live process; drops the pins of dead ones"""
+        names = set()
+        for pin in os.listdir(PIN_DIR):
+            venv_name, _, owner = pin.rpartition("@")
+            if pid_alive(int(owner.split("-")[0])):
+                names.add(venv_name)
+            else:
+                os.remove(f"{PIN_DIR}/{pin}")
+        return names
+
+    def evict(self):
+        """Remove the least recently used unpinned venvs until the cache fits in max_bytes"""
+        with flock(f"{LOCK_DIR}/cache.lock"):
+            venvs = []
+            for marker in glob.glob(f"{ENV_ROOT}/*/{MARKER}"):
+                with open(marker, "r", encoding="utf-8") as f:
+                    size = json.load(f).get("bytes", 0)
+                venvs.append((os.stat(marker).st_mtime, os.path.basename(os.path.dirname(marker)), size))
+            # The build-time sizes count every file of a venv: an upper bound once files are shared
+            if sum(size for _, _, size in venvs) <= self.max_bytes:
+                return
+            # After docker/dedup_envs.py a file hardlinked into many venvs takes its blocks once, and
+            # removing a venv frees only the files no other venv links to
+            inodes = {venv_name: tree_inodes(f"{ENV_ROOT}/{venv_name}") for _, venv_name, _ in venvs}
+            links = Counter(inode for files in inodes.values() for inode in files)
+            total = sum({inode: size for files in inodes.values() for inode, size in files.items()}.values())
+            pinned = self.pinned()
+            evicted = False
+            for _, venv_name, _ in sorted(venvs):
+                if total <= self.max_bytes:
+                    break
+                if venv_name in pinned:
+                    continue
+                # Incomplete first, so nobody picks it up while it is being removed
+                os.remove(f"{ENV_ROOT}/{venv_name}/{MARKER}")
+                shutil.rmtree(f"{ENV_ROOT}/{venv_name}", ignore_errors=True)
+                freed = 0
+                for inode, size in inodes[venv_name].items():
+                    links[inode] -= 1
+                    freed += size if links[inode] == 0 else 0
+                total -= freed
+                evicted = True
+                print(f"Evicted venv {venv_name} ({freed / 1e9:.2f} GB)")
+            if evicted:
+                # Their last venv link is gone: the store copies are what still takes the space
+                prune_store()
+
+    def prefetch(self, jobs):
+        """Build the venvs of upcoming (compt, filename) jobs in the background"""
+        for compt, filename in jobs:
+            venv_name = venv_for(compt, filename)
+            with self.lock:
+                if venv_name is None or venv_name in self.queued or complete(venv_name):
+                    continue
+                self.queued.add(venv_name)
+            self.executor.submit(self._prefetch_one, venv_name)
+
+    def _prefetch_one(self, venv_name):
+        try:
+            self.build(venv_name, blocking=False)
+        except Exception as e:
+            print(f"Prefetching venv {venv_name} failed: {e}")
+        finally:
+            with self.lock:
+                self.queued.discard(venv_name)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for venv_name in list(self.pins):
+            while self.pins[venv_name]:
+                self.release(venv_name)
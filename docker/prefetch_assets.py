@@ -0,0 +1,211 @@
+"""
+Local asset cache for the pretrained files the notebooks download at run time; run it after
+baseline/search_assets.py (which writes baseline/assets.json) and before the runners.
+
+Every asset is fetched once on the host into ASSET_ROOT, one directory per library:
+    torch/        TORCH_HOME    torchvision and (older) timm weights
+    huggingface/  HF_HOME       HuggingFace checkpoints and (newer) timm weights
+    keras/        HOME          keras.applications weights, in keras/.keras/models
+    nltk_data/    NLTK_DATA     nltk corpora (on top of the ones preloaded in the image)
+    spacy/        PYTHONPATH    spacy model packages (installed without dependencies; set only if any)
+The runners mount ASSET_ROOT read-only at the same path and set the variables (asset_docker_args),
+so the libraries find the files locally instead of stalling on the download until the timeout.
+keras is the exception: it ignores a cache directory it cannot write to, so only its weights are
+mounted (read-only) into the writable ~/.keras of the container.
+
+    python docker/prefetch_assets.py [--jobs 4] [--min-count 1] [--kinds torchvision hf ...] [--retry]
+    python docker/prefetch_assets.py --check-keras IMAGE   # one keras.applications model, offline
+
+Each asset is fetched by the host python (it needs the library of its kind) in its own process.
+ASSET_ROOT/manifest.json records the outcome of every asset, so a rerun only fetches new assets
+(and, with --retry, the failed ones). The files follow the cache layout of the host's library
+versions: notebooks pinned to much older releases (e.g. transformers 2.x) may still miss them.
+ASSET_ROOT defaults to /opt/kaggle_assets (override with KAGGLE_ASSET_ROOT).
+"""
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+ASSET_ROOT = os.path.abspath(os.environ.get("KAGGLE_ASSET_ROOT", "/opt/kaggle_assets"))
+ASSETS_PATH = "baseline/assets.json"
+MANIFEST = "manifest.json"
+FETCH_TIMEOUT = 1800
+
+# Environment variable -> directory under ASSET_ROOT
+ASSET_DIRS = {"TORCH_HOME": "torch", "HF_HOME": "huggingface", "NLTK_DATA": "nltk_data"}
+SPACY_DIR = "spacy"
+# tf.keras and keras 2 cache in ~/.keras whatever KERAS_HOME says (keras 3 reads it): fetched with
+# HOME set to this directory, the weights land in KERAS_DIR/.keras/models for every keras version
+KERAS_DIR = "keras"
+# get_file falls back to /tmp/.keras when KERAS_HOME is not writable, so the container gets a
+# writable keras home (the kaggle images run the notebooks as root) with the weights mounted in it
+KERAS_CONTAINER_HOME = "/root/.keras"
+
+# Python run with the asset name as sys.argv[1], by kind (corpus.features.ASSET_PATTERNS)
+FETCH = {
+    "nltk": """
+import os, ssl, sys, nltk
+# as the corpora preloaded in the image: proxies or missing certs break the verified context
+ssl._create_default_https_context = ssl._create_unverified_context
+sys.exit(0 if nltk.download(sys.argv[1], download_dir=os.environ["NLTK_DATA"], quiet=True) else 1)
+""",
+    "torchvision": """
+import sys, torchvision.models as models
+build = getattr(models, sys.argv[1])
+try:
+    build(weights="IMAGENET1K_V1")   # the weights pretrained=True loads
+except (TypeError, ValueError):
+    build(pretrained=True)
+""",
+    "timm": """
+import sys, timm
+timm.create_model(sys.argv[1], pretrained=True)
+""",
+    "keras": """
+import sys
+try:
+    from tensorflow.keras import applications
+except ImportError:
+    from keras import applications
+getattr(applications, sys.argv[1])(weights="imagenet")
+""",
+    "spacy": """
+import sys
+from spacy.cli import download
+download(sys.argv[1])
+""",
+    "hf": """
+import sys
+from huggingface_hub import snapshot_download
+snapshot_download(sys.argv[1], ignore_patterns=["*.msgpack", "*.onnx", "*.ot", "*.tflite"])
+""",
+}
+
+
+def fetch_env():
+    env = dict(os.environ)
+    for var, sub in ASSET_DIRS.items():
+        env[var] = f"{ASSET_ROOT}/{sub}"
+    env["KERAS_HOME"] = f"{ASSET_ROOT}/{KERAS_DIR}/.keras"
+    # spacy.cli.download runs pip: model package only, into the spacy directory
+    env.update(PIP_TARGET=f"{ASSET_ROOT}/{SPACY_DIR}", PIP_NO_DEPS="1", PIP_DISABLE_PIP_VERSION_CHECK="1")
+    return env
+
+
+def fetch(kind, name, env):
+    """Download one asset into the cache; returns None on success, else the last line of its error output"""
+    try:
+        proc = subprocess.run([sys.executable, "-c", FETCH[kind], name], capture_output=True, text=True,
+                              env=env, timeout=FETCH_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return f"timeout after {FETCH_TIMEOUT} s"
+    if proc.returncode == 0:
+        return None
+    lines = (proc.stderr or proc.stdout).strip().splitlines()
+    return lines[-1] if lines else f"exit {proc.returncode}"
+
+
+def read_manifest():
+    """{kind: {name: None or error}} of the assets fetched so far"""
+    path = f"{ASSET_ROOT}/{MANIFEST}"
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def prefetch_assets(jobs=4, min_count=1, kinds=None, retry=False):
+    with open(ASSETS_PATH, "r", encoding="utf-8") as f:
+        assets = json.load(f)
+    manifest = read_manifest()
+    todo = []
+    for kind, names in assets.items():
+        if kind not in FETCH or (kinds and kind not in kinds):
+            continue
+        done = manifest.setdefault(kind, {})
+        todo += [(kind, name) for name, count in names.items()
+                 if count >= min_count and (name not in done or (retry and done[name] is not None))]
+    print(f"{sum(len(names) for names in manifest.values())} assets in {ASSET_ROOT}, {len(todo)} to fetch")
+
+    for sub in list(ASSET_DIRS.values()) + [SPACY_DIR, f"{KERAS_DIR}/.keras/models"]:
+        os.makedirs(f"{ASSET_ROOT}/{sub}", exist_ok=True)
+    env = fetch_env()
+    keras_env = dict(env, HOME=f"{ASSET_ROOT}/{KERAS_DIR}")
+    # pip --target replaces whole directories, so the spacy models are installed one at a time
+    spacy_lock = threading.Lock()
+
+    def run(task):
+        kind, name = task
+        if kind == "spacy":
+            with spacy_lock:
+                return kind, name, fetch(kind, name, env)
+        return kind, name, fetch(kind, name, keras_env if kind == "keras" else env)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for kind, name, error in tqdm(executor.map(run, todo), total=len(todo), desc="Fetching assets"):
+            manifest[kind][name] = error
+
+    with open(f"{ASSET_ROOT}/{MANIFEST}", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    for kind, names in sorted(manifest.items()):
+        failed = sum(error is not None for error in names.values())
+        print(f"{kind}: {len(names) - failed} cached, {failed} failed")
+    print(f"Errors are kept in {ASSET_ROOT}/{MANIFEST} (rerun with --retry to fetch them again)")
+
+
+def asset_docker_args():
+    """
+    docker run options mounting the asset cache read-only and pointing the libraries at it; "" until
+    prefetch_assets has run. Assets missing from the cache fail at once instead of waiting on the hub
+    """
+    if not os.path.exists(f"{ASSET_ROOT}/{MANIFEST}"):
+        return ""
+    opts = f" -v {ASSET_ROOT}:{ASSET_ROOT}:ro"
+    for var, sub in ASSET_DIRS.items():
+        opts += f" -e {var}={ASSET_ROOT}/{sub}"
+    opts += f" -v {ASSET_ROOT}/{KERAS_DIR}/.keras/models:{KERAS_CONTAINER_HOME}/models:ro"
+    opts += f" -e KERAS_HOME={KERAS_CONTAINER_HOME}"
+    opts += " -e HF_HUB_OFFLINE=1 -e TRANSFORMERS_OFFLINE=1"
+    # Only with models in it: PYTHONPATH replaces the one of the image
+    if os.listdir(f"{ASSET_ROOT}/{SPACY_DIR}"):
+        opts += f" -e PYTHONPATH={ASSET_ROOT}/{SPACY_DIR}"
+    return opts
+
+
+def check_keras(image):
+    """
+    Build one cached keras.applications model in the image without network, with the options of
+    the runners; the notebooks find the prefetched weights exactly when this passes
+    """
+    cached = sorted(name for name, error in read_manifest().get("keras", {}).items() if error is None)
+    if not cached:
+        raise SystemExit(f"No keras weights in {ASSET_ROOT} (python docker/prefetch_assets.py --kinds keras)")
+    cmd = ["docker", "run", "--rm", "--network", "none", *shlex.split(asset_docker_args()), image,
+           "python", "-c", FETCH["keras"], cached[0]]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        lines = (proc.stderr or proc.stdout).strip().splitlines()
+        raise SystemExit(f"{cached[0]} failed offline in {image}: {lines[-1] if lines else f'exit {proc.returncode}'}")
+    print(f"{cached[0]} loaded its imagenet weights offline from {KERAS_CONTAINER_HOME}/models in {image}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Fetch the pretrained assets of the notebooks into a local cache")
+    arg_parser.add_argument("--jobs", type=int, default=4, help="parallel downloads")
+    arg_parser.add_argument("--min-count", type=int, default=1, help="only assets used by at least this many notebooks")
+    arg_parser.add_argument("--kinds", nargs="*", default=None, choices=sorted(FETCH), help="only these kinds")
+    arg_parser.add_argument("--retry", action="store_true", help="fetch the failed assets again")
+    arg_parser.add_argument("--check-keras", metavar="IMAGE", help="only check that a cached keras.applications model "
+                                                                   "loads offline in IMAGE with the runners' mounts")
+    cli = arg_parser.parse_args()
+    if cli.check_keras:
+        check_keras(cli.check_keras)
+    else:
+        prefetch_assets(cli.jobs, cli.min_count, cli.kinds, cli.retry)
@@ -11,6 +11,10 @@ import shutil
 from pathlib import Path
 import re
 import select
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from docker.build_envs import env_docker_args
+from docker.prefetch_assets import asset_docker_args
 import threading
 import fcntl  # for file locking
 import traceback
@@ -203,9 +207,14 @@ def build_docker_command(k_token, temp_dir, compt, filename, gpu, dst):
     cmd += f' -v {dst}/prepared/public:/kaggle/data'
     cmd += f' -v {dst}/prepared/public:/kaggle/data/{compt}'
     cmd += "".join([f" -v {mount}" for mount in volume_mounts])
+    # Host-built venv of the kernel (docker/build_envs.py), if there is one
+    env_opts, kernel_opts = env_docker_args(compt, filename)
+    cmd += env_opts
+    # Pretrained weights and corpora fetched ahead of time (docker/prefetch_assets.py)
+    cmd += asset_docker_args()
     cmd += f" -w /kaggle/working kaggle/customized_{gpu}"
     # cmd += " -lc 'set -euxo pipefail; ls -la; cd ../input/rsna-2022-cervical-spine-fracture-detection; ls'"
-    cmd += f" jupyter nbconvert --to notebook --inplace --execute {filename} --ExecutePreprocessor.allow_errors=True --ExecutePreprocessor.timeout=-1"
+    cmd += f" jupyter nbconvert --to notebook --inplace --execute {filename} --ExecutePreprocessor.allow_errors=True --ExecutePreprocessor.timeout=-1{kernel_opts}"
     # cmd += f" timeout {timeout_seconds*1.1} jupyter nbconvert --to notebook --inplace --execute {filename} --ExecutePreprocessor.allow_errors=True --ExecutePreprocessor.timeout=-1"
     # cmd += f" python -Xfrozen_modules=off -m jupyter nbconvert --to notebook --stdout --execute {filename} --ExecutePreprocessor.allow_errors=True --ExecutePreprocessor.timeout=-1"
     
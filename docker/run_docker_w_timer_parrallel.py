@@ -11,6 +11,11 @@ import shutil
 from pathlib import Path
 import re
 import select
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from docker.build_envs import env_docker_args
+from docker.prefetch_assets import asset_docker_args
+from docker.env_cache import EnvCache, PREFETCH_AHEAD
 import threading
 import fcntl  # for file locking
 import traceback
@@ -203,9 +208,14 @@ def build_docker_command(k_token, temp_dir, compt, filename, gpu, dst):
     cmd += f' -v {dst}/prepared/public:/kaggle/data'
     cmd += f' -v {dst}/prepared/public:/kaggle/data/{compt}'
     cmd += "".join([f" -v {mount}" for mount in volume_mounts])
+    # Host-built venv of the kernel (docker/build_envs.py), if there is one
+    env_opts, kernel_opts = env_docker_args(compt, filename)
+    cmd += env_opts
+    # Pretrained weights and corpora fetched ahead of time (docker/prefetch_assets.py)
+    cmd += asset_docker_args()
     cmd += f" -w /kaggle/working kaggle/customized_{gpu}"
     # cmd += " -lc 'set -euxo pipefail; ls -la; cd ../input/rsna-2022-cervical-spine-fracture-detection; ls'"
-    cmd += f" jupyter nbconvert --to notebook --inplace --execute {filename} --ExecutePreprocessor.allow_errors=True --ExecutePreprocessor.timeout=-1"
+    cmd += f" jupyter nbconvert --to notebook --inplace --execute {filename} --ExecutePreprocessor.allow_errors=True --ExecutePreprocessor.timeout=-1{kernel_opts}"
     # cmd += f" timeout {timeout_seconds*1.1} jupyter nbconvert --to notebook --inplace --execute {filename} --ExecutePreprocessor.allow_errors=True --ExecutePreprocessor.timeout=-1"
     # cmd += f" python -Xfrozen_modules=off -m jupyter nbconvert --to notebook --stdout --execute {filename} --ExecutePreprocessor.allow_errors=True --ExecutePreprocessor.timeout=-1"
     
@@ -434,111 +444,126 @@ def process_gpu_files_separate(gpu_id, parrallel_groups, setting):
         all_files = [f for f in os.listdir(expected) if f.endswith('.ipynb')]
         parrallel_groups = [f for f in all_files if f.split("_")[0] in parrallel_groups]
 
+    # Venvs are materialized when their job comes up (docker/env_cache.py)
+    env_cache = EnvCache()
+
     # for filename in tqdm(os.listdir(expected)):
-    for filename in tqdm(parrallel_groups, desc=f"GPU {gpu_id}",
+    for position, filename in enumerate(tqdm(parrallel_groups, desc=f"GPU {gpu_id}",
                         position=gpu_id,  # Each GPU gets its own line
-                        leave=True):      # Keep bar visible after completion
+                        leave=True)):     # Keep bar visible after completion
         # print(f"\r\n{filename}", end='', flush=True)
-        p_time_start = time.time()
-
         parts = filename.split("_")
         compt = parts[0]
         notebook_name = "_".join(parts[1:-2])
         version = parts[-2]
         out_path = nb_out / compt / notebook_name / version
 
-        # Clear all outputs from the notebook file before processing
-        notebook_path = os.path.join(expected, filename)
-        if not clear_notebook_outputs(notebook_path):
-            print(f"Failed to clear outputs from {filename}")
+        # Pin this kernel's venv (built now if missing) and build the next ones while it runs;
+        # the build is recorded as venv_time, not as part of process_time
+        venv_start = time.time()
+        venv_name = env_cache.acquire(compt, filename)
+        venv_time = time.time() - venv_start
+        upcoming = parrallel_groups[position + 1:position + 1 + PREFETCH_AHEAD]
+        env_cache.prefetch((f.split("_")[0], f) for f in upcoming)
+        p_time_start = time.time()
+
+        try:
+            # Clear all outputs from the notebook file before processing
+            notebook_path = os.path.join(expected, filename)
+            if not clear_notebook_outputs(notebook_path):
+                print(f"Failed to clear outputs from {filename}")
         
-        # Create temporary working directory
-        temp_dir = tempfile.mkdtemp(prefix=f'gpu_{gpu_id}_')
-        shutil.copy2(os.path.join(expected, filename), temp_dir)
+            # Create temporary working directory
+            temp_dir = tempfile.mkdtemp(prefix=f'gpu_{gpu_id}_')
+            shutil.copy2(os.path.join(expected, filename), temp_dir)
 
-        subprocess.run([f'chmod -R a+rw {temp_dir}'], shell=True, check=True)
+            subprocess.run([f'chmod -R a+rw {temp_dir}'], shell=True, check=True)
 
-        # Snapshot before run (existing files)
-        before = set(Path(temp_dir).glob("*.csv"))
+            # Snapshot before run (existing files)
+            before = set(Path(temp_dir).glob("*.csv"))
 
 
-        upperdir = tempfile.mkdtemp(prefix=f'overlay_upper_{gpu_id}_')
-        workdir = tempfile.mkdtemp(prefix=f'overlay_work_{gpu_id}_')
-        dst = f'/home/b27jin/mle-bench-internal/tester/{filename.split(".")[0]}'
-        os.makedirs(dst, exist_ok=True)
+            upperdir = tempfile.mkdtemp(prefix=f'overlay_upper_{gpu_id}_')
+            workdir = tempfile.mkdtemp(prefix=f'overlay_work_{gpu_id}_')
+            dst = f'/home/b27jin/mle-bench-internal/tester/{filename.split(".")[0]}'
+            os.makedirs(dst, exist_ok=True)
 
 
-        try:
-            # sudo mount -t overlay overlay  -o lowerdir="/home/b27jin/mle-bench-internal/docker-test/test",upperdir="/tmp/overlay-upper",workdir="/tmp/overlay-work" .
-            subprocess.run([f'sudo mount -t overlay overlay -o lowerdir="/home/b27jin/.cache/mle-bench/data/{compt}",upperdir="{upperdir}",workdir="{workdir}" "{dst}"'], shell=True, check=True)
+            try:
+                # sudo mount -t overlay overlay  -o lowerdir="/home/b27jin/mle-bench-internal/docker-test/test",upperdir="/tmp/overlay-upper",workdir="/tmp/overlay-work" .
+                subprocess.run([f'sudo mount -t overlay overlay -o lowerdir="/home/b27jin/.cache/mle-bench/data/{compt}",upperdir="{upperdir}",workdir="{workdir}" "{dst}"'], shell=True, check=True)
 
-            # cleanup_cmd = f'docker ps -aq --filter "name=gpu_{gpu_id}_*" | xargs -r docker rm -f'
-            # subprocess.run([cleanup_cmd], shell=True, 
-            #             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            while not (os.path.exists(f"{dst}/prepared/public") and os.path.isdir(f"{dst}/prepared/public")):  # Ensure mount is ready
-                time.sleep(0.1)
+                # cleanup_cmd = f'docker ps -aq --filter "name=gpu_{gpu_id}_*" | xargs -r docker rm -f'
+                # subprocess.run([cleanup_cmd], shell=True, 
+                #             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                while not (os.path.exists(f"{dst}/prepared/public") and os.path.isdir(f"{dst}/prepared/public")):  # Ensure mount is ready
+                    time.sleep(0.1)
                 
-            cmd,container_name = build_docker_command(k_token, temp_dir, compt, filename, gpu_id, dst)
+                cmd,container_name = build_docker_command(k_token, temp_dir, compt, filename, gpu_id, dst)
             
-            # Run notebooks with timeout monitoring
-            runner = NotebookRunner(timeout_seconds)
-            result = runner.run_single_notebook(cmd, compt, filename)
-            results[filename] = result
+                # Run notebooks with timeout monitoring
+                runner = NotebookRunner(timeout_seconds)
+                result = runner.run_single_notebook(cmd, compt, filename)
+                results[filename] = result
 
-            # Move the nb file (w/ outputs) to expected directory
-            temp_notebook_path = os.path.join(temp_dir, filename)
+                # Move the nb file (w/ outputs) to expected directory
+                temp_notebook_path = os.path.join(temp_dir, filename)
 
-            # save nb back to new dir e.g., ./scripts_out
-            if not os.path.exists(out_path):
-                os.makedirs(out_path, exist_ok=True)
+                # save nb back to new dir e.g., ./scripts_out
+                if not os.path.exists(out_path):
+                    os.makedirs(out_path, exist_ok=True)
 
-            if os.path.exists(temp_notebook_path):
-                shutil.copy(temp_notebook_path, out_path)
-                shutil.copy(temp_notebook_path, './scripts_out_all')
+                if os.path.exists(temp_notebook_path):
+                    shutil.copy(temp_notebook_path, out_path)
+                    shutil.copy(temp_notebook_path, './scripts_out_all')
 
-            # Snapshot after run (detect new .csv files)
-            after = set(Path(temp_dir).glob("*.csv"))
+                # Snapshot after run (detect new .csv files)
+                after = set(Path(temp_dir).glob("*.csv"))
             
-            # save nb back to new dir e.g., scripts_out/
-            # scripts_out/{compt}/{username}/{version}/ (1) csv (2) notebook (3) json
-            new_csvs = after - before
-            # Move and rename new CSV files
-            for csv_path in new_csvs:
-                new_name = filename.rsplit(".", maxsplit=1)[0] + ".csv"
-                destination = os.path.join(out_path, new_name)
-                shutil.copy(str(csv_path), os.path.join(output_dir, new_name))
-                shutil.move(str(csv_path), str(destination))
-                results[filename]["output"] = f"{destination}"
-                results[filename]['status'] = 'csv_created'
-
-        except Exception as e:
-            results[filename]['error'] = str(traceback.format_exc())
-
-        # Cleanup temp dir
-        start = time.time()
-
-        subprocess.run([f'sudo umount {dst}'], shell=True, check=True)
-        subprocess.run([f'sudo rm -rf {temp_dir}'], shell=True, check=True)
-        subprocess.run([f'sudo rm -rf {upperdir}'], shell=True, check=True)
-        subprocess.run([f'sudo rm -rf {workdir}'], shell=True, check=True)
-
-        try:
-            subprocess.run([f'rm -rf {dst}'], shell=True, check=True)
-        except Exception as e:
-            subprocess.run([f'sudo umount -f {dst} 2>/dev/null || true'], shell=True)
-            subprocess.run([f'rm -rf {dst}'], shell=True)
-
-        end = time.time()
-        results[filename]['cleanup_time'] = end - start
-
-
-        subprocess.run([f'docker kill {container_name}'], shell=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.STDOUT)
+                # save nb back to new dir e.g., scripts_out/
+                # scripts_out/{compt}/{username}/{version}/ (1) csv (2) notebook (3) json
+                new_csvs = after - before
+                # Move and rename new CSV files
+                for csv_path in new_csvs:
+                    new_name = filename.rsplit(".", maxsplit=1)[0] + ".csv"
+                    destination = os.path.join(out_path, new_name)
+                    shutil.copy(str(csv_path), os.path.join(output_dir, new_name))
+                    shutil.move(str(csv_path), str(destination))
+                    results[filename]["output"] = f"{destination}"
+                    results[filename]['status'] = 'csv_created'
+
+            except Exception as e:
+                results[filename]['error'] = str(traceback.format_exc())
+
+            # Cleanup temp dir
+            start = time.time()
+
+            subprocess.run([f'sudo umount {dst}'], shell=True, check=True)
+            subprocess.run([f'sudo rm -rf {temp_dir}'], shell=True, check=True)
+            subprocess.run([f'sudo rm -rf {upperdir}'], shell=True, check=True)
+            subprocess.run([f'sudo rm -rf {workdir}'], shell=True, check=True)
+
+            try:
+                subprocess.run([f'rm -rf {dst}'], shell=True, check=True)
+            except Exception as e:
+                subprocess.run([f'sudo umount -f {dst} 2>/dev/null || true'], shell=True)
+                subprocess.run([f'rm -rf {dst}'], shell=True)
+
+            end = time.time()
+            results[filename]['cleanup_time'] = end - start
+
+
+            subprocess.run([f'docker kill {container_name}'], shell=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.STDOUT)
+        finally:
+            # Unpinned even if the cleanup fails, so the cache can evict the venv later in the run
+            env_cache.release(venv_name)
     
 
         p_time_end = time.time()
         results[filename]['process_time'] = p_time_end - p_time_start
+        results[filename]['venv_time'] = venv_time
 
         with open(out_path / 'result.json', 'w', encoding='utf-8') as f:
             json.dump(results[filename], f, indent=2, ensure_ascii=False)
@@ -548,6 +573,8 @@ def process_gpu_files_separate(gpu_id, parrallel_groups, setting):
             json.dump(results, file, indent=2, ensure_ascii=False)
             fcntl.flock(file.fileno(), fcntl.LOCK_UN)
 
+    env_cache.close()
+
 import multiprocessing as mp
 import sys
 if __name__ == "__main__":